@@ -3,9 +3,21 @@
 # This file configures the Django admin interface for your models.
 # ======================================================================
 
+from django import forms
 from django.contrib import admin
 from django.utils.html import format_html
-from .models import UserProfile, Entry, RewardItem, RedeemedPoints, Device, DeviceLog
+from .models import (
+    UserProfile,
+    Entry,
+    RewardItem,
+    RedeemedPoints,
+    Device,
+    DeviceLog,
+    DeviceLogRollup,
+    DeviceEvent,
+)
+from .device_auth import invalidate_api_key
+from . import liveness, school_ids
 import uuid
 
 # Register your models here so they appear in the admin interface
@@ -24,13 +36,13 @@ class UserProfileAdmin(admin.ModelAdmin):
         "id_generation_helper",
         "total_points",
         "qr_code_data",
-    )
-    readonly_fields = ("id_generation_helper",)
+    ) + UserProfile.STAT_FIELDS
+    readonly_fields = ("id_generation_helper",) + UserProfile.STAT_FIELDS
 
     def id_generation_helper(self, obj):
         """Display helper text for ID generation"""
         if obj.user_type == "student":
-            suggested_id = UserProfile.generate_school_id()
+            suggested_id = school_ids.peek("student")
             return format_html(
                 '<div style="background: #e7f3ff; padding: 10px; border-radius: 5px;">'
                 "<strong>📋 Student ID Format:</strong> C22-0369<br>"
@@ -41,7 +53,7 @@ class UserProfileAdmin(admin.ModelAdmin):
                 suggested_id,
             )
         elif obj.user_type == "teacher":
-            suggested_id = UserProfile.generate_faculty_id()
+            suggested_id = school_ids.peek("teacher")
             return format_html(
                 '<div style="background: #fff3e7; padding: 10px; border-radius: 5px;">'
                 "<strong>📋 Faculty ID Format:</strong> SMCIC-001-0001<br>"
@@ -69,12 +81,38 @@ class EntryAdmin(admin.ModelAdmin):
     date_hierarchy = "created_at"
 
 
+class RewardItemForm(forms.ModelForm):
+    class Meta:
+        model = RewardItem
+        fields = "__all__"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Post the stock shown when the page was loaded too, so "changed"
+        # means the admin edited it - not that redemptions took some since
+        self.fields["stock"].show_hidden_initial = True
+
+
 @admin.register(RewardItem)
 class RewardItemAdmin(admin.ModelAdmin):
-    list_display = ("reward_name", "points_required", "image")
-    list_filter = ("points_required",)
+    form = RewardItemForm
+    list_display = ("reward_name", "points_required", "stock", "is_active", "image")
+    list_filter = ("is_active", "points_required")
     search_fields = ("reward_name",)
 
+    def save_model(self, request, obj, form, change):
+        if change and "stock" not in form.changed_data:
+            # Leave the stock to ledger.redeem_reward's conditional UPDATEs
+            obj.save(
+                update_fields=[
+                    field.name
+                    for field in obj._meta.concrete_fields
+                    if not field.primary_key and field.name != "stock"
+                ]
+            )
+        else:
+            super().save_model(request, obj, form, change)
+
 
 @admin.register(RedeemedPoints)
 class RedeemedPointsAdmin(admin.ModelAdmin):
@@ -84,17 +122,36 @@ class RedeemedPointsAdmin(admin.ModelAdmin):
     date_hierarchy = "created_at"
 
 
+class LivenessFilter(admin.SimpleListFilter):
+    """Filter on derived liveness; the choices show the status rollup counts"""
+
+    title = "liveness"
+    parameter_name = "liveness"
+
+    def lookups(self, request, model_admin):
+        counts = liveness.status_counts()
+        return [
+            (status, f"{label} ({counts[status]})")
+            for status, label in Device.DEVICE_STATUS_CHOICES
+        ]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(live_status=self.value())
+        return queryset
+
+
 @admin.register(Device)
 class DeviceAdmin(admin.ModelAdmin):
     list_display = (
         "device_name",
         "device_id",
         "location",
-        "status",
+        "live_status",
         "total_bottles_processed",
         "last_heartbeat",
     )
-    list_filter = ("status", "created_at", "last_heartbeat")
+    list_filter = (LivenessFilter, "status", "created_at", "last_heartbeat")
     search_fields = ("device_name", "device_id", "location")
     readonly_fields = (
         "api_key",
@@ -104,11 +161,33 @@ class DeviceAdmin(admin.ModelAdmin):
         "updated_at",
     )
 
+    actions = ["regenerate_api_keys"]
+
+    def get_queryset(self, request):
+        return liveness.with_liveness(super().get_queryset(request))
+
+    @admin.display(description="Liveness", ordering="live_status")
+    def live_status(self, obj):
+        return obj.live_status
+
     def save_model(self, request, obj, form, change):
+        # Cached authentication is dropped by the Device post_save signal
         if not change:  # If creating a new device
             obj.api_key = str(uuid.uuid4())
         super().save_model(request, obj, form, change)
 
+    @admin.action(description="Regenerate API key for selected devices")
+    def regenerate_api_keys(self, request, queryset):
+        rotated = 0
+        for device in queryset:
+            old_api_key = device.api_key
+            device.api_key = str(uuid.uuid4())
+            device.save(update_fields=["api_key", "updated_at"])
+            # The old key must stop working immediately
+            invalidate_api_key(old_api_key)
+            rotated += 1
+        self.message_user(request, f"Regenerated API keys for {rotated} device(s).")
+
 
 @admin.register(DeviceLog)
 class DeviceLogAdmin(admin.ModelAdmin):
@@ -120,3 +199,25 @@ class DeviceLogAdmin(admin.ModelAdmin):
 
     def has_add_permission(self, request):
         return False  # Logs are created automatically, not manually
+
+
+@admin.register(DeviceLogRollup)
+class DeviceLogRollupAdmin(admin.ModelAdmin):
+    list_display = ("device", "period", "period_start", "log_type", "sort_result", "count")
+    list_filter = ("period", "log_type", "sort_result", "device")
+    readonly_fields = ("device", "period", "period_start", "log_type", "sort_result", "count")
+    date_hierarchy = "period_start"
+
+    def has_add_permission(self, request):
+        return False  # Built by "manage.py rollup_device_logs"
+
+
+@admin.register(DeviceEvent)
+class DeviceEventAdmin(admin.ModelAdmin):
+    list_display = ("event_key", "device", "status_code", "created_at")
+    list_filter = ("device", "status_code")
+    search_fields = ("event_key",)
+    readonly_fields = ("device", "event_key", "response", "status_code", "created_at")
+
+    def has_add_permission(self, request):
+        return False  # Recorded automatically when devices submit events
@@ -0,0 +1,78 @@
+# ======================================================================
+# core/auth_backends.py
+# Sign-in with a username, an ID number (any hyphen/case variant) or an
+# email address. The identifier is resolved to one user with a single
+# query and the password is checked exactly once, so a wrong password or
+# an ID-number login costs one password hash instead of up to three.
+# Unknown identifiers still pay one (dummy) hash, so response times don't
+# reveal which accounts exist.
+# ======================================================================
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.db.models import F, Q
+
+from .identity import normalize_identifier
+from .models import UserProfile
+
+MAX_CANDIDATES = 5
+
+
+def find_user(identifier):
+    """
+    The user ``identifier`` refers to, or None. Several accounts can match
+    (one's username is another's ID number); the first of these wins:
+    exact username, school ID, username of a profile without a school ID,
+    email address.
+    """
+    UserModel = get_user_model()
+    identifier = (identifier or "").strip()
+    if not identifier:
+        return None
+    key = normalize_identifier(identifier)
+    matches = Q(**{UserModel.USERNAME_FIELD: identifier})
+    if key is not None:
+        # A subquery rather than a join keeps every OR branch on an index
+        matches |= Q(
+            pk__in=UserProfile.objects.filter(identity_key=key).values("user_id")
+        )
+    if "@" in identifier:
+        matches |= Q(email=identifier)
+    candidates = list(
+        UserModel._default_manager.filter(matches).annotate(
+            profile_identity_key=F("profile__identity_key"),
+            profile_school_id=F("profile__school_id"),
+        )[:MAX_CANDIDATES]
+    )
+    if not candidates:
+        return None
+
+    def rank(user):
+        if user.get_username() == identifier:
+            return 0
+        if user.profile_identity_key == key:
+            return 1 if user.profile_school_id else 2
+        return 3
+
+    return min(candidates, key=rank)
+
+
+class IdentifierBackend(ModelBackend):
+    """
+    ModelBackend that accepts a username, ID number or email as the
+    username (login form and Django admin alike)
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(get_user_model().USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        user = find_user(username)
+        if user is None:
+            # Hash anyway so a miss takes as long as a wrong password
+            get_user_model()().set_password(password)
+            return None
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
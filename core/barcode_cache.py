@@ -0,0 +1,93 @@
+# ======================================================================
+# core/barcode_cache.py
+# Content-addressed cache of rendered barcode PNGs.
+# The key is a hash of the encoded data and the render options, so a
+# changed school ID or a new render version simply misses. The same hash
+# is the HTTP ETag, which lets generate_qr_code_view answer 304s without
+# rendering anything.
+# Storage is the Django cache (bounded by the backend's own eviction) or,
+# when BARCODE_CACHE_DIR is set, a directory trimmed to
+# BARCODE_CACHE_MAX_BYTES by evicting the least recently used files.
+# ======================================================================
+
+import hashlib
+import os
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .utils import generate_barcode_buffer
+
+# Bump when generate_barcode_buffer's output changes
+RENDER_VERSION = 1
+CACHE_KEY = "barcode:{}"
+
+
+def digest(school_id, include_text=True):
+    """Hash of everything that determines the rendered image"""
+    data = school_id.replace("-", "")
+    source = f"{RENDER_VERSION}|code128|{data}|{int(include_text)}"
+    return hashlib.sha256(source.encode()).hexdigest()
+
+
+def _directory():
+    directory = getattr(settings, "BARCODE_CACHE_DIR", None)
+    return Path(directory) if directory else None
+
+
+def _read(key):
+    directory = _directory()
+    if directory is None:
+        return cache.get(CACHE_KEY.format(key))
+    path = directory / key[:2] / f"{key}.png"
+    try:
+        data = path.read_bytes()
+    except FileNotFoundError:
+        return None
+    os.utime(path)  # Mark as recently used
+    return data
+
+
+def _write(key, data):
+    directory = _directory()
+    if directory is None:
+        cache.set(
+            CACHE_KEY.format(key), data, getattr(settings, "BARCODE_CACHE_TTL", 604800)
+        )
+        return
+    path = directory / key[:2] / f"{key}.png"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_suffix(f".{os.getpid()}.tmp")
+    temporary.write_bytes(data)
+    os.replace(temporary, path)  # Readers never see a partial file
+    _evict(directory)
+
+
+def _evict(directory):
+    """Delete least recently used files until the directory fits its budget"""
+    limit = getattr(settings, "BARCODE_CACHE_MAX_BYTES", 50 * 1024 * 1024)
+    files = []
+    total = 0
+    for path in directory.glob("*/*.png"):
+        stat = path.stat()
+        files.append((stat.st_mtime, stat.st_size, path))
+        total += stat.st_size
+    if total <= limit:
+        return
+    files.sort()
+    for _, size, path in files:
+        if total <= limit * 0.9:  # Leave headroom so we don't evict on every write
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+
+
+def get_png(school_id, include_text=True):
+    """Return the barcode PNG bytes for ``school_id``, rendering only on a miss"""
+    key = digest(school_id, include_text)
+    data = _read(key)
+    if data is None:
+        data = generate_barcode_buffer(school_id, include_text).getvalue()
+        _write(key, data)
+    return data
@@ -0,0 +1,121 @@
+# ======================================================================
+# core/counters.py
+# Materialized global totals for the landing page and dashboards.
+# The ledger bumps them in the same transaction as the balance change,
+# and signals keep the user counts current, so pages read a handful of
+# rows instead of summing Entry/RedeemedPoints/UserProfile on every load.
+# reconcile() rebuilds every counter from the source tables.
+# ======================================================================
+
+from django.contrib.auth.models import User
+from django.db import models, transaction
+from django.db.models import Case, F, Sum, Value, When
+
+from .models import Entry, GlobalCounter, RedeemedPoints, UserProfile
+
+USERS = "users"  # UserProfile rows
+STAFF_USERS = "staff_users"  # Profiles whose user is_staff
+BOTTLES = "bottles"  # Sum of Entry.no_bottle
+POINTS_EARNED = "points_earned"  # Sum of Entry.points
+POINTS_REDEEMED = "points_redeemed"  # Sum of RedeemedPoints.redeemed_points
+POINTS_BALANCE = "points_balance"  # Sum of UserProfile.total_points
+
+NAMES = (USERS, STAFF_USERS, BOTTLES, POINTS_EARNED, POINTS_REDEEMED, POINTS_BALANCE)
+
+
+def bump(**deltas):
+    """Add ``deltas`` (counter name -> amount) to the counters in one UPDATE"""
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    if len(deltas) == 1:
+        (name, delta), = deltas.items()
+        increment = Value(delta)
+    else:
+        increment = Case(
+            *(When(name=name, then=Value(delta)) for name, delta in deltas.items()),
+            output_field=models.BigIntegerField(),
+        )
+    updated = GlobalCounter.objects.filter(name__in=deltas).update(
+        value=F("value") + increment
+    )
+    if updated < len(deltas):
+        # Rows missing (fresh table): create them; reconcile() fixes the totals
+        existing = set(
+            GlobalCounter.objects.filter(name__in=deltas).values_list("name", flat=True)
+        )
+        GlobalCounter.objects.bulk_create(
+            [
+                GlobalCounter(name=name, value=delta)
+                for name, delta in deltas.items()
+                if name not in existing
+            ],
+            ignore_conflicts=True,
+        )
+
+
+def get_many(*names):
+    """Return ``{name: value}`` for ``names`` (all counters if none given)"""
+    names = names or NAMES
+    values = dict.fromkeys(names, 0)
+    values.update(
+        GlobalCounter.objects.filter(name__in=names).values_list("name", "value")
+    )
+    return values
+
+
+def compute():
+    """Recompute every counter from the source tables"""
+    profiles = UserProfile.objects.aggregate(
+        users=models.Count("pk"),
+        staff_users=models.Count("pk", filter=models.Q(user__is_staff=True)),
+        points_balance=Sum("total_points"),
+    )
+    entries = Entry.objects.aggregate(
+        bottles=Sum("no_bottle"), points_earned=Sum("points")
+    )
+    redeemed = RedeemedPoints.objects.aggregate(points_redeemed=Sum("redeemed_points"))
+    return {
+        name: value or 0
+        for name, value in {**profiles, **entries, **redeemed}.items()
+    }
+
+
+def reconcile():
+    """
+    Rebuild every counter from scratch. Returns ``{name: (old, new)}``.
+    Counter rows are locked first so concurrent deposits wait rather than
+    bumping a value that is about to be overwritten.
+    """
+    with transaction.atomic():
+        old = dict.fromkeys(NAMES, 0)
+        old.update(
+            GlobalCounter.objects.select_for_update().values_list("name", "value")
+        )
+        new = compute()
+        for name in NAMES:
+            GlobalCounter.objects.update_or_create(
+                name=name, defaults={"value": new[name]}
+            )
+    return {name: (old[name], new[name]) for name in NAMES}
+
+
+def profile_saved(profile, created, points_before):
+    """Signal hook: count new profiles and direct edits of total_points"""
+    deltas = {POINTS_BALANCE: profile.total_points - points_before}
+    if created:
+        deltas[USERS] = 1
+        deltas[STAFF_USERS] = 1 if profile.user.is_staff else 0
+    bump(**deltas)
+
+
+def profile_deleted(profile):
+    """Signal hook: remove a deleted profile from the totals"""
+    is_staff = User.objects.filter(pk=profile.user_id, is_staff=True).exists()
+    bump(
+        **{
+            USERS: -1,
+            STAFF_USERS: -1 if is_staff else 0,
+            POINTS_BALANCE: -profile.total_points,
+        }
+    )
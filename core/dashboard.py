@@ -0,0 +1,154 @@
+# ======================================================================
+# core/dashboard.py
+# Data service for admin_dashboard_view.
+# Each widget is built with at most one query per table (grouped or
+# conditional aggregation) and cached for DASHBOARD_CACHE_TTL seconds.
+# Widgets that change rarely (devices, rewards) are also invalidated by
+# signals; the activity widgets change with every bottle and simply
+# expire with the TTL. Device status is the derived liveness from
+# core/liveness.py, not the last reported status.
+# ======================================================================
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, FilteredRelation, Q, Sum
+from django.utils import timezone
+
+from . import counters, liveness
+from .models import DeviceLog, Entry, RedeemedPoints, UserProfile
+
+WIDGET_KEY = "dashboard:{}"
+
+
+def _ttl():
+    return getattr(settings, "DASHBOARD_CACHE_TTL", 30)
+
+
+def _week_ago():
+    return timezone.now() - timedelta(days=7)
+
+
+def _totals():
+    totals = counters.get_many()
+    users = totals[counters.USERS]
+    return {
+        "total_users": users,
+        "student_users": users - totals[counters.STAFF_USERS],
+        "faculty_users": totals[counters.STAFF_USERS],
+        "total_bottles": totals[counters.BOTTLES],
+        "total_points_earned": totals[counters.POINTS_EARNED],
+        "total_points_redeemed": totals[counters.POINTS_REDEEMED],
+        "avg_points_per_user": round(
+            totals[counters.POINTS_BALANCE] / users if users else 0, 1
+        ),
+    }
+
+
+def _activity():
+    return {
+        "recent_deposits": Entry.objects.filter(created_at__gte=_week_ago()).count(),
+        "recent_transactions": list(
+            Entry.objects.select_related("user_profile__user").order_by("-created_at")[
+                :10
+            ]
+        ),
+        "top_recyclers": list(
+            UserProfile.objects.select_related("user").order_by("-total_points")[:5]
+        ),
+    }
+
+
+def _rewards():
+    # One grouped query gives both the per-reward breakdown and, summed,
+    # the number of redemptions in the last week
+    stats = list(
+        RedeemedPoints.objects.values("reward_item__reward_name")
+        .annotate(
+            count=Count("id"),
+            total_points=Sum("redeemed_points"),
+            recent=Count("id", filter=Q(created_at__gte=_week_ago())),
+        )
+        .order_by("-count")
+    )
+    return {
+        "reward_stats": stats[:5],
+        "recent_redemptions": sum(row["recent"] for row in stats),
+    }
+
+
+def _devices():
+    # The device table is small: fetch every device once with its recent
+    # plastic detections and derive the liveness counts from the same rows.
+    # The conditions go into the JOIN so only last week's logs are read.
+    devices = list(
+        liveness.with_liveness()
+        .annotate(
+            recent_logs=FilteredRelation(
+                "devicelog",
+                condition=Q(
+                    devicelog__created_at__gte=_week_ago(),
+                    devicelog__log_type="bottle_detected",
+                    devicelog__sort_result="plastic",
+                ),
+            )
+        )
+        .annotate(recent_bottles=Count("recent_logs"))
+        .order_by("-total_bottles_processed")
+    )
+    by_status = dict.fromkeys(liveness.STATUSES, 0)
+    for device in devices:
+        by_status[device.live_status] += 1
+    return {
+        "total_devices": len(devices),
+        "online_devices": by_status["online"],
+        "offline_devices": by_status["offline"],
+        "error_devices": by_status["error"],
+        "maintenance_devices": by_status["maintenance"],
+        "device_performance": devices[:5],
+    }
+
+
+def _device_logs():
+    return {
+        "recent_device_logs": list(
+            DeviceLog.objects.select_related("device").order_by("-created_at")[:10]
+        )
+    }
+
+
+WIDGETS = {
+    "totals": _totals,
+    "activity": _activity,
+    "rewards": _rewards,
+    "devices": _devices,
+    "device_logs": _device_logs,
+}
+
+
+def get_context():
+    """Return the admin dashboard context, building only the expired widgets"""
+    keys = {WIDGET_KEY.format(name): name for name in WIDGETS}
+    cached = cache.get_many(keys.keys())
+    context = {}
+    missing = {}
+    for key, name in keys.items():
+        if key in cached:
+            context.update(cached[key])
+        else:
+            missing[key] = WIDGETS[name]()
+            context.update(missing[key])
+    if missing:
+        cache.set_many(missing, _ttl())
+    return context
+
+
+def invalidate(*names):
+    """Drop the named widgets (all if none given) so the next load rebuilds them"""
+    cache.delete_many([WIDGET_KEY.format(name) for name in names or WIDGETS])
+
+
+async def ainvalidate(*names):
+    """Async version of invalidate"""
+    await cache.adelete_many([WIDGET_KEY.format(name) for name in names or WIDGETS])
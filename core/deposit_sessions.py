@@ -0,0 +1,105 @@
+# ======================================================================
+# core/deposit_sessions.py
+# Short-lived deposit sessions. api_user_verify opens one when a student
+# scans their ID and returns its token; the device then sends that token
+# with every bottle, so detections credit the already-resolved profile
+# without any identity lookup. Closing the session writes one summary
+# DeviceLog row instead of one "bottle_sorted" row per bottle.
+# ======================================================================
+
+import secrets
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import DeviceLog
+
+SESSION_KEY = "deposit_session:{}"
+
+
+def session_ttl():
+    """Seconds a deposit session stays open after its last bottle"""
+    return getattr(settings, "DEPOSIT_SESSION_TTL", 300)
+
+
+def _new_session(device, profile):
+    return {
+        "device": device.pk,
+        "profile": profile.pk,
+        "username": profile.user.username,
+        "bottles": 0,
+        "points": 0,
+        "opened_at": timezone.now().isoformat(),
+    }
+
+
+def open_session(device, profile):
+    """Start a deposit session for ``profile`` on ``device`` and return its token"""
+    token = secrets.token_urlsafe(16)
+    cache.set(SESSION_KEY.format(token), _new_session(device, profile), session_ttl())
+    return token
+
+
+async def aopen_session(device, profile):
+    """Async version of open_session"""
+    token = secrets.token_urlsafe(16)
+    await cache.aset(
+        SESSION_KEY.format(token), _new_session(device, profile), session_ttl()
+    )
+    return token
+
+
+def _check(device, session):
+    # A token is only valid on the device that opened it
+    if session is None or session["device"] != device.pk:
+        return None
+    return session
+
+
+def get_session(device, token):
+    """Return the session for ``token`` if it is open on ``device``, else None"""
+    if not token:
+        return None
+    return _check(device, cache.get(SESSION_KEY.format(token)))
+
+
+async def aget_session(device, token):
+    """Async version of get_session"""
+    if not token:
+        return None
+    return _check(device, await cache.aget(SESSION_KEY.format(token)))
+
+
+def add_bottles(token, session, bottles, points):
+    """Add credited bottles to the session tally and extend its lifetime"""
+    session["bottles"] += bottles
+    session["points"] += points
+    cache.set(SESSION_KEY.format(token), session, session_ttl())
+
+
+def close_session(device, token):
+    """
+    End the session and write its single summary log row.
+    Returns the final session tally or None if it was not open.
+    """
+    session = get_session(device, token)
+    if session is None:
+        return None
+    cache.delete(SESSION_KEY.format(token))
+    if session["bottles"]:
+        DeviceLog.objects.create(
+            device=device,
+            log_type="bottle_sorted",
+            sort_result="plastic",
+            sensor_data={
+                "bottles": session["bottles"],
+                "points": session["points"],
+                "opened_at": session["opened_at"],
+            },
+            message=(
+                f"Deposit session: {session['bottles']} bottle(s), "
+                f"{session['points']} points awarded to {session['username']}"
+            ),
+        )
+    return session
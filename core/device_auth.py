@@ -0,0 +1,147 @@
+# ======================================================================
+# core/device_auth.py
+# Cached api_key -> Device lookup used by every device API request.
+# A small in-process TTL/LRU cache sits in front of the shared Django
+# cache, which sits in front of the database. Unknown keys are cached
+# too (negative caching) so a misconfigured board cannot hammer the DB.
+# Entries are invalidated from Device save/delete (see core/signals.py)
+# and from the admin key-rotation path. Other processes' in-process
+# entries are revoked through a generation number in the shared cache,
+# checked on every lookup, so a rotated key stops working everywhere at
+# once.
+# ======================================================================
+
+import copy
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Device
+
+MISSING = "__missing__"  # Negative-cache marker for unknown keys
+GENERATION_KEY = "device_auth:generation"
+
+_local = OrderedDict()  # cache key -> (expires_at, generation, device or MISSING)
+_lock = threading.Lock()
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _cache_key(api_key):
+    # Hash the key so raw credentials never end up in cache keys
+    return "device_auth:" + hashlib.sha256(api_key.encode()).hexdigest()
+
+
+def _local_get(key, generation):
+    with _lock:
+        item = _local.get(key)
+        if item is None:
+            return None
+        if item[0] < time.monotonic() or item[1] != generation:
+            del _local[key]
+            return None
+        _local.move_to_end(key)
+        return item[2]
+
+
+def _local_set(key, value, ttl, generation):
+    with _lock:
+        _local[key] = (time.monotonic() + ttl, generation, value)
+        _local.move_to_end(key)
+        while len(_local) > _setting("DEVICE_AUTH_LOCAL_SIZE", 256):
+            _local.popitem(last=False)
+
+
+def _shared_ttl(value):
+    if value == MISSING:
+        return _setting("DEVICE_AUTH_NEGATIVE_TTL", 30)
+    return _setting("DEVICE_AUTH_CACHE_TTL", 300)
+
+
+def _remember_locally(key, value, generation):
+    if value == MISSING:
+        ttl = _setting("DEVICE_AUTH_NEGATIVE_TTL", 30)
+    else:
+        ttl = _setting("DEVICE_AUTH_LOCAL_TTL", 30)
+    _local_set(key, value, ttl, generation)
+
+
+def _result(value):
+    if value == MISSING:
+        return None
+    # Views mutate and save the device, so never hand out the shared instance
+    # (nor its dirty-field snapshot, which save() updates in place)
+    device = copy.copy(value)
+    if getattr(value, "_loaded_values", None) is not None:
+        device._loaded_values = dict(value._loaded_values)
+    return device
+
+
+def get_device_by_api_key(api_key):
+    """Return the Device for ``api_key`` or None, hitting the DB at most once per TTL"""
+    if not api_key:
+        return None
+    key = _cache_key(api_key)
+    generation = cache.get(GENERATION_KEY, 0)
+
+    value = _local_get(key, generation)
+    if value is None:
+        value = cache.get(key)
+        if value is None:
+            try:
+                value = Device.objects.get(api_key=api_key)
+            except Device.DoesNotExist:
+                value = MISSING
+            cache.set(key, value, _shared_ttl(value))
+        _remember_locally(key, value, generation)
+    return _result(value)
+
+
+async def aget_device_by_api_key(api_key):
+    """Async version of get_device_by_api_key for the ASGI device endpoints"""
+    if not api_key:
+        return None
+    key = _cache_key(api_key)
+    generation = await cache.aget(GENERATION_KEY, 0)
+
+    value = _local_get(key, generation)
+    if value is None:
+        value = await cache.aget(key)
+        if value is None:
+            try:
+                value = await Device.objects.aget(api_key=api_key)
+            except Device.DoesNotExist:
+                value = MISSING
+            await cache.aset(key, value, _shared_ttl(value))
+        _remember_locally(key, value, generation)
+    return _result(value)
+
+
+def invalidate_api_key(*api_keys, revoke=True):
+    """
+    Forget cached lookups (positive or negative) for the given keys. With
+    ``revoke`` (a key was rotated or deleted) every process also drops its
+    in-process entries; without it they may serve the old Device data for
+    up to DEVICE_AUTH_LOCAL_TTL seconds.
+    """
+    keys = [_cache_key(api_key) for api_key in api_keys if api_key]
+    if not keys:
+        return
+    with _lock:
+        for key in keys:
+            _local.pop(key, None)
+    cache.delete_many(keys)
+    if not revoke:
+        return
+    # Revoke what other processes hold in memory
+    cache.add(GENERATION_KEY, 0, None)
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:  # Evicted between add() and incr()
+        cache.set(GENERATION_KEY, 1, None)
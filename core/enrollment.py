@@ -0,0 +1,287 @@
+# ======================================================================
+# core/enrollment.py
+# Bulk account import from CSV/XLSX enrollment lists.
+# The whole file is validated before anything is written. Passwords are
+# hashed in a process pool (the slow part, see core/password_pool.py),
+# school IDs are reserved per user type in one statement, and User and
+# UserProfile rows are inserted with bulk_create, which sends no post_save
+# signals - so the counters and the identifier index are updated here once
+# for the whole batch instead.
+# Used by "manage.py import_users" and the staff console upload page.
+# ======================================================================
+
+import csv
+import io
+import re
+import uuid
+from dataclasses import dataclass, field
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from . import counters, dashboard, school_ids, sequences
+from .identity import known_identifiers, normalize_identifier
+from .models import UserProfile
+from .password_pool import hash_passwords
+
+COLUMNS = (
+    "username",
+    "password",
+    "first_name",
+    "last_name",
+    "email",
+    "user_type",
+    "school_id",
+)
+USER_TYPES = ("student", "teacher", "staff")
+STAFF_TYPES = ("teacher", "staff")  # Same rule as admin_user_add_view
+ALLOCATED_TYPES = ("student", "teacher")  # Get a school ID when none is given
+# Letters, digits and hyphens (C22-0369, SMCIC-001-0001, hand-made IDs)
+SCHOOL_ID_PATTERN = re.compile(r"^[A-Z0-9]+(-[A-Z0-9]+)*$")
+
+# Columns checked with the model field's own validators (lengths, the
+# username characters, email syntax) so the database never rejects a row
+FIELD_COLUMNS = (
+    (User, "username"),
+    (User, "first_name"),
+    (User, "last_name"),
+    (User, "email"),
+    (UserProfile, "school_id"),
+)
+
+
+class ImportFileError(Exception):
+    """The file can't be read at all (format, missing columns)"""
+
+
+@dataclass
+class ImportRow:
+    line: int
+    username: str
+    password: str = ""
+    first_name: str = ""
+    last_name: str = ""
+    email: str = ""
+    user_type: str = "student"
+    school_id: str = ""
+
+
+@dataclass
+class ImportResult:
+    rows: list = field(default_factory=list)
+    errors: list = field(default_factory=list)  # (line, message)
+    created: int = 0
+
+
+def read_rows(fileobj, filename):
+    """Yield ``{column: value}`` dicts (keys lower-cased) from a CSV or XLSX file"""
+    if filename.lower().endswith(".xlsx"):
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise ImportFileError(
+                "Install openpyxl to import .xlsx files, or upload a CSV"
+            )
+        sheet = load_workbook(fileobj, read_only=True, data_only=True).active
+        rows = sheet.iter_rows(values_only=True)
+        header = [str(name or "").strip().lower() for name in next(rows, ())]
+        for values in rows:
+            yield {
+                name: "" if value is None else str(value).strip()
+                for name, value in zip(header, values)
+            }
+        return
+    text = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+    reader = csv.DictReader(text)
+    if reader.fieldnames is None:
+        return
+    reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+    for values in reader:
+        yield {name: (value or "").strip() for name, value in values.items() if name}
+
+
+def validate(records):
+    """Check every row against the file and the database. Returns an ImportResult."""
+    result = ImportResult()
+    usernames = {}
+    ids = {}
+    keys = {}
+    for line, record in enumerate(records, 2):  # Line 1 is the header
+        if line == 2 and "username" not in record:
+            raise ImportFileError("The file needs a 'username' column")
+        if not any(record.values()):
+            continue
+        row = ImportRow(
+            line=line,
+            **{name: record.get(name, "") for name in COLUMNS},
+        )
+        row.user_type = (row.user_type or "student").lower()
+        row.school_id = row.school_id.upper()
+
+        invalid = _field_errors(row)
+        result.errors.extend((line, message) for message in invalid)
+        if not row.username:
+            result.errors.append((line, "Username is required"))
+        elif row.username in usernames:
+            first = usernames[row.username]
+            result.errors.append((line, f"Username {row.username} repeats line {first}"))
+        else:
+            usernames[row.username] = line
+        if row.user_type not in USER_TYPES:
+            result.errors.append((line, f"Unknown user type {row.user_type}"))
+        if row.school_id:
+            if not SCHOOL_ID_PATTERN.match(row.school_id):
+                result.errors.append(
+                    (line, f"School ID {row.school_id} may only contain letters, "
+                           "digits and single hyphens")
+                )
+            if row.school_id in ids:
+                first = ids[row.school_id]
+                result.errors.append(
+                    (line, f"School ID {row.school_id} repeats line {first}")
+                )
+            else:
+                ids[row.school_id] = line
+
+        # The key card scans and ID logins resolve (see core/identity.py):
+        # 'C22-0369' and 'C220369' are the same person, so it must be unique.
+        # Rows that will be allocated an ID get a fresh one from the sequence.
+        key = None
+        if row.school_id or row.user_type not in ALLOCATED_TYPES:
+            key = normalize_identifier(row.school_id or row.username)
+        if key is not None and not invalid:
+            if key in keys:
+                first = keys[key]
+                result.errors.append(
+                    (line, f"ID {row.school_id or row.username} is the same as line {first}")
+                )
+            else:
+                keys[key] = line
+        result.rows.append(row)
+
+    # Clashes with existing accounts, a chunk of lookups at a time
+    clashes = set()
+    for taken in _existing(User.objects, "username", list(usernames)):
+        clashes.add(usernames[taken])
+        result.errors.append((usernames[taken], f"Username {taken} already exists"))
+    for taken in _existing(UserProfile.objects, "school_id", list(ids)):
+        clashes.add(ids[taken])
+        result.errors.append((ids[taken], f"School ID {taken} is already assigned"))
+    for taken in _existing(UserProfile.objects, "identity_key", list(keys)):
+        if keys[taken] not in clashes:  # Already reported above
+            result.errors.append(
+                (keys[taken], f"ID {taken} already belongs to another account")
+            )
+    result.errors.sort()
+    return result
+
+
+def _field_errors(row):
+    """Messages for the columns the model fields would reject"""
+    messages = []
+    for model, name in FIELD_COLUMNS:
+        value = getattr(row, name)
+        if not value:
+            continue
+        field = model._meta.get_field(name)
+        try:
+            field.run_validators(value)
+        except ValidationError as e:
+            messages.append(f"{field.verbose_name.capitalize()}: {' '.join(e.messages)}")
+    return messages
+
+
+def _existing(manager, field_name, values, chunk=900):
+    for start in range(0, len(values), chunk):
+        yield from manager.filter(
+            **{f"{field_name}__in": values[start : start + chunk]}
+        ).values_list(field_name, flat=True)
+
+
+def create_accounts(rows, default_password=None, batch_size=1000, workers=None):
+    """
+    Create validated rows. Rows without a password get ``default_password``
+    (hashed once and shared), or an unusable password. Returns the count.
+    """
+    own = [row for row in rows if row.password]
+    hashed = hash_passwords([row.password for row in own], workers)
+    passwords = {row.line: password for row, password in zip(own, hashed)}
+    if len(own) < len(rows):
+        shared = make_password(default_password or None)
+        for row in rows:
+            passwords.setdefault(row.line, shared)
+
+    with transaction.atomic():
+        # Reserve the missing school IDs, one block per user type
+        for user_type in ("student", "teacher"):
+            needing = [
+                row for row in rows if row.user_type == user_type and not row.school_id
+            ]
+            if needing:
+                allocated = school_ids.allocate(user_type, len(needing))
+                for row, school_id in zip(needing, allocated):
+                    row.school_id = school_id
+        # ... and move the sequences past the IDs given in the file
+        highest = {}
+        for row in rows:
+            position = school_ids.sequence_position(row.school_id)
+            if position is not None:
+                name, number = position
+                highest[name] = max(highest.get(name, 0), number)
+        for name, number in highest.items():
+            sequences.advance_to(name, number)
+
+        users = User.objects.bulk_create(
+            [
+                User(
+                    username=row.username,
+                    password=passwords[row.line],
+                    first_name=row.first_name,
+                    last_name=row.last_name,
+                    email=row.email,
+                    is_staff=row.user_type in STAFF_TYPES,
+                )
+                for row in rows
+            ],
+            batch_size=batch_size,
+        )
+        if users and users[0].pk is None:  # Backend can't return bulk insert keys
+            created = User.objects.filter(username__in=[row.username for row in rows])
+            by_name = dict(created.values_list("username", "pk"))
+            for user in users:
+                user.pk = by_name[user.username]
+
+        UserProfile.objects.bulk_create(
+            [
+                UserProfile(
+                    user_id=user.pk,
+                    user_type=row.user_type,
+                    school_id=row.school_id or None,
+                    # Same values as admin_user_add_view / the profile signal
+                    qr_code_data=row.school_id
+                    or f"SMC-USER-{row.username}-{str(uuid.uuid4())[:8]}",
+                    identity_key=normalize_identifier(row.school_id or row.username),
+                )
+                for user, row in zip(users, rows)
+            ],
+            batch_size=batch_size,
+        )
+        counters.bump(
+            **{
+                counters.USERS: len(users),
+                counters.STAFF_USERS: sum(user.is_staff for user in users),
+            }
+        )
+        transaction.on_commit(known_identifiers.invalidate)
+        transaction.on_commit(lambda: dashboard.invalidate("totals"))
+    return len(users)
+
+
+def import_file(fileobj, filename, default_password=None, dry_run=False, **options):
+    """Validate ``fileobj`` and, if it is clean, create every account in it"""
+    result = validate(read_rows(fileobj, filename))
+    if not result.errors and result.rows and not dry_run:
+        result.created = create_accounts(result.rows, default_password, **options)
+    return result
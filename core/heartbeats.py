@@ -0,0 +1,142 @@
+# ======================================================================
+# core/heartbeats.py
+# Write-behind buffer for device heartbeats.
+# The latest heartbeat of every device lives in the cache (latest state
+# wins). It is written to Device.last_heartbeat/status at most once per
+# HEARTBEAT_FLUSH_INTERVAL, and a heartbeat DeviceLog row is only stored
+# when the reported status or sensor state actually changes.
+# ======================================================================
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from . import dashboard
+from .models import Device, DeviceLog
+
+STATE_KEY = "heartbeat:state:{}"
+STATE_TIMEOUT = 60 * 60 * 24  # Keep buffered state for a day
+
+
+def _flush_interval():
+    return timedelta(seconds=getattr(settings, "HEARTBEAT_FLUSH_INTERVAL", 60))
+
+
+def _write(device_pk, state):
+    """Persist buffered state with a narrow UPDATE of the two heartbeat columns"""
+    Device.objects.filter(pk=device_pk).update(
+        status=state["status"], last_heartbeat=state["last_seen"]
+    )
+    state["flushed_at"] = state["last_seen"]
+
+
+def _next_state(previous, status, sensor_data, now):
+    """
+    Work out the new buffered state for a heartbeat.
+    Returns ``(state, changed, write_through)``.
+    """
+    if previous is None:
+        # Nothing buffered (first ping, restart or eviction): the previous
+        # sensor state is unknown, so treat it as a change.
+        changed = True
+        flushed_at = None
+    else:
+        changed = (
+            previous["status"] != status or previous["sensor_data"] != sensor_data
+        )
+        flushed_at = previous["flushed_at"]
+
+    state = {
+        "status": status,
+        "sensor_data": sensor_data,
+        "last_seen": now,
+        "flushed_at": flushed_at,
+    }
+    write_through = (
+        changed or flushed_at is None or now - flushed_at >= _flush_interval()
+    )
+    if write_through:
+        state["flushed_at"] = now
+    return state, changed, write_through
+
+
+def _log_fields(device, state):
+    return {
+        "device": device,
+        "log_type": "heartbeat",
+        "sensor_data": state["sensor_data"],
+        "message": f"Device {device.device_name} heartbeat ({state['status']})",
+    }
+
+
+def record_heartbeat(device, status, sensor_data=None, now=None):
+    """
+    Buffer a heartbeat for ``device``.
+    Returns True when the heartbeat changed state and was written through.
+    """
+    now = now or timezone.now()
+    key = STATE_KEY.format(device.pk)
+    state, changed, write_through = _next_state(
+        cache.get(key), status, sensor_data, now
+    )
+
+    if write_through:
+        _write(device.pk, state)
+        device.status = status
+        device.last_heartbeat = now
+    if changed:
+        DeviceLog.objects.create(**_log_fields(device, state))
+        dashboard.invalidate("devices")
+
+    cache.set(key, state, STATE_TIMEOUT)
+    return changed
+
+
+async def arecord_heartbeat(device, status, sensor_data=None, now=None):
+    """Async version of record_heartbeat for the ASGI device endpoints"""
+    now = now or timezone.now()
+    key = STATE_KEY.format(device.pk)
+    state, changed, write_through = _next_state(
+        await cache.aget(key), status, sensor_data, now
+    )
+
+    if write_through:
+        await Device.objects.filter(pk=device.pk).aupdate(
+            status=status, last_heartbeat=now
+        )
+        device.status = status
+        device.last_heartbeat = now
+    if changed:
+        await DeviceLog.objects.acreate(**_log_fields(device, state))
+        await dashboard.ainvalidate("devices")
+
+    await cache.aset(key, state, STATE_TIMEOUT)
+    return changed
+
+
+def forget(device):
+    """Drop buffered state so the next heartbeat is written through"""
+    cache.delete(STATE_KEY.format(device.pk))
+
+
+async def aforget(device):
+    """Async version of forget"""
+    await cache.adelete(STATE_KEY.format(device.pk))
+
+
+def flush_pending():
+    """Write every buffered heartbeat newer than its last flush. Returns count."""
+    device_pks = list(Device.objects.values_list("pk", flat=True))
+    keys = {STATE_KEY.format(pk): pk for pk in device_pks}
+    states = cache.get_many(keys.keys())
+
+    flushed = 0
+    for key, state in states.items():
+        if state["flushed_at"] is not None and state["last_seen"] <= state["flushed_at"]:
+            continue
+        _write(keys[key], state)
+        cache.set(key, state, STATE_TIMEOUT)
+        flushed += 1
+    return flushed
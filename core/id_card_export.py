@@ -0,0 +1,257 @@
+# ======================================================================
+# core/id_card_export.py
+# Bulk ID card export for enrollment: print-ready A4 sheets of ten cards,
+# rendered in a process pool and written one sheet at a time as a ZIP of
+# PNG pages or a multi-page PDF, so memory stays at a few sheets whatever
+# the size of the batch.
+# Used by "manage.py export_id_cards" and by the staff console, which runs
+# the export in a background thread and serves the finished file from
+# ID_CARD_EXPORT_DIR.
+# ======================================================================
+
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import id_cards
+from .models import UserProfile
+
+FORMATS = ("zip", "pdf")
+CONTENT_TYPES = {"zip": "application/zip", "pdf": "application/pdf"}
+JOB_KEY = "idcard-export:{}"
+JOB_TTL = 24 * 3600
+
+# A4 in PDF points
+PAGE_WIDTH, PAGE_HEIGHT = 595.28, 841.89
+
+
+def select_cards(user_type=None, id_prefix=None, user_ids=None):
+    """
+    ``(full_name, school_id)`` for every profile with a school ID matching
+    the filters, in school ID order
+    """
+    profiles = UserProfile.objects.exclude(school_id__isnull=True).exclude(school_id="")
+    if user_type:
+        profiles = profiles.filter(user_type=user_type)
+    if id_prefix:
+        profiles = profiles.filter(school_id__startswith=id_prefix)
+    if user_ids:
+        profiles = profiles.filter(user_id__in=user_ids)
+    rows = profiles.order_by("school_id").values_list(
+        "user__first_name", "user__last_name", "user__username", "school_id"
+    )
+    return [
+        ((f"{first} {last}".strip() or username).upper(), school_id)
+        for first, last, username, school_id in rows
+    ]
+
+
+def _workers(workers=None):
+    if workers is None:
+        workers = getattr(settings, "ID_CARD_EXPORT_WORKERS", 0)
+    return workers or os.cpu_count() or 1
+
+
+def render_sheets(cards, page_format, workers=None):
+    """
+    Yield encoded sheets in order. With more than one worker, at most two
+    sheets per worker are in flight so finished pages never pile up.
+    """
+    workers = _workers(workers)
+    batches = (
+        cards[start : start + id_cards.CARDS_PER_SHEET]
+        for start in range(0, len(cards), id_cards.CARDS_PER_SHEET)
+    )
+    sheet_format = "pdf" if page_format == "pdf" else "png"
+    if workers <= 1:
+        for batch in batches:
+            yield id_cards.sheet_bytes(batch, sheet_format)
+        return
+    # Spawned workers only import core.id_cards: no Django, no inherited
+    # database connections or threads
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        pending = deque()
+        for batch in batches:
+            pending.append(executor.submit(id_cards.sheet_bytes, batch, sheet_format))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class _CountingWriter:
+    """Tracks the byte offset of a write-only stream (PDF xref needs it)"""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.offset = 0
+
+    def write(self, data):
+        self.fileobj.write(data)
+        self.offset += len(data)
+
+
+def write_pdf(sheets, fileobj):
+    """Write one full-page image per sheet as a PDF. Returns the page count."""
+    out = _CountingWriter(fileobj)
+    offsets = {}
+
+    def obj(number, body, stream=None):
+        offsets[number] = out.offset
+        out.write(f"{number} 0 obj\n".encode() + body)
+        if stream is not None:
+            out.write(b"\nstream\n" + stream + b"\nendstream")
+        out.write(b"\nendobj\n")
+
+    out.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    obj(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+    width, height = id_cards.SHEET_SIZE
+    draw = f"q {PAGE_WIDTH} 0 0 {PAGE_HEIGHT} 0 0 cm /Sheet Do Q".encode()
+    pages = []
+    number = 3
+    for sheet in sheets:
+        image, content, page = number, number + 1, number + 2
+        number += 3
+        obj(
+            image,
+            (
+                f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} "
+                f"/ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /FlateDecode "
+                f"/Length {len(sheet)} >>"
+            ).encode(),
+            sheet,
+        )
+        obj(content, f"<< /Length {len(draw)} >>".encode(), draw)
+        obj(
+            page,
+            (
+                f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+                f"/Resources << /XObject << /Sheet {image} 0 R >> >> "
+                f"/Contents {content} 0 R >>"
+            ).encode(),
+        )
+        pages.append(page)
+    kids = " ".join(f"{page} 0 R" for page in pages)
+    obj(2, f"<< /Type /Pages /Kids [{kids}] /Count {len(pages)} >>".encode())
+
+    xref = out.offset
+    out.write(f"xref\n0 {number}\n0000000000 65535 f \n".encode())
+    for index in range(1, number):
+        out.write(f"{offsets[index]:010d} 00000 n \n".encode())
+    out.write(
+        f"trailer\n<< /Size {number} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    )
+    return len(pages)
+
+
+def write_zip(sheets, fileobj):
+    """Write each sheet as sheet-NNNN.png. Returns the page count."""
+    count = 0
+    # PNGs are already compressed
+    with zipfile.ZipFile(fileobj, "w", zipfile.ZIP_STORED) as archive:
+        for count, sheet in enumerate(sheets, 1):
+            archive.writestr(f"sheet-{count:04d}.png", sheet)
+    return count
+
+
+def export(cards, page_format, fileobj, workers=None, progress=None):
+    """Render ``cards`` and write them to ``fileobj``. Returns the page count."""
+    if page_format not in FORMATS:
+        raise ValueError(f"Unknown export format: {page_format}")
+    sheets = render_sheets(cards, page_format, workers)
+    if progress is not None:
+        sheets = _reporting(sheets, progress)
+    writer = write_pdf if page_format == "pdf" else write_zip
+    return writer(sheets, fileobj)
+
+
+def _reporting(sheets, progress):
+    for done, sheet in enumerate(sheets, 1):
+        yield sheet
+        progress(done)
+
+
+# ----------------------------------------------------------------------
+# Background jobs for the staff console
+# ----------------------------------------------------------------------
+
+
+def _directory():
+    return Path(
+        getattr(settings, "ID_CARD_EXPORT_DIR", None)
+        or Path(settings.BASE_DIR) / "exports" / "id_cards"
+    )
+
+
+def path(job_id, page_format):
+    return _directory() / f"{job_id}.{page_format}"
+
+
+def _prune(directory):
+    """Drop exports nobody downloaded within a day"""
+    cutoff = time.time() - JOB_TTL
+    for old in directory.glob("*.*"):
+        if old.stat().st_mtime < cutoff:
+            old.unlink(missing_ok=True)
+
+
+def start(cards, page_format, workers=None):
+    """Export in a background thread. Returns the job ID for ``status()``."""
+    if page_format not in FORMATS:
+        raise ValueError(f"Unknown export format: {page_format}")
+    job_id = uuid.uuid4().hex
+    directory = _directory()
+    directory.mkdir(parents=True, exist_ok=True)
+    _prune(directory)
+    sheets = -(-len(cards) // id_cards.CARDS_PER_SHEET)
+    job = {
+        "state": "running",
+        "format": page_format,
+        "cards": len(cards),
+        "sheets": sheets,
+        "done": 0,
+    }
+    cache.set(JOB_KEY.format(job_id), job, JOB_TTL)
+
+    def progress(done):
+        cache.set(JOB_KEY.format(job_id), {**job, "done": done}, JOB_TTL)
+
+    def run():
+        target = path(job_id, page_format)
+        partial = target.with_suffix(".part")
+        try:
+            with open(partial, "wb") as fileobj:
+                export(cards, page_format, fileobj, workers, progress)
+            os.replace(partial, target)  # Only finished files are downloadable
+            cache.set(
+                JOB_KEY.format(job_id), {**job, "state": "done", "done": sheets}, JOB_TTL
+            )
+        except Exception as e:
+            partial.unlink(missing_ok=True)
+            cache.set(
+                JOB_KEY.format(job_id), {**job, "state": "failed", "error": str(e)}, JOB_TTL
+            )
+
+    threading.Thread(target=run, name=f"idcard-export-{job_id}", daemon=True).start()
+    return job_id
+
+
+def status(job_id):
+    """The job's progress, or None if it is unknown"""
+    job = cache.get(JOB_KEY.format(job_id))
+    if job is None:
+        # Another process may have run it (per-process caches): trust the disk
+        for page_format in FORMATS:
+            if path(job_id, page_format).exists():
+                return {"state": "done", "format": page_format}
+    return job
@@ -0,0 +1,181 @@
+# ======================================================================
+# core/id_cards.py
+# ID card renderer.
+# Fonts are resolved once per process and the static part of the card
+# (blue header, school name) is drawn once into a base template that each
+# card copies. The barcode is drawn straight from its Code 128 modules at
+# whole-pixel bar widths, so there is no intermediate PNG and no resample.
+# Cards are also laid out on printable A4 sheets for bulk export (see
+# core/id_card_export.py). Nothing here touches Django, so export worker
+# processes can import it without setting up the project.
+# ======================================================================
+
+import threading
+import zlib
+from functools import lru_cache
+from io import BytesIO
+
+import barcode
+from PIL import Image, ImageDraw, ImageFont
+
+WIDTH, HEIGHT = 1012, 638
+HEADER_COLOR = "#1e40af"
+BARCODE_SIZE = (600, 120)
+BARCODE_TOP = 400
+PNG_COMPRESS_LEVEL = 1
+QUIET_MODULES = 10  # Same margin as generate_barcode_buffer's 3mm quiet zone
+
+# 1012x638 is a CR80 card at 300 dpi; an A4 page at 300 dpi holds 2 x 5
+SHEET_SIZE = (2480, 3508)
+SHEET_COLUMNS, SHEET_ROWS = 2, 5
+CARDS_PER_SHEET = SHEET_COLUMNS * SHEET_ROWS
+CUT_LINE_COLOR = "#cbd5e1"
+
+FONT_CANDIDATES = (
+    "arial.ttf",
+    "Arial.ttf",
+    "DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
+    "/usr/share/fonts/dejavu/DejaVuSans.ttf",
+    "/Library/Fonts/Arial.ttf",
+    "C:/Windows/Fonts/arial.ttf",
+)
+FONT_SIZES = {"title": 40, "name": 50, "info": 30}
+
+_template_lock = threading.Lock()
+_template = None
+
+
+@lru_cache(maxsize=None)
+def font(role):
+    """The font for ``role`` ("title", "name" or "info"), loaded once"""
+    size = FONT_SIZES[role]
+    for path in FONT_CANDIDATES:
+        try:
+            return ImageFont.truetype(path, size)
+        except OSError:
+            continue
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:  # Pillow < 10.1 has no scalable default font
+        return ImageFont.load_default()
+
+
+def base_template():
+    """The card with everything that doesn't depend on the user drawn in"""
+    global _template
+    if _template is None:
+        with _template_lock:
+            if _template is None:
+                card = Image.new("RGB", (WIDTH, HEIGHT), "white")
+                draw = ImageDraw.Draw(card)
+                draw.rectangle([(0, 0), (WIDTH, 150)], fill=HEADER_COLOR)
+                draw.text(
+                    (WIDTH // 2, 50),
+                    "St. Michael's College",
+                    fill="white",
+                    font=font("title"),
+                    anchor="mm",
+                )
+                draw.text(
+                    (WIDTH // 2, 100),
+                    "Iligan City",
+                    fill="white",
+                    font=font("info"),
+                    anchor="mm",
+                )
+                _template = card
+    return _template
+
+
+def barcode_image(school_id, size=BARCODE_SIZE):
+    """Code 128 barcode for ``school_id`` drawn directly at ``size`` (mode "L")"""
+    data = school_id.replace("-", "")
+    modules = barcode.get_barcode_class("code128")(data).build()[0]
+    width, height = size
+    total = len(modules) + 2 * QUIET_MODULES
+    # Whole-pixel modules keep every bar crisp; centre what's left over
+    module = max(1, width // total)
+    row = bytearray(b"\xff" * width)
+    x = (width - module * len(modules)) // 2
+    for bit in modules:
+        if bit == "1" and 0 <= x and x + module <= width:
+            row[x : x + module] = b"\x00" * module
+        x += module
+    return Image.frombytes("L", (width, 1), bytes(row)).resize(
+        (width, height), Image.NEAREST
+    )
+
+
+def render(full_name, school_id):
+    """Return the card as a PIL image"""
+    card = base_template().copy()
+    draw = ImageDraw.Draw(card)
+    draw.text(
+        (WIDTH // 2, 250), full_name, fill=HEADER_COLOR, font=font("name"), anchor="mm"
+    )
+    draw.text(
+        (WIDTH // 2, 320),
+        f"ID: {school_id}",
+        fill="black",
+        font=font("info"),
+        anchor="mm",
+    )
+    card.paste(barcode_image(school_id), ((WIDTH - BARCODE_SIZE[0]) // 2, BARCODE_TOP))
+    return card
+
+
+def card_details(user):
+    """``(full_name, school_id)`` as printed on the user's card"""
+    school_id = user.profile.school_id or "NO-ID"
+    full_name = f"{user.first_name} {user.last_name}".strip() or user.username
+    return full_name.upper(), school_id
+
+
+def encode(card):
+    """PNG buffer for a rendered card"""
+    buffer = BytesIO()
+    # Encoding dominates once drawing is cheap; the card is mostly flat
+    # colour, so the fastest zlib level costs little in size
+    card.save(buffer, format="PNG", compress_level=PNG_COMPRESS_LEVEL)
+    buffer.seek(0)
+    return buffer
+
+
+def render_png(user):
+    """PNG buffer of the user's card, ready to stream"""
+    return encode(render(*card_details(user)))
+
+
+def _slots():
+    """Top-left corner of every card position on a sheet, row by row"""
+    sheet_width, sheet_height = SHEET_SIZE
+    gap_x = (sheet_width - SHEET_COLUMNS * WIDTH) // (SHEET_COLUMNS + 1)
+    gap_y = (sheet_height - SHEET_ROWS * HEIGHT) // (SHEET_ROWS + 1)
+    return [
+        (gap_x + column * (WIDTH + gap_x), gap_y + row * (HEIGHT + gap_y))
+        for row in range(SHEET_ROWS)
+        for column in range(SHEET_COLUMNS)
+    ]
+
+
+def render_sheet(cards):
+    """Lay up to CARDS_PER_SHEET ``(full_name, school_id)`` cards on an A4 page"""
+    sheet = Image.new("RGB", SHEET_SIZE, "white")
+    draw = ImageDraw.Draw(sheet)
+    for (x, y), details in zip(_slots(), cards):
+        sheet.paste(render(*details), (x, y))
+        draw.rectangle([(x - 1, y - 1), (x + WIDTH, y + HEIGHT)], outline=CUT_LINE_COLOR)
+    return sheet
+
+
+def sheet_bytes(cards, page_format):
+    """
+    One encoded sheet: a PNG for "png", or zlib-compressed RGB samples
+    ready to embed as a PDF image stream for "pdf". Runs in export workers.
+    """
+    sheet = render_sheet(cards)
+    if page_format == "pdf":
+        return zlib.compress(sheet.tobytes(), PNG_COMPRESS_LEVEL)
+    return encode(sheet).getvalue()
@@ -0,0 +1,78 @@
+# ======================================================================
+# core/idempotency.py
+# Exactly-once processing of device submissions. Devices send an
+# "event_id" (or a "seq" number, optionally with a "boot_id") with each
+# POST; the first request claims the key in the DeviceEvent table and
+# stores its response, and retries get that response back without
+# touching Entry, UserProfile or DeviceLog again.
+# ======================================================================
+
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import JsonResponse
+from django.utils import timezone
+
+from .models import DeviceEvent
+
+
+def event_id_from(data, request=None):
+    """Read the client-supplied event id from the payload or Idempotency-Key header"""
+    event_id = data.get("event_id") if isinstance(data, dict) else None
+    if not event_id and isinstance(data, dict) and data.get("seq") is not None:
+        # A sequence number restarts at 0 after a reboot, so include the
+        # boot id when the firmware sends one
+        event_id = f"{data.get('boot_id', 'seq')}:{data['seq']}"
+    if not event_id and request is not None:
+        event_id = request.headers.get("Idempotency-Key")
+    return str(event_id)[:150] if event_id else None
+
+
+def run_once(device, event_id, handler):
+    """
+    Call ``handler()`` (which returns a JsonResponse) at most once per event.
+    Without an event id the handler simply runs.
+    """
+    if not event_id:
+        return handler()
+
+    event_key = f"{device.pk if device else 'legacy'}:{event_id}"
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                event = DeviceEvent.objects.create(device=device, event_key=event_key)
+        except IntegrityError:
+            # Already processed (or being processed and now committed)
+            event = DeviceEvent.objects.get(event_key=event_key)
+            response = JsonResponse(event.response, status=event.status_code)
+            response["X-Idempotent-Replay"] = "true"
+            return response
+
+        response = handler()
+        if response.status_code >= 400:
+            # Failed attempts must stay retryable
+            event.delete()
+        else:
+            event.response = json.loads(response.content)
+            event.status_code = response.status_code
+            event.save(update_fields=["response", "status_code"])
+        return response
+
+
+def prune_events(batch_size=1000):
+    """Delete DeviceEvent rows older than DEVICE_EVENT_RETENTION_HOURS. Returns count."""
+    cutoff = timezone.now() - timedelta(
+        hours=getattr(settings, "DEVICE_EVENT_RETENTION_HOURS", 48)
+    )
+    deleted = 0
+    while True:
+        pks = list(
+            DeviceEvent.objects.filter(created_at__lt=cutoff).values_list(
+                "pk", flat=True
+            )[:batch_size]
+        )
+        if not pks:
+            return deleted
+        deleted += DeviceEvent.objects.filter(pk__in=pks).delete()[0]
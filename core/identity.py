@@ -0,0 +1,214 @@
+# ======================================================================
+# core/identity.py
+# Resolves scanned barcodes/QR codes, typed ID numbers and legacy
+# qr_code_data values to a UserProfile with a single indexed query.
+# Unknown codes are answered from an in-memory set of known identifiers
+# and a short per-device negative cache, without touching the database.
+# ======================================================================
+
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+
+from .models import UserProfile
+
+GENERATION_KEY = "identity:generation"
+MISS_KEY = "identity:miss:{}:{}:{}"
+
+
+def normalize_identifier(code):
+    """Case-fold and strip hyphens/whitespace: 'c22-0369 ' -> 'C220369'"""
+    if not code:
+        return None
+    return "".join(code.split()).replace("-", "").upper() or None
+
+
+def resolve_profile(code):
+    """
+    Return ``(profile, lookup_method)`` for ``code`` or ``(None, None)``.
+
+    Matches the normalized school ID (so 'C22-0369', 'C220369' and 'c22-0369'
+    are the same), the username of profiles without a school ID, and the
+    legacy qr_code_data value - all in one query.
+    """
+    queryset = _candidates(code)
+    if queryset is None:
+        return None, None
+    return _best_match(list(queryset), code)
+
+
+async def aresolve_profile(code):
+    """Async version of resolve_profile for the ASGI device endpoints"""
+    queryset = _candidates(code)
+    if queryset is None:
+        return None, None
+    return _best_match([profile async for profile in queryset], code)
+
+
+def resolve_profiles(codes):
+    """
+    Resolve several codes at once (batch detections) with one query.
+    Returns ``{code: profile}`` for the codes that matched.
+    """
+    keys = {}
+    for code in codes:
+        key = normalize_identifier(code)
+        if key is not None:
+            keys[code] = key
+    if not keys:
+        return {}
+    raw = {code.strip() for code in keys} | {code.strip().upper() for code in keys}
+    candidates = list(
+        UserProfile.objects.select_related("user").filter(
+            Q(identity_key__in=set(keys.values())) | Q(qr_code_data__in=raw)
+        )
+    )
+    resolved = {}
+    for code, key in keys.items():
+        matches = [
+            profile
+            for profile in candidates
+            if profile.identity_key == key
+            or profile.qr_code_data in (code.strip(), code.strip().upper())
+        ]
+        profile, _ = _best_match(matches, code)
+        if profile is not None:
+            resolved[code] = profile
+    return resolved
+
+
+def _candidates(code):
+    key = normalize_identifier(code)
+    if key is None:
+        return None
+    code = code.strip()
+    return UserProfile.objects.select_related("user").filter(
+        Q(identity_key=key) | Q(qr_code_data__in={code, code.upper()})
+    )[:5]
+
+
+def _best_match(candidates, code):
+    if not candidates:
+        return None, None
+    code = code.strip().upper()
+    key = normalize_identifier(code)
+
+    def rank(profile):
+        if profile.school_id and profile.school_id.upper() == code:
+            return 0, "school_id"
+        if profile.identity_key == key and profile.school_id:
+            return 1, "school_id_normalized"
+        if profile.identity_key == key:
+            return 2, "username"
+        return 3, "qr_code_data"
+
+    profile = min(candidates, key=lambda candidate: rank(candidate)[0])
+    return profile, rank(profile)[1]
+
+
+class KnownIdentifiers:
+    """
+    Process-local set of every normalized identifier that could resolve.
+
+    It may contain stale entries (a deleted user) but never misses a live
+    one: profile saves add their keys incrementally, and a generation number
+    in the shared cache makes other workers rebuild after bulk changes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = None
+        self._generation = None
+        self._built_at = 0.0
+
+    def _stale(self, generation):
+        max_age = getattr(settings, "IDENTITY_INDEX_MAX_AGE", 300)
+        return (
+            self._keys is None
+            or generation != self._generation
+            or time.monotonic() - self._built_at > max_age
+        )
+
+    def _rebuild(self, generation):
+        keys = set()
+        rows = UserProfile.objects.values_list("identity_key", "qr_code_data")
+        for identity_key, qr_code_data in rows.iterator(chunk_size=2000):
+            keys.add(identity_key)
+            keys.add(normalize_identifier(qr_code_data))
+        keys.discard(None)
+        self._keys = keys
+        self._generation = generation
+        self._built_at = time.monotonic()
+
+    def might_exist(self, key):
+        generation = cache.get(GENERATION_KEY, 0)
+        with self._lock:
+            if self._stale(generation):
+                self._rebuild(generation)
+            return key in self._keys
+
+    def add(self, profile):
+        """Record a saved profile's identifiers (called once the save commits)"""
+        with self._lock:
+            if self._keys is not None:
+                self._keys.add(profile.identity_key)
+                self._keys.add(normalize_identifier(profile.qr_code_data))
+                self._keys.discard(None)
+        self._bump_generation()
+
+    def invalidate(self):
+        """Force every worker to rebuild (use after bulk_create/bulk_update)"""
+        with self._lock:
+            self._keys = None
+        self._bump_generation()
+
+    def _bump_generation(self):
+        cache.add(GENERATION_KEY, 0, None)
+        try:
+            generation = cache.incr(GENERATION_KEY)
+        except ValueError:  # Evicted between add() and incr()
+            cache.set(GENERATION_KEY, 1, None)
+            generation = 1
+        with self._lock:
+            # Only adopt the new generation if nobody else changed it meanwhile
+            if self._keys is not None and self._generation == generation - 1:
+                self._generation = generation
+
+
+known_identifiers = KnownIdentifiers()
+
+
+def is_cached_miss(device, key):
+    """True if ``device`` recently scanned ``key`` and it did not resolve"""
+    generation = cache.get(GENERATION_KEY, 0)
+    return cache.get(MISS_KEY.format(device.pk, generation, key)) is not None
+
+
+async def ais_cached_miss(device, key):
+    """Async version of is_cached_miss"""
+    generation = await cache.aget(GENERATION_KEY, 0)
+    return await cache.aget(MISS_KEY.format(device.pk, generation, key)) is not None
+
+
+def remember_miss(device, key):
+    """Negatively cache an unknown code for this device; keyed by generation so
+    a newly added profile makes the entry unreachable immediately"""
+    generation = cache.get(GENERATION_KEY, 0)
+    cache.set(
+        MISS_KEY.format(device.pk, generation, key),
+        True,
+        getattr(settings, "IDENTITY_NEGATIVE_TTL", 30),
+    )
+
+
+async def aremember_miss(device, key):
+    """Async version of remember_miss"""
+    generation = await cache.aget(GENERATION_KEY, 0)
+    await cache.aset(
+        MISS_KEY.format(device.pk, generation, key),
+        True,
+        getattr(settings, "IDENTITY_NEGATIVE_TTL", 30),
+    )
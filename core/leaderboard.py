@@ -0,0 +1,212 @@
+# ======================================================================
+# core/leaderboard.py
+# Student leaderboards: all-time (UserProfile.total_points) plus weekly
+# and monthly windows (LeaderboardScore rows bumped on every deposit).
+# Each process keeps a sorted snapshot per window, rebuilt from the
+# indexed tables every LEADERBOARD_SNAPSHOT_TTL seconds and patched in
+# place by local deposits, so "top N" is a slice and "my rank" is a
+# binary search.
+# ======================================================================
+
+import threading
+import time
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import Entry, LeaderboardScore, UserProfile
+
+PERIODS = ("all", "week", "month")
+WINDOWS = ("week", "month")
+
+_snapshots = {}  # period -> _Snapshot
+_lock = threading.Lock()
+
+
+def period_start(period, now=None):
+    """First local day of the window containing ``now`` (None for all-time)"""
+    today = timezone.localdate(now)
+    if period == "week":
+        return today - timedelta(days=today.weekday())
+    if period == "month":
+        return today.replace(day=1)
+    return None
+
+
+class _Snapshot:
+    """Scores sorted best first: ``keys`` holds (-score, pk) pairs"""
+
+    def __init__(self, start, rows):
+        self.start = start
+        self.built = time.monotonic()
+        self.scores = dict(rows)
+        self.keys = sorted((-score, pk) for pk, score in rows)
+
+    def set_score(self, pk, score):
+        old = self.scores.get(pk)
+        if old is not None:
+            del self.keys[bisect_left(self.keys, (-old, pk))]
+        self.scores[pk] = score
+        insort(self.keys, (-score, pk))
+
+    def rank(self, score):
+        # Users with the same score share a rank
+        return bisect_left(self.keys, (-score, 0)) + 1
+
+
+def _load(period, start):
+    if period == "all":
+        rows = UserProfile.objects.filter(user__is_staff=False).values_list(
+            "pk", "total_points"
+        )
+    else:
+        rows = LeaderboardScore.objects.filter(
+            period=period,
+            period_start=start,
+            user_profile__user__is_staff=False,
+        ).values_list("user_profile_id", "points")
+    return _Snapshot(start, list(rows))
+
+
+def _snapshot(period):
+    start = period_start(period)
+    ttl = getattr(settings, "LEADERBOARD_SNAPSHOT_TTL", 60)
+    snapshot = _snapshots.get(period)
+    if (
+        snapshot is None
+        or snapshot.start != start
+        or time.monotonic() - snapshot.built > ttl
+    ):
+        snapshot = _load(period, start)
+        with _lock:
+            _snapshots[period] = snapshot
+    return snapshot
+
+
+def top(period="all", limit=10):
+    """Best ``limit`` students of the window, each with a ``score`` attribute"""
+    snapshot = _snapshot(period)
+    with _lock:
+        leaders = [(pk, -score) for score, pk in snapshot.keys[:limit]]
+    profiles = UserProfile.objects.select_related("user").in_bulk(
+        [pk for pk, _ in leaders]
+    )
+    result = []
+    for pk, score in leaders:
+        profile = profiles.get(pk)
+        if profile is not None:
+            profile.score = score
+            result.append(profile)
+    return result
+
+
+def rank(profile, period="all"):
+    """
+    ``{"rank", "total", "top_percent", "points"}`` for ``profile`` in the
+    window, or None if the student has no points in it.
+    """
+    snapshot = _snapshot(period)
+    with _lock:
+        score = snapshot.scores.get(profile.pk)
+        if score is None or (period != "all" and not score):
+            return None
+        position = snapshot.rank(score)
+        total = len(snapshot.keys)
+    return {
+        "rank": position,
+        "total": total,
+        "top_percent": max(1, round(100 * position / total)),
+        "points": score,
+    }
+
+
+def record(profile_id, points, balance, now=None):
+    """Add deposit points to the profile's weekly and monthly scores"""
+    starts = {period: period_start(period, now) for period in WINDOWS}
+    if connection.features.supports_update_conflicts_with_target:
+        # One upsert statement for both windows
+        table = connection.ops.quote_name(LeaderboardScore._meta.db_table)
+        sql = (
+            f"INSERT INTO {table} (period, period_start, user_profile_id, points) "
+            f"VALUES (%s, %s, %s, %s), (%s, %s, %s, %s) "
+            f"ON CONFLICT (period, period_start, user_profile_id) "
+            f"DO UPDATE SET points = {table}.points + excluded.points"
+        )
+        params = []
+        for period, start in starts.items():
+            params += [period, start, profile_id, points]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+    else:
+        for period, start in starts.items():
+            score, created = LeaderboardScore.objects.get_or_create(
+                period=period,
+                period_start=start,
+                user_profile_id=profile_id,
+                defaults={"points": points},
+            )
+            if not created:
+                LeaderboardScore.objects.filter(pk=score.pk).update(
+                    points=F("points") + points
+                )
+
+    # Patch this process's snapshots once the deposit is committed (a
+    # rolled-back deposit must not leave phantom points); other processes
+    # catch up on rebuild.
+    transaction.on_commit(lambda: _patch(profile_id, points, balance, starts))
+
+
+def _patch(profile_id, points, balance, starts):
+    # Only students (present in the all-time snapshot) are ranked
+    with _lock:
+        everyone = _snapshots.get("all")
+        if everyone is None or profile_id not in everyone.scores:
+            return
+        everyone.set_score(profile_id, balance)
+        for period, start in starts.items():
+            snapshot = _snapshots.get(period)
+            if snapshot is not None and snapshot.start == start:
+                snapshot.set_score(
+                    profile_id, snapshot.scores.get(profile_id, 0) + points
+                )
+
+
+def rebuild(now=None):
+    """Recompute the current weekly and monthly scores from Entry. Returns rows."""
+    written = 0
+    with transaction.atomic():
+        for period in WINDOWS:
+            start = period_start(period, now)
+            since = timezone.make_aware(datetime.combine(start, datetime.min.time()))
+            totals = (
+                Entry.objects.filter(created_at__gte=since)
+                .values("user_profile_id")
+                .annotate(total=Sum("points"))
+                .order_by()
+            )
+            LeaderboardScore.objects.filter(period=period, period_start=start).delete()
+            written += len(
+                LeaderboardScore.objects.bulk_create(
+                    [
+                        LeaderboardScore(
+                            period=period,
+                            period_start=start,
+                            user_profile_id=row["user_profile_id"],
+                            points=row["total"],
+                        )
+                        for row in totals
+                    ]
+                )
+            )
+    reset()
+    return written
+
+
+def reset():
+    """Drop this process's snapshots (tests, rebuilds)"""
+    with _lock:
+        _snapshots.clear()
@@ -0,0 +1,244 @@
+# ======================================================================
+# core/ledger.py
+# Points ledger shared by every deposit and redemption path.
+# Balances are changed with conditional, in-database UPDATEs so that
+# concurrent requests (several devices, several gunicorn workers) can
+# never lose an update or drive a balance below zero.
+# ======================================================================
+
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import counters, leaderboard
+from .models import UserProfile, Entry, Device, RewardItem, RedeemedPoints
+
+POINTS_PER_BOTTLE = 10
+
+
+class InsufficientPoints(Exception):
+    """Raised when a debit would take a balance below zero"""
+
+
+class RewardUnavailable(Exception):
+    """
+    Raised when a reward can't be redeemed as shown. ``reason`` is
+    "inactive" (deactivated or deleted), "repriced" (its points changed
+    since it was read) or "stock" (too little left).
+    """
+
+    def __init__(self, message, reason="stock"):
+        super().__init__(message)
+        self.reason = reason
+
+
+def supports_update_returning():
+    """
+    True if the database runs UPDATE ... RETURNING: PostgreSQL, and SQLite
+    from 3.35 (the release that added RETURNING to INSERT as well). The
+    INSERT feature flag alone isn't enough: MariaDB sets it but can't
+    return from an UPDATE.
+    """
+    if connection.vendor == "postgresql":
+        return True
+    return (
+        connection.vendor == "sqlite"
+        and connection.features.can_return_columns_from_insert
+    )
+
+
+def _increment_returning(model, pk, increments, guard=None, values=None):
+    """
+    Apply ``field = field + delta`` for every item in ``increments`` (and
+    ``field = value`` for every item in ``values``) to one row and return
+    the new value of the first incremented field.
+
+    ``guard`` is an optional ``(field, minimum)`` pair; the row is only updated
+    if ``field >= minimum`` at the time of the UPDATE. Returns None when no row
+    matched (missing pk or guard failed).
+    """
+    if supports_update_returning():
+        # UPDATE ... RETURNING gives us the new balance without a second
+        # round trip.
+        qn = connection.ops.quote_name
+        opts = model._meta
+        assignments = []
+        params = []
+        for name, delta in increments.items():
+            column = qn(opts.get_field(name).column)
+            assignments.append(f"{column} = {column} + %s")
+            params.append(delta)
+        for name, value in (values or {}).items():
+            field = opts.get_field(name)
+            assignments.append(f"{qn(field.column)} = %s")
+            params.append(field.get_db_prep_save(value, connection))
+        where = f"{qn(opts.pk.column)} = %s"
+        params.append(pk)
+        if guard:
+            where += f" AND {qn(opts.get_field(guard[0]).column)} >= %s"
+            params.append(guard[1])
+        returning = qn(opts.get_field(next(iter(increments))).column)
+        sql = (
+            f"UPDATE {qn(opts.db_table)} SET {', '.join(assignments)} "
+            f"WHERE {where} RETURNING {returning}"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    # Fallback for backends without RETURNING: the UPDATE holds the row lock
+    # until the surrounding transaction ends, so the read below is consistent.
+    with transaction.atomic():
+        queryset = model.objects.filter(pk=pk)
+        if guard:
+            queryset = queryset.filter(**{f"{guard[0]}__gte": guard[1]})
+        updated = queryset.update(
+            **{name: F(name) + delta for name, delta in increments.items()},
+            **(values or {}),
+        )
+        if not updated:
+            return None
+        return (
+            model.objects.filter(pk=pk)
+            .values_list(next(iter(increments)), flat=True)
+            .get()
+        )
+
+
+def credit_points(profile_id, points, bottles=0, deposits=1, counter_deltas=None):
+    """
+    Add points to a profile and return the new balance.
+    A credit with ``bottles`` is a deposit (``deposits`` Entry rows): the
+    profile's own stats, the global counters and the leaderboards are
+    updated as well.
+    Callers crediting several profiles in one transaction pass a dict as
+    ``counter_deltas``: the counter changes are added to it instead of
+    bumped, and the caller bumps them once after every profile UPDATE.
+    """
+    increments = {"total_points": points}
+    values = None
+    if bottles:
+        increments.update(
+            total_bottles=bottles, deposit_count=deposits, points_earned=points
+        )
+        values = {"last_deposit_at": timezone.now()}
+    with transaction.atomic(savepoint=False):
+        balance = _increment_returning(
+            UserProfile, profile_id, increments, values=values
+        )
+        if balance is not None:
+            deltas = {counters.POINTS_BALANCE: points}
+            if bottles:
+                deltas[counters.BOTTLES] = bottles
+                deltas[counters.POINTS_EARNED] = points
+                leaderboard.record(profile_id, points, balance)
+            if counter_deltas is None:
+                counters.bump(**deltas)
+            else:
+                for name, delta in deltas.items():
+                    counter_deltas[name] = counter_deltas.get(name, 0) + delta
+    if balance is None:
+        raise UserProfile.DoesNotExist(f"UserProfile {profile_id} does not exist")
+    return balance
+
+
+def debit_points(profile_id, points):
+    """
+    Subtract points from a profile only if the balance covers them and
+    count them as redeemed. Returns the new balance or raises
+    InsufficientPoints.
+    """
+    with transaction.atomic(savepoint=False):
+        balance = _increment_returning(
+            UserProfile,
+            profile_id,
+            {"total_points": -points, "points_redeemed": points},
+            guard=("total_points", points),
+        )
+        if balance is not None:
+            counters.bump(
+                **{counters.POINTS_BALANCE: -points, counters.POINTS_REDEEMED: points}
+            )
+    if balance is None:
+        if not UserProfile.objects.filter(pk=profile_id).exists():
+            raise UserProfile.DoesNotExist(f"UserProfile {profile_id} does not exist")
+        raise InsufficientPoints(f"Not enough points to deduct {points}")
+    return balance
+
+
+def add_device_bottles(device_id, bottles):
+    """Atomically bump a device's processed-bottle counter"""
+    Device.objects.filter(pk=device_id).update(
+        total_bottles_processed=F("total_bottles_processed") + bottles
+    )
+
+
+def record_deposit(profile, bottles=1, points=None, device=None):
+    """
+    Credit a bottle deposit in one transaction: points, the Entry record and
+    (optionally) the device counter. Returns ``(entry, new_balance)``.
+    """
+    if points is None:
+        points = bottles * POINTS_PER_BOTTLE
+    with transaction.atomic():
+        balance = credit_points(profile.pk, points, bottles=bottles)
+        entry = Entry.objects.create(
+            user_profile=profile, no_bottle=bottles, points=points
+        )
+        if device is not None:
+            add_device_bottles(device.pk, bottles)
+    profile.total_points = balance
+    profile.mark_clean("total_points")
+    return entry, balance
+
+
+def redeem_reward(profile, reward, quantity=1):
+    """
+    Redeem ``quantity`` of ``reward`` in one transaction: take the stock,
+    debit the points and record the RedeemedPoints row. Stock and points are
+    both taken with conditional UPDATEs, so concurrent redeemers can neither
+    oversell an item nor overdraw a balance. Raises RewardUnavailable or
+    InsufficientPoints (and changes nothing) otherwise. Returns
+    ``(redemption, new_balance)``.
+    """
+    if quantity < 1:
+        raise ValueError("quantity must be at least 1")
+    points = reward.points_required * quantity
+    with transaction.atomic():
+        # Stock first: every redemption locks the reward row before the
+        # profile row, so concurrent redemptions can't deadlock. The price
+        # is part of the condition, so a redemption racing a price edit
+        # can't be charged the old price. NULL stock (unlimited) stays NULL.
+        taken = (
+            RewardItem.objects.filter(
+                pk=reward.pk, is_active=True, points_required=reward.points_required
+            )
+            .filter(Q(stock__isnull=True) | Q(stock__gte=quantity))
+            .update(stock=F("stock") - quantity)
+        )
+        if not taken:
+            current = (
+                RewardItem.objects.filter(pk=reward.pk, is_active=True)
+                .values_list("points_required", flat=True)
+                .first()
+            )
+            if current is None:
+                reason = "inactive"
+            elif current != reward.points_required:
+                reason = "repriced"
+            else:
+                reason = "stock"
+            raise RewardUnavailable(
+                f"{reward} is not available x{quantity}", reason=reason
+            )
+        balance = debit_points(profile.pk, points)
+        redemption = RedeemedPoints.objects.create(
+            user_profile=profile,
+            reward_item=reward,
+            redeemed_points=points,
+            quantity=quantity,
+        )
+    profile.total_points = balance
+    profile.mark_clean("total_points")
+    return redemption, balance
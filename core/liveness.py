@@ -0,0 +1,76 @@
+# ======================================================================
+# core/liveness.py
+# Server-side device liveness.
+# Device.status is whatever the board last reported, so a board that lost
+# power would stay "online" forever. Here a device whose last_heartbeat is
+# older than DEVICE_STALE_AFTER seconds counts as "offline" (maintenance
+# is set by staff and is kept). Pages read the derived "live_status"
+# annotation; "manage.py sweep_devices" also writes it back in bulk.
+# ======================================================================
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, Count, F, Q, Value, When
+from django.utils import timezone
+
+from . import dashboard
+from .heartbeats import STATE_KEY
+from .models import Device
+
+STATUSES = [status for status, _ in Device.DEVICE_STATUS_CHOICES]
+
+
+def stale_before(now=None):
+    """Heartbeats older than this mean the device is gone"""
+    return (now or timezone.now()) - timedelta(
+        seconds=getattr(settings, "DEVICE_STALE_AFTER", 180)
+    )
+
+
+def _stale(now=None):
+    return (
+        Q(last_heartbeat__isnull=True) | Q(last_heartbeat__lt=stale_before(now))
+    ) & ~Q(status="maintenance")
+
+
+def with_liveness(queryset=None, now=None):
+    """Annotate ``live_status``: the reported status, or "offline" when stale"""
+    if queryset is None:
+        queryset = Device.objects.all()
+    return queryset.annotate(
+        live_status=Case(When(_stale(now), then=Value("offline")), default=F("status"))
+    )
+
+
+def status_counts(now=None):
+    """Return ``{status: count}`` for every status plus "total", in one grouped query"""
+    counts = dict.fromkeys(STATUSES, 0)
+    counts.update(
+        with_liveness(now=now)
+        .values_list("live_status")
+        .annotate(count=Count("pk"))
+        .order_by()
+    )
+    counts["total"] = sum(counts[status] for status in STATUSES)
+    return counts
+
+
+def sweep(now=None):
+    """Mark stale devices offline with one UPDATE. Returns the number flipped."""
+    stale = Device.objects.filter(_stale(now)).exclude(status="offline")
+    device_pks = list(stale.values_list("pk", flat=True))
+    if not device_pks:
+        return 0
+    # Re-check staleness in the UPDATE so a heartbeat that just arrived wins
+    flipped = (
+        Device.objects.filter(_stale(now), pk__in=device_pks)
+        .exclude(status="offline")
+        .update(status="offline")
+    )
+    # Drop buffered heartbeat state so a device that comes back is written
+    # through and logged as a change
+    cache.delete_many([STATE_KEY.format(pk) for pk in device_pks])
+    dashboard.invalidate("devices")
+    return flipped
@@ -0,0 +1,127 @@
+# ======================================================================
+# core/log_rollup.py
+# Rollup and retention for DeviceLog.
+# Raw logs are summarized into per-device hourly DeviceLogRollup rows
+# (counts by log_type/sort_result), hourly rows into daily ones, and raw
+# rows older than DEVICE_LOG_RETENTION_DAYS are then deleted in small
+# batches. Only rows that are already rolled up are ever deleted.
+# Run through "manage.py rollup_device_logs".
+# ======================================================================
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Count, Max, Min, Sum, Value
+from django.db.models.functions import Coalesce, TruncDay, TruncHour
+from django.utils import timezone
+
+from .models import DeviceLog, DeviceLogRollup
+
+STEP = {"hour": timedelta(hours=1), "day": timedelta(days=1)}
+WINDOW = {"hour": timedelta(days=1), "day": timedelta(days=31)}  # Per query
+TRUNC = {"hour": TruncHour, "day": TruncDay}
+
+
+def _truncate(moment, period):
+    local = timezone.localtime(moment).replace(minute=0, second=0, microsecond=0)
+    if period == "day":
+        local = local.replace(hour=0)
+    return local
+
+
+def rolled_until(period):
+    """End of the newest rolled-up bucket for ``period`` (None before the first run)"""
+    last = DeviceLogRollup.objects.filter(period=period).aggregate(
+        last=Max("period_start")
+    )["last"]
+    return None if last is None else last + STEP[period]
+
+
+def _save(period, rows):
+    DeviceLogRollup.objects.bulk_create(
+        [
+            DeviceLogRollup(
+                device_id=row["device_id"],
+                period=period,
+                period_start=row["bucket"],
+                log_type=row["log_type"],
+                sort_result=row["result"],
+                count=row["total"],
+            )
+            for row in rows
+        ],
+        update_conflicts=True,
+        unique_fields=["device", "period", "period_start", "log_type", "sort_result"],
+        update_fields=["count"],
+    )
+
+
+def _roll(period, source, field, total, start, end):
+    """Aggregate ``source`` over [start, end) one window at a time. Returns rows read."""
+    read = 0
+    while start < end:
+        window_end = min(start + WINDOW[period], end)
+        rows = list(
+            source.filter(**{f"{field}__gte": start, f"{field}__lt": window_end})
+            .annotate(
+                bucket=TRUNC[period](field),
+                result=Coalesce("sort_result", Value("")),
+            )
+            .values("device_id", "bucket", "log_type", "result")
+            .annotate(total=total)
+            .order_by()
+        )
+        _save(period, rows)
+        read += sum(row["total"] for row in rows)
+        start = window_end
+    return read
+
+
+def rollup_hours(now=None):
+    """Roll raw logs up into every completed hour not yet rolled up. Returns rows read."""
+    start = rolled_until("hour")
+    if start is None:
+        first = DeviceLog.objects.aggregate(first=Min("created_at"))["first"]
+        if first is None:
+            return 0
+        start = _truncate(first, "hour")
+    end = _truncate(now or timezone.now(), "hour")
+    return _roll("hour", DeviceLog.objects, "created_at", Count("pk"), start, end)
+
+
+def rollup_days(now=None):
+    """Roll hourly rows up into every completed day not yet rolled up. Returns logs counted."""
+    hours = DeviceLogRollup.objects.filter(period="hour")
+    start = rolled_until("day")
+    if start is None:
+        first = hours.aggregate(first=Min("period_start"))["first"]
+        if first is None:
+            return 0
+        start = _truncate(first, "day")
+    end = _truncate(now or timezone.now(), "day")
+    return _roll("day", hours, "period_start", Sum("count"), start, end)
+
+
+def prune_logs(now=None, batch_size=1000):
+    """
+    Delete raw logs older than DEVICE_LOG_RETENTION_DAYS in batches of
+    ``batch_size``, never past the hourly rollup. Returns count.
+    """
+    rolled = rolled_until("hour")
+    if rolled is None:
+        return 0
+    cutoff = min(
+        rolled,
+        (now or timezone.now())
+        - timedelta(days=getattr(settings, "DEVICE_LOG_RETENTION_DAYS", 30)),
+    )
+    deleted = 0
+    while True:
+        pks = list(
+            DeviceLog.objects.filter(created_at__lt=cutoff).values_list(
+                "pk", flat=True
+            )[:batch_size]
+        )
+        if not pks:
+            return deleted
+        deleted += DeviceLog.objects.filter(pk__in=pks).delete()[0]
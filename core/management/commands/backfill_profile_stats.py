@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from core.profile_stats import backfill
+
+
+class Command(BaseCommand):
+    help = 'Recompute per-user bottle/points stats from deposits and redemptions'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Profiles checked per chunk',
+        )
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Only report mismatches, do not fix them',
+        )
+
+    def handle(self, *args, **options):
+        checked, mismatched = backfill(
+            batch_size=options['batch_size'], fix=not options['verify']
+        )
+        action = 'found' if options['verify'] else 'fixed'
+        style = self.style.WARNING if mismatched and options['verify'] else self.style.SUCCESS
+        self.stdout.write(style(
+            f'Checked {checked} profile(s), {action} {mismatched} mismatch(es)'
+        ))
@@ -0,0 +1,184 @@
+import asyncio
+import json
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from django.contrib.auth.models import User
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test import Client, override_settings
+from django.test.utils import setup_databases, teardown_databases
+
+from core.models import Device
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare concurrent-device throughput of the device API under WSGI '
+        '(sync worker threads) and ASGI (one event loop). Runs against a '
+        'throwaway test database and a private in-memory cache, so live '
+        'counters, leaderboards and logs are never touched'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--devices', type=int, default=20,
+                            help='Number of simulated devices sending at once')
+        parser.add_argument('--requests', type=int, default=15,
+                            help='Requests sent by each device')
+        parser.add_argument('--wsgi-workers', type=int, default=1,
+                            help='Concurrent requests WSGI can serve (gunicorn sync workers)')
+        parser.add_argument('--db-latency', type=float, default=5.0,
+                            help='Simulated network latency per DB query in ms (0 to disable)')
+
+    def handle(self, *args, **options):
+        # The requests credit points, bump the global counters and write
+        # leaderboard, event and log rows: keep all of that out of the real
+        # database (a test database, as "manage.py test" creates) and out of
+        # the shared cache
+        old_config = setup_databases(verbosity=0, interactive=False, aliases={'default'})
+        try:
+            with override_settings(CACHES={
+                'default': {
+                    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                    'LOCATION': 'bench-device-api',
+                },
+            }):
+                self._benchmark(options)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+
+    def _benchmark(self, options):
+        self.latency = options['db_latency'] / 1000
+        suffix = uuid.uuid4().hex[:8]
+        self.api_key = f'bench-{suffix}'
+        device = Device.objects.create(
+            device_id=f'BENCH-{suffix}',
+            device_name='Benchmark Device',
+            location='Benchmark',
+            api_key=self.api_key,
+        )
+        user = User.objects.create_user(f'bench-{suffix}', password=uuid.uuid4().hex)
+        profile = user.profile
+        profile.school_id = f'B{suffix}'
+        profile.save()
+        self.school_id = profile.school_id
+        self.qr_code = profile.qr_code_data
+
+        # Simulate a remote database: every query pays the latency, in
+        # whichever thread it runs
+        self.failures = 0
+        connection_created.connect(self._add_latency)
+        self._add_latency(connection=connection)
+        try:
+            total = options['devices'] * options['requests']
+            wsgi = self._run_wsgi(options)
+            asgi = asyncio.run(self._run_asgi(options))
+        finally:
+            connection_created.disconnect(self._add_latency)
+            if self._delay in connection.execute_wrappers:
+                connection.execute_wrappers.remove(self._delay)
+
+        self.stdout.write(
+            f"{options['devices']} devices x {options['requests']} requests, "
+            f"{options['db_latency']:g} ms simulated DB latency"
+        )
+        self.stdout.write(f'WSGI ({options["wsgi_workers"]} worker(s)): '
+                          f'{total / wsgi:8.1f} req/s  ({wsgi:.2f}s)')
+        self.stdout.write(f'ASGI (event loop):   {total / asgi:8.1f} req/s  ({asgi:.2f}s)')
+        self.stdout.write(self.style.SUCCESS(f'ASGI speed-up: {wsgi / asgi:.2f}x'))
+        if self.failures:
+            self.stdout.write(self.style.WARNING(f'{self.failures} request(s) failed'))
+
+    def _delay(self, execute, sql, params, many, context):
+        time.sleep(self.latency)
+        return execute(sql, params, many, context)
+
+    def _add_latency(self, sender=None, connection=None, **kwargs):
+        if self.latency and self._delay not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self._delay)
+
+    def _requests(self, count):
+        """The mix a board sends: heartbeats, ID scans and bottle detections"""
+        for index in range(count):
+            kind = index % 3
+            if kind == 0:
+                yield 'post', '/api/device/heartbeat/', {'status': 'online'}
+            elif kind == 1:
+                yield 'get', '/api/user/verify/', {'code': self.school_id}
+            else:
+                yield 'post', '/api/device/detection/', {
+                    'sort_result': 'plastic', 'user_id': self.qr_code,
+                }
+
+    def _run_wsgi(self, options):
+        headers = {'Authorization': f'Bearer {self.api_key}'}
+
+        def device(_):
+            client = Client()
+            try:
+                for method, path, data in self._requests(options['requests']):
+                    if method == 'get':
+                        response = client.get(path, data, headers=headers)
+                    else:
+                        response = client.post(path, data, content_type='application/json',
+                                               headers=headers)
+                    if response.status_code >= 400:
+                        self.failures += 1
+            finally:
+                connection.close()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['wsgi_workers']) as pool:
+            list(pool.map(device, range(options['devices'])))
+        return time.perf_counter() - started
+
+    async def _run_asgi(self, options):
+        # Call the real ASGI application (as uvicorn would) rather than the
+        # test AsyncClient, so each request gets its own thread-sensitive
+        # context exactly like in production
+        application = get_asgi_application()
+        headers = [
+            (b'authorization', f'Bearer {self.api_key}'.encode()),
+            (b'content-type', b'application/json'),
+            (b'host', b'localhost'),
+        ]
+
+        async def call(method, path, data):
+            body = b'' if method == 'get' else json.dumps(data).encode()
+            scope = {
+                'type': 'http',
+                'asgi': {'version': '3.0'},
+                'http_version': '1.1',
+                'method': method.upper(),
+                'scheme': 'http',
+                'path': path,
+                'raw_path': path.encode(),
+                'query_string': urlencode(data).encode() if method == 'get' else b'',
+                'headers': headers,
+                'client': ('127.0.0.1', 0),
+                'server': ('localhost', 80),
+            }
+            messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+
+            async def receive():
+                if messages:
+                    return messages.pop()
+                await asyncio.Event().wait()  # Never disconnects
+
+            async def send(message):
+                if message['type'] == 'http.response.start' and message['status'] >= 400:
+                    self.failures += 1
+
+            await application(scope, receive, send)
+
+        async def device():
+            for method, path, data in self._requests(options['requests']):
+                await call(method, path, data)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(device() for _ in range(options['devices'])))
+        return time.perf_counter() - started
@@ -0,0 +1,66 @@
+import time
+from io import BytesIO
+
+from django.core.management.base import BaseCommand
+from PIL import Image, ImageDraw, ImageFont
+
+from core import id_cards
+from core.utils import generate_barcode_buffer
+
+
+def legacy_card(full_name, school_id):
+    """The original renderer: fonts probed, header drawn and barcode resampled per card"""
+    width, height = 1012, 638
+    card = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(card)
+    draw.rectangle([(0, 0), (width, 150)], fill='#1e40af')
+    try:
+        title_font = ImageFont.truetype('arial.ttf', 40)
+        name_font = ImageFont.truetype('arial.ttf', 50)
+        info_font = ImageFont.truetype('arial.ttf', 30)
+    except OSError:
+        title_font = name_font = info_font = ImageFont.load_default()
+    draw.text((width // 2, 50), "St. Michael's College", fill='white',
+              font=title_font, anchor='mm')
+    draw.text((width // 2, 100), 'Iligan City', fill='white', font=info_font, anchor='mm')
+    draw.text((width // 2, 250), full_name, fill='#1e40af', font=name_font, anchor='mm')
+    draw.text((width // 2, 320), f'ID: {school_id}', fill='black',
+              font=info_font, anchor='mm')
+    barcode_img = Image.open(generate_barcode_buffer(school_id, include_text=False))
+    card.paste(barcode_img.resize((600, 120)), ((width - 600) // 2, 400))
+    return card
+
+
+class Command(BaseCommand):
+    help = 'Benchmark ID card rendering (cards/sec) for the legacy and current renderers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cards', type=int, default=200,
+                            help='Cards to render with each renderer')
+        parser.add_argument('--no-encode', action='store_true',
+                            help='Time drawing only, without PNG encoding')
+
+    def handle(self, *args, **options):
+        count = options['cards']
+        encode = not options['no_encode']
+        cards = [(f'STUDENT NUMBER {i}', f'C25-{i:04d}') for i in range(count)]
+
+        id_cards.font.cache_clear()
+        id_cards._template = None
+        results = {}
+        renderers = (
+            ('legacy', legacy_card, lambda image: image.save(BytesIO(), format='PNG')),
+            ('current', id_cards.render, id_cards.encode),
+        )
+        for label, render, save in renderers:
+            started = time.perf_counter()
+            for full_name, school_id in cards:
+                image = render(full_name, school_id)
+                if encode:
+                    save(image)
+            results[label] = count / (time.perf_counter() - started)
+            self.stdout.write(f'{label:>8}: {results[label]:8.1f} cards/sec')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'speed-up: {results["current"] / results["legacy"]:.1f}x'
+        ))
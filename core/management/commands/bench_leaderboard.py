@@ -0,0 +1,124 @@
+import random
+import time
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from django.test.utils import setup_databases, teardown_databases
+
+from core import leaderboard
+from core.models import LeaderboardScore, UserProfile
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark leaderboard top-N and rank lookups against SQL COUNT '
+        'ranking. Runs against a throwaway test database and a private '
+        'in-memory cache, so live data is never touched'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50000,
+                            help='Number of simulated students')
+        parser.add_argument('--lookups', type=int, default=2000,
+                            help='Rank lookups to time')
+
+    def handle(self, *args, **options):
+        # Seeding tens of thousands of students inside a rolled-back
+        # transaction of the real database would hold its write lock for the
+        # whole run: use a test database, as "manage.py test" creates, and a
+        # private cache instead
+        old_config = setup_databases(verbosity=0, interactive=False, aliases={'default'})
+        try:
+            with override_settings(CACHES={
+                'default': {
+                    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                    'LOCATION': 'bench-leaderboard',
+                },
+            }):
+                self._run(options)
+        finally:
+            leaderboard.reset()
+            teardown_databases(old_config, verbosity=0)
+
+    def _run(self, options):
+        count = options['users']
+        suffix = uuid.uuid4().hex[:8]
+        started = time.perf_counter()
+        User.objects.bulk_create(
+            [User(username=f'lb-{suffix}-{i}', password='!') for i in range(count)],
+            batch_size=2000,
+        )
+        user_ids = User.objects.filter(
+            username__startswith=f'lb-{suffix}-'
+        ).values_list('pk', flat=True)
+        UserProfile.objects.bulk_create(
+            [
+                UserProfile(
+                    user_id=user_id,
+                    total_points=random.randint(0, 5000),
+                    qr_code_data=f'LB-{suffix}-{user_id}',
+                )
+                for user_id in user_ids
+            ],
+            batch_size=2000,
+        )
+        profiles = list(
+            UserProfile.objects.filter(qr_code_data__startswith=f'LB-{suffix}-')
+        )
+        week = leaderboard.period_start('week')
+        LeaderboardScore.objects.bulk_create(
+            [
+                LeaderboardScore(
+                    period='week',
+                    period_start=week,
+                    user_profile=profile,
+                    points=random.randint(1, 500),
+                )
+                for profile in profiles
+            ],
+            batch_size=2000,
+        )
+        self.stdout.write(f'Seeded {count} students in {time.perf_counter() - started:.1f}s')
+
+        sample = random.sample(profiles, min(options['lookups'], len(profiles)))
+
+        for period in ('all', 'week'):
+            leaderboard.reset()
+            started = time.perf_counter()
+            leaderboard.rank(sample[0], period)
+            build = time.perf_counter() - started
+
+            started = time.perf_counter()
+            for profile in sample:
+                leaderboard.rank(profile, period)
+            snapshot_rank = (time.perf_counter() - started) / len(sample)
+
+            started = time.perf_counter()
+            leaderboard.top(period, 10)
+            top = time.perf_counter() - started
+
+            started = time.perf_counter()
+            for profile in sample[:200]:
+                self._sql_rank(profile, period, week)
+            sql_rank = (time.perf_counter() - started) / min(200, len(sample))
+
+            self.stdout.write(f'[{period}] snapshot build: {build * 1000:8.1f} ms')
+            self.stdout.write(f'[{period}] top 10:         {top * 1000:8.2f} ms')
+            self.stdout.write(f'[{period}] rank (snapshot): {snapshot_rank * 1e6:7.1f} us')
+            self.stdout.write(f'[{period}] rank (SQL COUNT): {sql_rank * 1e6:6.1f} us')
+            self.stdout.write(self.style.SUCCESS(
+                f'[{period}] rank speed-up: {sql_rank / snapshot_rank:.0f}x'
+            ))
+
+    def _sql_rank(self, profile, period, week):
+        """The per-request alternative: count better scores in the database"""
+        if period == 'all':
+            students = UserProfile.objects.filter(user__is_staff=False)
+            return students.filter(total_points__gt=profile.total_points).count() + 1
+        scores = LeaderboardScore.objects.filter(
+            period='week', period_start=week, user_profile__user__is_staff=False
+        )
+        mine = scores.get(user_profile=profile).points
+        return scores.filter(points__gt=mine).count() + 1
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from core import heartbeats
+
+
+class Command(BaseCommand):
+    help = 'Write buffered device heartbeats to the database (run on a schedule)'
+
+    def handle(self, *args, **options):
+        flushed = heartbeats.flush_pending()
+        self.stdout.write(
+            self.style.SUCCESS(f'Flushed heartbeats for {flushed} device(s)')
+        )
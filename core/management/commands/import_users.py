@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import enrollment
+
+
+class Command(BaseCommand):
+    help = (
+        'Create accounts from a CSV/XLSX enrollment list (columns: username, '
+        'password, first_name, last_name, email, user_type, school_id). '
+        'Nothing is created unless every row is valid.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or XLSX file')
+        parser.add_argument('--default-password',
+                            help='Password for rows without one (otherwise unusable)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only validate the file')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Rows per INSERT')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Password hashing processes (default: IMPORT_HASH_WORKERS)')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            with open(options['path'], 'rb') as fileobj:
+                result = enrollment.import_file(
+                    fileobj,
+                    options['path'],
+                    default_password=options['default_password'],
+                    dry_run=options['dry_run'],
+                    batch_size=options['batch_size'],
+                    workers=options['workers'],
+                )
+        except (OSError, enrollment.ImportFileError) as e:
+            raise CommandError(str(e))
+        elapsed = time.perf_counter() - started
+
+        if result.errors:
+            for line, message in result.errors:
+                self.stderr.write(f'line {line}: {message}')
+            raise CommandError(f'{len(result.errors)} problem(s) found; nothing was imported')
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f'{len(result.rows)} row(s) are valid'))
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {result.created} account(s) in {elapsed:.1f}s '
+            f'({result.created / elapsed:.0f} rows/sec)'
+        ))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from core.idempotency import prune_events
+
+
+class Command(BaseCommand):
+    help = 'Delete device event ids older than DEVICE_EVENT_RETENTION_HOURS'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Rows deleted per statement',
+        )
+
+    def handle(self, *args, **options):
+        deleted = prune_events(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} device event(s)'))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from core import leaderboard
+
+
+class Command(BaseCommand):
+    help = 'Recompute the weekly and monthly leaderboard scores from deposits'
+
+    def handle(self, *args, **options):
+        written = leaderboard.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} leaderboard score(s)'))
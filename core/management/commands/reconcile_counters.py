@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from core import counters
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the dashboard counters (bottles, points, users) from scratch'
+
+    def handle(self, *args, **options):
+        for name, (old, new) in counters.reconcile().items():
+            drift = f' (was {old})' if old != new else ''
+            self.stdout.write(f'{name}: {new}{drift}')
+        self.stdout.write(self.style.SUCCESS('Counters reconciled'))
@@ -0,0 +1,49 @@
+import time
+
+from django.core.management.base import BaseCommand
+from core import log_rollup
+
+
+class Command(BaseCommand):
+    help = (
+        'Roll device logs up into hourly/daily summaries and delete raw logs '
+        'older than DEVICE_LOG_RETENTION_DAYS (run on a schedule)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Rows deleted per statement',
+        )
+        parser.add_argument(
+            '--no-prune',
+            action='store_true',
+            help='Only build rollups, keep all raw logs',
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        rolled = log_rollup.rollup_hours()
+        log_rollup.rollup_days()
+        rolled_in = time.perf_counter() - started
+
+        deleted = 0
+        pruned_in = 0.0
+        if not options['no_prune']:
+            started = time.perf_counter()
+            deleted = log_rollup.prune_logs(batch_size=options['batch_size'])
+            pruned_in = time.perf_counter() - started
+
+        self.stdout.write(
+            f'Rolled up {rolled} log(s) in {rolled_in:.2f}s '
+            f'({self._rate(rolled, rolled_in)} rows/sec)'
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {deleted} log(s) in {pruned_in:.2f}s '
+            f'({self._rate(deleted, pruned_in)} rows/sec)'
+        ))
+
+    def _rate(self, rows, seconds):
+        return f'{rows / seconds:.0f}' if seconds else '-'
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from core import liveness
+
+
+class Command(BaseCommand):
+    help = 'Mark devices without a recent heartbeat as offline (run on a schedule)'
+
+    def handle(self, *args, **options):
+        flipped = liveness.sweep()
+        self.stdout.write(
+            self.style.SUCCESS(f'Marked {flipped} stale device(s) offline')
+        )
@@ -0,0 +1,34 @@
+# Generated by Django 5.0.6 on 2026-10-18 15:34
+
+from django.db import migrations, models
+
+
+def backfill_identity_keys(apps, schema_editor):
+    """Fill identity_key for existing profiles (normalized school ID or username)"""
+    UserProfile = apps.get_model('core', 'UserProfile')
+    batch = []
+    for profile in UserProfile.objects.select_related('user').iterator(chunk_size=1000):
+        source = profile.school_id or profile.user.username
+        profile.identity_key = "".join(source.split()).replace("-", "").upper() or None
+        batch.append(profile)
+        if len(batch) >= 1000:
+            UserProfile.objects.bulk_update(batch, ['identity_key'])
+            batch = []
+    if batch:
+        UserProfile.objects.bulk_update(batch, ['identity_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_redeemedpoints_quantity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='identity_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=150, null=True),
+        ),
+        migrations.RunPython(backfill_identity_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.0.6 on 2026-10-18 15:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_deviceevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeviceLogRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hourly'), ('day', 'Daily')], max_length=4)),
+                ('period_start', models.DateTimeField()),
+                ('log_type', models.CharField(choices=[('bottle_detected', 'Bottle Detected'), ('bottle_sorted', 'Bottle Sorted'), ('error', 'Error'), ('maintenance', 'Maintenance'), ('heartbeat', 'Heartbeat')], max_length=20)),
+                ('sort_result', models.CharField(blank=True, default='', max_length=10)),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='devicelog',
+            index=models.Index(fields=['created_at'], name='devicelog_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='devicelog',
+            index=models.Index(fields=['device', 'created_at'], name='devicelog_device_idx'),
+        ),
+        migrations.AddField(
+            model_name='devicelogrollup',
+            name='device',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.device'),
+        ),
+        migrations.AddIndex(
+            model_name='devicelogrollup',
+            index=models.Index(fields=['period', 'period_start'], name='core_device_period_126bb1_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='devicelogrollup',
+            constraint=models.UniqueConstraint(fields=('device', 'period', 'period_start', 'log_type', 'sort_result'), name='unique_devicelog_rollup'),
+        ),
+    ]
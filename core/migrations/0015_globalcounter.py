@@ -0,0 +1,43 @@
+# Generated by Django 5.0.6 on 2026-10-18 15:48
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def seed_counters(apps, schema_editor):
+    """Start the counters from the current table totals"""
+    UserProfile = apps.get_model('core', 'UserProfile')
+    Entry = apps.get_model('core', 'Entry')
+    RedeemedPoints = apps.get_model('core', 'RedeemedPoints')
+    GlobalCounter = apps.get_model('core', 'GlobalCounter')
+    totals = {
+        **UserProfile.objects.aggregate(
+            users=Count('pk'),
+            staff_users=Count('pk', filter=Q(user__is_staff=True)),
+            points_balance=Sum('total_points'),
+        ),
+        **Entry.objects.aggregate(bottles=Sum('no_bottle'), points_earned=Sum('points')),
+        **RedeemedPoints.objects.aggregate(points_redeemed=Sum('redeemed_points')),
+    }
+    GlobalCounter.objects.bulk_create(
+        [GlobalCounter(name=name, value=value or 0) for name, value in totals.items()]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_devicelog_rollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GlobalCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(seed_counters, migrations.RunPython.noop),
+    ]
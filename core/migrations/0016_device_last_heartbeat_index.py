@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-18 15:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_globalcounter'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='device',
+            name='last_heartbeat',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
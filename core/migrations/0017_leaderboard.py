@@ -0,0 +1,68 @@
+# Generated by Django 5.0.6 on 2026-10-18 15:54
+
+import django.db.models.deletion
+from datetime import datetime, timedelta
+from django.db import migrations, models
+from django.db.models import Sum
+from django.utils import timezone
+
+
+def backfill_scores(apps, schema_editor):
+    """Fill the current week and month from existing entries"""
+    Entry = apps.get_model('core', 'Entry')
+    LeaderboardScore = apps.get_model('core', 'LeaderboardScore')
+    today = timezone.localdate()
+    starts = {
+        'week': today - timedelta(days=today.weekday()),
+        'month': today.replace(day=1),
+    }
+    for period, start in starts.items():
+        since = timezone.make_aware(datetime.combine(start, datetime.min.time()))
+        totals = (
+            Entry.objects.filter(created_at__gte=since)
+            .values('user_profile_id')
+            .annotate(total=Sum('points'))
+            .order_by()
+        )
+        LeaderboardScore.objects.bulk_create([
+            LeaderboardScore(
+                period=period,
+                period_start=start,
+                user_profile_id=row['user_profile_id'],
+                points=row['total'],
+            )
+            for row in totals
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_device_last_heartbeat_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='userprofile',
+            name='total_points',
+            field=models.PositiveIntegerField(db_index=True, default=0),
+        ),
+        migrations.CreateModel(
+            name='LeaderboardScore',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('week', 'Weekly'), ('month', 'Monthly')], max_length=5)),
+                ('period_start', models.DateField()),
+                ('points', models.PositiveIntegerField(default=0)),
+                ('user_profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.userprofile')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['period', 'period_start', '-points'], name='leaderboard_rank_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='leaderboardscore',
+            constraint=models.UniqueConstraint(fields=('period', 'period_start', 'user_profile'), name='unique_leaderboard_score'),
+        ),
+        migrations.RunPython(backfill_scores, migrations.RunPython.noop),
+    ]
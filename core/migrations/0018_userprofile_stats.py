@@ -0,0 +1,77 @@
+# Generated by Django 5.0.6 on 2026-10-18 15:58
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Sum
+
+
+def backfill_stats(apps, schema_editor):
+    """Fill the new stats for existing profiles from their entries/redemptions"""
+    UserProfile = apps.get_model('core', 'UserProfile')
+    Entry = apps.get_model('core', 'Entry')
+    RedeemedPoints = apps.get_model('core', 'RedeemedPoints')
+    entries = {
+        row['user_profile_id']: row
+        for row in Entry.objects.values('user_profile_id').annotate(
+            total_bottles=Sum('no_bottle'),
+            deposit_count=Count('pk'),
+            last_deposit_at=Max('created_at'),
+            points_earned=Sum('points'),
+        ).order_by()
+    }
+    redeemed = dict(
+        RedeemedPoints.objects.values('user_profile_id')
+        .annotate(total=Sum('redeemed_points'))
+        .values_list('user_profile_id', 'total')
+        .order_by()
+    )
+    fields = ['total_bottles', 'deposit_count', 'last_deposit_at', 'points_earned']
+    batch = []
+    for profile in UserProfile.objects.filter(
+        pk__in=set(entries) | set(redeemed)
+    ).iterator(chunk_size=1000):
+        row = entries.get(profile.pk, {})
+        for name in fields:
+            setattr(profile, name, row.get(name, getattr(profile, name)))
+        profile.points_redeemed = redeemed.get(profile.pk, 0)
+        batch.append(profile)
+        if len(batch) >= 1000:
+            UserProfile.objects.bulk_update(batch, fields + ['points_redeemed'])
+            batch = []
+    if batch:
+        UserProfile.objects.bulk_update(batch, fields + ['points_redeemed'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_leaderboard'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='deposit_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='last_deposit_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='points_earned',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='points_redeemed',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='total_bottles',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_stats, migrations.RunPython.noop),
+    ]
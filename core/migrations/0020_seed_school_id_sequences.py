@@ -0,0 +1,45 @@
+# Generated by Django 5.0.6 on 2026-10-18 16:13
+
+import re
+
+from django.db import migrations
+
+STUDENT_PATTERN = re.compile(r'^C(\d{2})-(\d{1,6})$')
+FACULTY_PATTERN = re.compile(r'^SMCIC-(\d{3})-(\d{4})$')
+
+
+def seed_sequences(apps, schema_editor):
+    """Start every school ID sequence after the highest ID already issued"""
+    UserProfile = apps.get_model('core', 'UserProfile')
+    Sequence = apps.get_model('core', 'Sequence')
+    highest = {}
+    school_ids = UserProfile.objects.exclude(school_id__isnull=True).values_list(
+        'school_id', flat=True
+    )
+    for school_id in school_ids.iterator(chunk_size=2000):
+        school_id = school_id.strip().upper()
+        match = STUDENT_PATTERN.match(school_id)
+        if match:
+            name, number = f'school_id:C{match.group(1)}', int(match.group(2))
+        else:
+            match = FACULTY_PATTERN.match(school_id)
+            if not match or not int(match.group(1)) or not int(match.group(2)):
+                continue
+            # Same numbering as core/school_ids.py (9999 per department)
+            name = 'school_id:SMCIC'
+            number = (int(match.group(1)) - 1) * 9999 + int(match.group(2))
+        highest[name] = max(highest.get(name, 0), number)
+    Sequence.objects.bulk_create(
+        [Sequence(name=name, value=value) for name, value in highest.items()]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_sequence'),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_sequences, migrations.RunPython.noop),
+    ]
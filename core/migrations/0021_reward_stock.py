@@ -0,0 +1,23 @@
+# Generated by Django 5.0.6 on 2026-10-18 16:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_seed_school_id_sequences'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rewarditem',
+            name='is_active',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='rewarditem',
+            name='stock',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
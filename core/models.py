@@ -7,11 +7,93 @@
 
 from django.db import models
 from django.contrib.auth.models import User
-from datetime import datetime
+
+
+class DirtyFieldsMixin(models.Model):
+    """
+    Remembers the field values an instance was loaded (or last saved) with.
+    A save() without update_fields then writes only the fields that changed
+    and skips the query altogether when nothing did. Instances built in
+    code rather than loaded are saved in full as usual.
+    """
+
+    # Fields a plain save() never writes, even if changed in memory
+    DIRTY_EXCLUDE = ()
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_values()
+        return instance
+
+    def _remember_values(self, names=None):
+        # Deferred fields aren't in __dict__ and are left untracked
+        values = {
+            field.attname: self.__dict__[field.attname]
+            for field in self._meta.concrete_fields
+            if field.attname in self.__dict__
+            and (names is None or field.name in names)
+        }
+        if names is None or getattr(self, "_loaded_values", None) is None:
+            self._loaded_values = values
+        else:
+            self._loaded_values.update(values)
+
+    def mark_clean(self, *names):
+        """
+        Treat ``names`` as saved with their current values. For fields
+        written straight to the database (e.g. ledger balances), so a later
+        plain save() doesn't write them back.
+        """
+        self._remember_values(names)
+
+    def loaded_value(self, attname, default=None):
+        """The value ``attname`` had when loaded or last saved (``default`` if unknown)"""
+        loaded = getattr(self, "_loaded_values", None)
+        if loaded is None or attname not in loaded:
+            return default
+        return loaded[attname]
+
+    def dirty_fields(self):
+        """Names of the fields changed since load/save, or None for untracked instances"""
+        loaded = getattr(self, "_loaded_values", None)
+        if loaded is None:
+            return None
+        return {
+            field.name
+            for field in self._meta.concrete_fields
+            if not field.primary_key
+            and field.attname in self.__dict__
+            and (
+                field.attname not in loaded
+                or self.__dict__[field.attname] != loaded[field.attname]
+            )
+        }
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None and not self._state.adding:
+            dirty = self.dirty_fields()
+            if dirty is not None:
+                dirty -= set(self.DIRTY_EXCLUDE)
+                if not dirty:
+                    return
+                # auto_now timestamps still move on every real write
+                dirty |= {
+                    field.name
+                    for field in self._meta.concrete_fields
+                    if getattr(field, "auto_now", False)
+                }
+                kwargs["update_fields"] = dirty
+        super().save(*args, **kwargs)
+        self._remember_values(kwargs.get("update_fields"))
 
 
 # Extends Django's built-in User model to include points
-class UserProfile(models.Model):
+class UserProfile(DirtyFieldsMixin, models.Model):
     USER_TYPE_CHOICES = [
         ("student", "Student"),
         ("teacher", "Teacher"),
@@ -19,7 +101,7 @@ class UserProfile(models.Model):
     ]
 
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="profile")
-    total_points = models.PositiveIntegerField(default=0)
+    total_points = models.PositiveIntegerField(default=0, db_index=True)
     # School ID Number - Works for ALL user types (students, teachers, admins)
     # Format: C22-0369 for students (C=class, 22=year, 0369=student number)
     # Format: SMCIC-***-**** for faculty/teachers
@@ -33,10 +115,34 @@ class UserProfile(models.Model):
     )
     # Keep the old field for backward compatibility
     qr_code_data = models.CharField(max_length=100, unique=True, blank=True, null=True)
+    # Normalized school ID (hyphens/spaces stripped, upper case) used to resolve
+    # any barcode/QR variant with one indexed query. Falls back to the username
+    # for profiles without a school ID. Maintained in save().
+    identity_key = models.CharField(
+        max_length=150, blank=True, null=True, db_index=True, editable=False
+    )
     # User type field to distinguish between student, teacher, and admin
     user_type = models.CharField(
         max_length=10, choices=USER_TYPE_CHOICES, default="student"
     )
+    # Lifetime deposit/redemption stats, maintained by core/ledger.py in the
+    # same UPDATE as total_points (verify with "manage.py backfill_profile_stats")
+    total_bottles = models.PositiveIntegerField(default=0, editable=False)
+    deposit_count = models.PositiveIntegerField(default=0, editable=False)
+    last_deposit_at = models.DateTimeField(null=True, blank=True, editable=False)
+    points_earned = models.PositiveIntegerField(default=0, editable=False)
+    points_redeemed = models.PositiveIntegerField(default=0, editable=False)
+
+    # Only ever written by the ledger, never by a full save() of a possibly
+    # stale instance
+    STAT_FIELDS = (
+        "total_bottles",
+        "deposit_count",
+        "last_deposit_at",
+        "points_earned",
+        "points_redeemed",
+    )
+    DIRTY_EXCLUDE = STAT_FIELDS
 
     def __str__(self):
         return self.user.username
@@ -44,63 +150,23 @@ class UserProfile(models.Model):
     @staticmethod
     def generate_student_id(year=None):
         """
-        Generate a student ID in format: C22-0369
+        Reserve a student ID in format: C22-0369
         C = class, 22 = year, 0369 = sequential number
         This is OPTIONAL - admins can manually enter any ID
         """
-        if year is None:
-            year = datetime.now().year % 100  # Get last 2 digits of year
+        from .school_ids import allocate_student_ids
 
-        # Get the last student ID for this year
-        last_student = (
-            UserProfile.objects.filter(
-                user_type="student", school_id__startswith=f"C{year:02d}-"
-            )
-            .order_by("-school_id")
-            .first()
-        )
-
-        if last_student and last_student.school_id:
-            try:
-                last_number = int(last_student.school_id.split("-")[1])
-                next_number = last_number + 1
-            except (IndexError, ValueError):
-                next_number = 1
-        else:
-            next_number = 1
-
-        return f"C{year:02d}-{next_number:04d}"
+        return allocate_student_ids(1, year)[0]
 
     @staticmethod
     def generate_faculty_id():
         """
-        Generate a faculty ID in format: SMCIC-001-0001
+        Reserve a faculty ID in format: SMCIC-001-0001
         This is OPTIONAL - admins can manually enter any ID
         """
-        # Get the last faculty ID
-        last_faculty = (
-            UserProfile.objects.filter(
-                user_type="teacher", school_id__startswith="SMCIC-"
-            )
-            .order_by("-school_id")
-            .first()
-        )
-
-        if last_faculty and last_faculty.school_id:
-            try:
-                parts = last_faculty.school_id.split("-")
-                if len(parts) >= 3:
-                    dept_num = int(parts[1])
-                    seq_num = int(parts[2])
-                    seq_num += 1
-                    if seq_num > 9999:
-                        dept_num += 1
-                        seq_num = 1
-                    return f"SMCIC-{dept_num:03d}-{seq_num:04d}"
-            except (IndexError, ValueError):
-                pass
-
-        return "SMCIC-001-0001"
+        from .school_ids import allocate_faculty_ids
+
+        return allocate_faculty_ids(1)[0]
 
     def save(self, *args, **kwargs):
         """
@@ -119,6 +185,31 @@ class UserProfile(models.Model):
                 # self.school_id = self.generate_faculty_id()
                 pass  # Leave empty - admin will fill it manually
 
+        from .identity import normalize_identifier
+
+        # The key falls back to the username, so only recompute it when its
+        # inputs may have changed or the user is at hand without a query
+        dirty = self.dirty_fields()
+        if (
+            dirty is None
+            or dirty & {"school_id", "user"}
+            or UserProfile.user.is_cached(self)
+        ):
+            self.identity_key = normalize_identifier(
+                self.school_id or self.user.username
+            )
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "school_id" in update_fields:
+            kwargs["update_fields"] = {*update_fields, "identity_key"}
+        elif update_fields is None and not self._state.adding and dirty is None:
+            # Not loaded from the database, so nothing is known about what
+            # changed: write everything except the ledger-owned stats
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.STAT_FIELDS
+            ]
+
         super().save(*args, **kwargs)
 
 
@@ -137,9 +228,11 @@ class Entry(models.Model):
 class RewardItem(models.Model):
     reward_name = models.CharField(max_length=100)
     points_required = models.PositiveIntegerField()
-    # You can add quantity or status if needed
-    # quantity = models.PositiveIntegerField(default=100)
-    # is_active = models.BooleanField(default=True)
+    # Items left to redeem; empty means unlimited. Redemptions take stock
+    # with a conditional UPDATE in ledger.redeem_reward
+    stock = models.PositiveIntegerField(null=True, blank=True)
+    # Inactive rewards are hidden from students and can't be redeemed
+    is_active = models.BooleanField(default=True)
     image = models.ImageField(
         upload_to="rewards/", null=True, blank=True
     )  # Image for reward icon
@@ -157,24 +250,24 @@ class RedeemedPoints(models.Model):
     receipt_number = models.CharField(max_length=30, unique=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    RECEIPT_SEQUENCE = "receipt"
+
     def __str__(self):
         qty_str = f" x{self.quantity}" if self.quantity > 1 else ""
         return f"{self.user_profile.user.username} redeemed {self.reward_item.reward_name}{qty_str}"
 
     def generate_receipt_number(self):
-        """Generate unique receipt number like SMCEcoDrop-2025-10232145"""
-        import random
+        """
+        Receipt number like SMCEcoDrop-2025-10232145000123: the minute it was
+        issued plus six digits of the receipt sequence, so no two receipts
+        ever share a number and none has to be probed for
+        """
         from django.utils import timezone
+        from .sequences import reserve
 
+        number = reserve(self.RECEIPT_SEQUENCE)
         now = timezone.now()
-        year = now.strftime("%Y")
-        date_time = now.strftime("%m%d%H%M")  # MMDDHHMI format
-
-        while True:
-            random_num = random.randint(10, 99)
-            receipt_num = f"SMCEcoDrop-{year}-{date_time}{random_num}"
-            if not RedeemedPoints.objects.filter(receipt_number=receipt_num).exists():
-                return receipt_num
+        return f"SMCEcoDrop-{now:%Y}-{now:%m%d%H%M}{number % 1000000:06d}"
 
     def save(self, *args, **kwargs):
         if not self.receipt_number:
@@ -197,7 +290,7 @@ class RedeemedPoints(models.Model):
 
 
 # Physical device management
-class Device(models.Model):
+class Device(DirtyFieldsMixin, models.Model):
     DEVICE_STATUS_CHOICES = [
         ("online", "Online"),
         ("offline", "Offline"),
@@ -212,7 +305,8 @@ class Device(models.Model):
     status = models.CharField(
         max_length=20, choices=DEVICE_STATUS_CHOICES, default="offline"
     )
-    last_heartbeat = models.DateTimeField(null=True, blank=True)
+    # Indexed for the liveness rollup (see core/liveness.py)
+    last_heartbeat = models.DateTimeField(null=True, blank=True, db_index=True)
     total_bottles_processed = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -248,5 +342,107 @@ class DeviceLog(models.Model):
     message = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Newest-first listings and the retention cutoff
+            models.Index(fields=["created_at"], name="devicelog_created_idx"),
+            models.Index(fields=["device", "created_at"], name="devicelog_device_idx"),
+        ]
+
     def __str__(self):
         return f"{self.device.device_name} - {self.log_type} at {self.created_at}"
+
+
+# Per-device log counts for one hour or day, kept after the raw DeviceLog
+# rows are pruned (see core/log_rollup.py)
+class DeviceLogRollup(models.Model):
+    PERIOD_CHOICES = [
+        ("hour", "Hourly"),
+        ("day", "Daily"),
+    ]
+
+    device = models.ForeignKey(Device, on_delete=models.CASCADE)
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    period_start = models.DateTimeField()
+    log_type = models.CharField(max_length=20, choices=DeviceLog.LOG_TYPE_CHOICES)
+    # Empty when the logs had no sort result
+    sort_result = models.CharField(max_length=10, blank=True, default="")
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["device", "period", "period_start", "log_type", "sort_result"],
+                name="unique_devicelog_rollup",
+            )
+        ]
+        indexes = [models.Index(fields=["period", "period_start"])]
+
+    def __str__(self):
+        return f"{self.device.device_name} - {self.log_type} x{self.count} ({self.period} of {self.period_start})"
+
+
+# Processed device submissions, kept for a retention window so that a
+# retried POST (flaky WiFi) is answered with the original response
+class DeviceEvent(models.Model):
+    device = models.ForeignKey(Device, on_delete=models.CASCADE, null=True, blank=True)
+    # "<device pk>:<event id>" ("legacy:<event id>" for /api/deposit/)
+    event_key = models.CharField(max_length=200, unique=True)
+    response = models.JSONField(null=True, blank=True)
+    status_code = models.PositiveSmallIntegerField(default=200)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.event_key} ({self.status_code})"
+
+
+# Running totals (bottles, points, users) maintained by the deposit,
+# redemption and user paths so dashboards never aggregate whole tables.
+# Rebuilt from scratch with "manage.py reconcile_counters".
+class GlobalCounter(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} = {self.value}"
+
+
+# Named counters that hand out unique numbers (receipt numbers, school IDs).
+# ``value`` is the last number reserved; see core/sequences.py.
+class Sequence(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} @ {self.value}"
+
+
+# Points earned per user in a leaderboard window (week or month), bumped on
+# every deposit. All-time rankings use UserProfile.total_points.
+class LeaderboardScore(models.Model):
+    PERIOD_CHOICES = [
+        ("week", "Weekly"),
+        ("month", "Monthly"),
+    ]
+
+    period = models.CharField(max_length=5, choices=PERIOD_CHOICES)
+    period_start = models.DateField()
+    user_profile = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
+    points = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["period", "period_start", "user_profile"],
+                name="unique_leaderboard_score",
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=["period", "period_start", "-points"],
+                name="leaderboard_rank_idx",
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.user_profile} - {self.points} ({self.period} of {self.period_start})"
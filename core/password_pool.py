@@ -0,0 +1,45 @@
+# ======================================================================
+# core/password_pool.py
+# Parallel password hashing for bulk account imports (core/enrollment.py).
+# A PBKDF2 hash is deliberately slow, so it is the bulk of an import's run
+# time; here it is spread over spawned worker processes. This module must
+# stay importable before Django is set up (workers import it to find the
+# functions they run), so it imports no models.
+# ======================================================================
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+
+
+def _setup_worker():
+    import django
+
+    django.setup()
+
+
+def _hash_chunk(passwords):
+    return [make_password(password) for password in passwords]
+
+
+def hash_passwords(passwords, workers=None, chunk=50):
+    """Hash ``passwords`` in order, spread over IMPORT_HASH_WORKERS processes"""
+    if workers is None:
+        workers = getattr(settings, "IMPORT_HASH_WORKERS", 0)
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(passwords) <= chunk:
+        return _hash_chunk(passwords)
+    chunks = [
+        passwords[start : start + chunk] for start in range(0, len(passwords), chunk)
+    ]
+    # Spawned, not forked, so no worker shares this process's database
+    # connection; they inherit DJANGO_SETTINGS_MODULE and set Django up
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=context, initializer=_setup_worker
+    ) as executor:
+        hashed = executor.map(_hash_chunk, chunks)
+        return [password for passwords in hashed for password in passwords]
@@ -0,0 +1,83 @@
+# ======================================================================
+# core/profile_stats.py
+# Verification and backfill of the per-user stats on UserProfile
+# (total_bottles, deposit_count, last_deposit_at, points_earned,
+# points_redeemed). The ledger keeps them current; this recomputes them
+# from Entry/RedeemedPoints one chunk of profiles at a time.
+# ======================================================================
+
+from django.db import transaction
+from django.db.models import Count, Max, Sum
+
+from .models import Entry, RedeemedPoints, UserProfile
+
+
+def compute(profile_pks):
+    """Return ``{pk: stats}`` recomputed from the source tables"""
+    stats = {
+        pk: {
+            "total_bottles": 0,
+            "deposit_count": 0,
+            "last_deposit_at": None,
+            "points_earned": 0,
+            "points_redeemed": 0,
+        }
+        for pk in profile_pks
+    }
+    entries = (
+        Entry.objects.filter(user_profile_id__in=profile_pks)
+        .values("user_profile_id")
+        .annotate(
+            total_bottles=Sum("no_bottle"),
+            deposit_count=Count("pk"),
+            last_deposit_at=Max("created_at"),
+            points_earned=Sum("points"),
+        )
+        .order_by()
+    )
+    for row in entries:
+        stats[row.pop("user_profile_id")].update(row)
+    redeemed = (
+        RedeemedPoints.objects.filter(user_profile_id__in=profile_pks)
+        .values("user_profile_id")
+        .annotate(points_redeemed=Sum("redeemed_points"))
+        .order_by()
+    )
+    for row in redeemed:
+        stats[row["user_profile_id"]]["points_redeemed"] = row["points_redeemed"]
+    return stats
+
+
+def backfill(batch_size=1000, fix=True):
+    """
+    Compare every profile's stats with the source tables, chunk by chunk.
+    Returns ``(checked, mismatched)``; mismatches are rewritten when ``fix``.
+    """
+    checked = mismatched = 0
+    last_pk = 0
+    while True:
+        # When fixing, lock the chunk's rows until the rewrite: the ledger
+        # changes stats with relative UPDATEs, so a deposit waits for the
+        # lock and is applied on top of the recomputed values instead of
+        # being overwritten by them
+        with transaction.atomic():
+            profiles = UserProfile.objects.filter(pk__gt=last_pk).order_by("pk")
+            if fix:
+                profiles = profiles.select_for_update()
+            profiles = list(profiles.only("pk", *UserProfile.STAT_FIELDS)[:batch_size])
+            if not profiles:
+                return checked, mismatched
+            last_pk = profiles[-1].pk
+            expected = compute([profile.pk for profile in profiles])
+
+            stale = []
+            for profile in profiles:
+                values = expected[profile.pk]
+                if any(getattr(profile, name) != value for name, value in values.items()):
+                    for name, value in values.items():
+                        setattr(profile, name, value)
+                    stale.append(profile)
+            checked += len(profiles)
+            mismatched += len(stale)
+            if fix and stale:
+                UserProfile.objects.bulk_update(stale, UserProfile.STAT_FIELDS)
@@ -0,0 +1,137 @@
+# ======================================================================
+# core/reward_catalog.py
+# The student reward catalog, served from a per-process snapshot.
+# The catalog changes a few times a semester but is read on every visit
+# to the rewards page, so each worker keeps the active rewards sorted by
+# cost together with a small search index (case-folded names, sorted
+# point costs) and searches and paginates in memory. A version number in
+# the shared cache tells every worker to rebuild after a reward is
+# added, edited or deleted. Stock changes with every redemption, so it is
+# not part of the snapshot: with_stock() reads the live counts of the
+# limited rewards actually shown.
+# ======================================================================
+
+import copy
+import re
+import threading
+import time
+from bisect import bisect_left, bisect_right
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import RewardItem
+
+VERSION_KEY = "reward-catalog:version"
+POINT_RANGE = re.compile(r"^(\d+)\s*-\s*(\d+)$")
+
+_lock = threading.Lock()
+_snapshot = None
+
+
+class _Catalog:
+    """Active rewards ordered by cost, with what searching them needs"""
+
+    def __init__(self, version, rewards):
+        self.version = version
+        self.built = time.monotonic()
+        self.rewards = rewards
+        self.names = [reward.reward_name.casefold() for reward in rewards]
+        # Rewards are already ordered by cost, so this is sorted too
+        self.points = [reward.points_required for reward in rewards]
+        # Unlimited (NULL stock) rewards never need a live stock read
+        self.limited = {reward.pk for reward in rewards if reward.stock is not None}
+
+    def costing(self, low, high):
+        """Indexes of the rewards costing ``low`` to ``high`` points"""
+        return range(bisect_left(self.points, low), bisect_right(self.points, high))
+
+    def search(self, query):
+        """
+        Rewards matching ``query``, cheapest first:
+        "100-500" - costing 100 to 500 points
+        "300"     - affordable with 300 points, or with "300" in the name
+        other     - every word appears in the name (any case)
+        """
+        query = " ".join(query.split())
+        if not query:
+            return self.rewards
+        match = POINT_RANGE.match(query)
+        if match:
+            low, high = sorted(int(number) for number in match.groups())
+            return [self.rewards[index] for index in self.costing(low, high)]
+        words = query.casefold().split()
+        found = {
+            index
+            for index, name in enumerate(self.names)
+            if all(word in name for word in words)
+        }
+        if query.isdigit():
+            found.update(self.costing(0, int(query)))
+        return [self.rewards[index] for index in sorted(found)]
+
+
+def _version():
+    return cache.get(VERSION_KEY, 0)
+
+
+def _load(version):
+    rewards = RewardItem.objects.filter(is_active=True).order_by(
+        "points_required", "reward_name", "pk"
+    )
+    return _Catalog(version, list(rewards))
+
+
+def catalog():
+    """The current snapshot, rebuilt when invalidated or too old"""
+    global _snapshot
+    version = _version()
+    max_age = getattr(settings, "REWARD_CATALOG_MAX_AGE", 600)
+    with _lock:
+        snapshot = _snapshot
+        if (
+            snapshot is None
+            or snapshot.version != version
+            or time.monotonic() - snapshot.built > max_age
+        ):
+            snapshot = _snapshot = _load(version)
+        return snapshot
+
+
+def search(query=""):
+    """Active rewards matching ``query`` (all of them if blank), cheapest first"""
+    return catalog().search(query or "")
+
+
+def with_stock(rewards):
+    """
+    ``rewards`` (from search()) with their current stock: one query for
+    the limited ones among them, none if all are unlimited. The snapshot's
+    instances are shared, so updated copies are returned.
+    """
+    limited = catalog().limited
+    pks = [reward.pk for reward in rewards if reward.pk in limited]
+    if not pks:
+        return list(rewards)
+    stock = dict(
+        RewardItem.objects.filter(pk__in=pks).values_list("pk", "stock")
+    )
+    result = []
+    for reward in rewards:
+        if reward.pk in stock:
+            reward = copy.copy(reward)
+            reward.stock = stock[reward.pk]
+        result.append(reward)
+    return result
+
+
+def invalidate():
+    """Make every worker rebuild its snapshot on its next read"""
+    global _snapshot
+    with _lock:
+        _snapshot = None
+    cache.add(VERSION_KEY, 0, None)
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:  # Evicted between add() and incr()
+        cache.set(VERSION_KEY, 1, None)
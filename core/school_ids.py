@@ -0,0 +1,95 @@
+# ======================================================================
+# core/school_ids.py
+# School ID allocation on top of core/sequences.py.
+# Students: C<YY>-<NNNN> with one sequence per enrollment year.
+# Faculty:  SMCIC-<DDD>-<NNNN> with one sequence; every 9999 numbers move
+#           on to the next department block (as generate_faculty_id did).
+# IDs are reserved atomically (a block of N in one statement for bulk
+# enrollment) instead of incrementing the highest ID found by a string
+# sort. IDs typed in by hand are reported through observe() so the
+# sequence always moves past them.
+# ======================================================================
+
+import re
+
+from django.utils import timezone
+
+from . import sequences
+
+FACULTY_PREFIX = "SMCIC"
+FACULTY_PER_DEPARTMENT = 9999
+FACULTY_SEQUENCE = "school_id:SMCIC"
+
+STUDENT_PATTERN = re.compile(r"^C(\d{2})-(\d{1,6})$")
+FACULTY_PATTERN = re.compile(r"^SMCIC-(\d{3})-(\d{4})$")
+
+
+def _year(year=None):
+    return timezone.localdate().year % 100 if year is None else year % 100
+
+
+def student_sequence(year=None):
+    return f"school_id:C{_year(year):02d}"
+
+
+def format_student_id(year, number):
+    return f"C{year % 100:02d}-{number:04d}"
+
+
+def format_faculty_id(number):
+    department, position = divmod(number - 1, FACULTY_PER_DEPARTMENT)
+    return f"{FACULTY_PREFIX}-{department + 1:03d}-{position + 1:04d}"
+
+
+def sequence_position(school_id):
+    """``(sequence name, number)`` that ``school_id`` occupies, or None"""
+    school_id = (school_id or "").strip().upper()
+    match = STUDENT_PATTERN.match(school_id)
+    if match:
+        return student_sequence(int(match.group(1))), int(match.group(2))
+    match = FACULTY_PATTERN.match(school_id)
+    if match:
+        department, position = int(match.group(1)), int(match.group(2))
+        if department and position:
+            number = (department - 1) * FACULTY_PER_DEPARTMENT + position
+            return FACULTY_SEQUENCE, number
+    return None
+
+
+def allocate_student_ids(count=1, year=None):
+    """Reserve ``count`` consecutive student IDs for the enrollment year"""
+    year = _year(year)
+    first = sequences.reserve(student_sequence(year), count)
+    return [format_student_id(year, number) for number in range(first, first + count)]
+
+
+def allocate_faculty_ids(count=1):
+    """Reserve ``count`` consecutive faculty IDs"""
+    first = sequences.reserve(FACULTY_SEQUENCE, count)
+    return [format_faculty_id(number) for number in range(first, first + count)]
+
+
+def allocate(user_type, count=1, year=None):
+    """Reserve IDs for ``user_type`` ([] for types that don't get one)"""
+    if user_type == "student":
+        return allocate_student_ids(count, year)
+    if user_type == "teacher":
+        return allocate_faculty_ids(count)
+    return []
+
+
+def peek(user_type, year=None):
+    """The ID the next allocation will probably get, for display only"""
+    if user_type == "student":
+        year = _year(year)
+        return format_student_id(year, sequences.current(student_sequence(year)) + 1)
+    if user_type == "teacher":
+        return format_faculty_id(sequences.current(FACULTY_SEQUENCE) + 1)
+    return None
+
+
+def observe(school_id):
+    """Move the matching sequence past an ID that was assigned by hand"""
+    position = sequence_position(school_id)
+    if position is not None:
+        sequences.advance_to(*position)
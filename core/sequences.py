@@ -0,0 +1,72 @@
+# ======================================================================
+# core/sequences.py
+# Named number sequences backed by the Sequence table.
+# reserve() hands out a block of consecutive numbers with one upsert, so
+# callers never probe for a free number and never race on a unique
+# constraint. The reservation is part of the caller's transaction: if
+# that rolls back, so does the reservation (and whatever used it).
+# ======================================================================
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+
+from .models import Sequence
+
+
+def reserve(name, count=1):
+    """
+    Reserve ``count`` consecutive numbers of sequence ``name`` (created on
+    first use, counting from 1) and return the first of them
+    """
+    if count < 1:
+        raise ValueError("count must be at least 1")
+    features = connection.features
+    if (
+        connection.vendor in ("postgresql", "sqlite")
+        and features.supports_update_conflicts_with_target
+        and features.can_return_columns_from_insert
+    ):
+        # PostgreSQL and SQLite >= 3.35: create-or-bump and read back in one
+        # statement; the row lock serializes concurrent reservations
+        table = connection.ops.quote_name(Sequence._meta.db_table)
+        sql = (
+            f"INSERT INTO {table} (name, value) VALUES (%s, %s) "
+            f"ON CONFLICT (name) DO UPDATE SET value = {table}.value + excluded.value "
+            f"RETURNING value"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [name, count])
+            last = cursor.fetchone()[0]
+        return last - count + 1
+
+    # Fallback: the UPDATE takes the row lock, so the read that follows in
+    # the same transaction sees our own increment
+    with transaction.atomic():
+        if not Sequence.objects.filter(name=name).update(value=F("value") + count):
+            try:
+                with transaction.atomic():
+                    Sequence.objects.create(name=name, value=count)
+                return 1
+            except IntegrityError:  # Created concurrently: bump it instead
+                Sequence.objects.filter(name=name).update(value=F("value") + count)
+        last = Sequence.objects.filter(name=name).values_list("value", flat=True).get()
+    return last - count + 1
+
+
+def current(name):
+    """Last number reserved from ``name`` (0 if never used)"""
+    return (
+        Sequence.objects.filter(name=name).values_list("value", flat=True).first() or 0
+    )
+
+
+def advance_to(name, value):
+    """
+    Make sure later reservations of ``name`` return numbers above ``value``
+    (for numbers that were handed out by hand)
+    """
+    if Sequence.objects.filter(name=name, value__lt=value).update(value=value):
+        return
+    Sequence.objects.bulk_create([Sequence(name=name, value=value)], ignore_conflicts=True)
+    # Lost a creation race to reserve(): the row exists now, so bump it
+    Sequence.objects.filter(name=name, value__lt=value).update(value=value)
@@ -1,7 +1,11 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, post_init, pre_save
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import UserProfile
+from .models import UserProfile, Device, RewardItem, RedeemedPoints
+from . import counters, dashboard, reward_catalog, school_ids
+from .device_auth import invalidate_api_key
+from .identity import known_identifiers
 import uuid
 
 @receiver(post_save, sender=User)
@@ -17,6 +21,102 @@ def create_user_profile(sender, instance, created, **kwargs):
 
 @receiver(post_save, sender=User)
 def save_user_profile(sender, instance, **kwargs):
-    """Save the UserProfile when the User is saved"""
-    if hasattr(instance, 'profile'):
+    """Save the UserProfile with the User if it was loaded (and changed)"""
+    # Only an already-fetched profile can carry edits, so don't fetch one on
+    # every User save (e.g. last_login on each login) - unless the username
+    # changed, which the profile's identity key may be derived from
+    if User.profile.is_cached(instance) or (
+        instance.username != instance._loaded_username and hasattr(instance, 'profile')
+    ):
         instance.profile.save()
+    instance._loaded_username = instance.username
+
+@receiver(post_init, sender=User)
+def remember_staff_flag(sender, instance, **kwargs):
+    """Remember the loaded is_staff flag and username so changes can be noticed"""
+    instance._loaded_is_staff = instance.is_staff
+    instance._loaded_username = instance.username
+
+@receiver(post_save, sender=User)
+def count_staff_change(sender, instance, created, **kwargs):
+    """Keep the staff_users counter in step with is_staff edits"""
+    if not created and instance.is_staff != instance._loaded_is_staff:
+        counters.bump(staff_users=1 if instance.is_staff else -1)
+    instance._loaded_is_staff = instance.is_staff
+
+@receiver(pre_save, sender=UserProfile)
+def remember_stored_points(sender, instance, update_fields, **kwargs):
+    """Read the stored balance so a direct total_points edit can be counted"""
+    if instance._state.adding:
+        instance._points_before = 0
+    elif update_fields is not None and "total_points" not in update_fields:
+        instance._points_before = instance.total_points
+    else:
+        instance._points_before = (
+            UserProfile.objects.filter(pk=instance.pk)
+            .values_list("total_points", flat=True)
+            .first()
+            or 0
+        )
+
+@receiver(post_save, sender=UserProfile)
+def count_profile_save(sender, instance, created, **kwargs):
+    """Update the user and points-balance counters"""
+    counters.profile_saved(instance, created, instance._points_before)
+
+@receiver(post_delete, sender=UserProfile)
+def count_profile_delete(sender, instance, **kwargs):
+    """Remove a deleted profile from the counters"""
+    counters.profile_deleted(instance)
+
+@receiver(post_save, sender=UserProfile)
+def index_profile_identifiers(sender, instance, created, **kwargs):
+    """Keep the known-identifier set used by api_user_verify up to date"""
+    # Adding bumps the shared generation (every worker rebuilds, cached misses
+    # are dropped), so only do it when an identifier really changed - not for
+    # points or stats saves. Unknown loaded values count as changed. It waits
+    # for the commit: a worker rebuilding before then would adopt the new
+    # generation without the new row and answer "not found" for it.
+    unknown = object()
+    if created or any(
+        getattr(instance, name) != instance.loaded_value(name, unknown)
+        for name in ("identity_key", "qr_code_data")
+    ):
+        transaction.on_commit(lambda: known_identifiers.add(instance))
+
+@receiver(post_save, sender=UserProfile)
+def advance_school_id_sequence(sender, instance, **kwargs):
+    """Keep the ID allocator ahead of IDs that were typed in by hand"""
+    if instance.school_id and instance.school_id != instance.loaded_value("school_id"):
+        school_ids.observe(instance.school_id)
+
+@receiver(post_save, sender=Device)
+def invalidate_device_auth_on_save(sender, instance, **kwargs):
+    """Drop cached authentication for the old and the current API key"""
+    # After the commit, so a concurrent lookup can't re-cache the old row
+    old_api_key, api_key = instance.loaded_value("api_key"), instance.api_key
+    transaction.on_commit(
+        lambda: invalidate_api_key(old_api_key, api_key, revoke=old_api_key != api_key)
+    )
+
+@receiver(post_delete, sender=Device)
+def invalidate_device_auth_on_delete(sender, instance, **kwargs):
+    """Revoke cached authentication for a deleted device"""
+    api_keys = (instance.loaded_value("api_key"), instance.api_key)
+    transaction.on_commit(lambda: invalidate_api_key(*api_keys))
+
+@receiver([post_save, post_delete], sender=Device)
+def invalidate_device_widgets(sender, **kwargs):
+    """Rebuild the admin dashboard device widgets after a device change"""
+    dashboard.invalidate("devices")
+
+@receiver([post_save, post_delete], sender=RewardItem)
+@receiver([post_save, post_delete], sender=RedeemedPoints)
+def invalidate_reward_widgets(sender, **kwargs):
+    """Rebuild the admin dashboard reward widgets after a redemption or reward edit"""
+    dashboard.invalidate("rewards")
+
+@receiver([post_save, post_delete], sender=RewardItem)
+def invalidate_reward_catalog(sender, **kwargs):
+    """Rebuild the student reward catalog once a reward change is committed"""
+    transaction.on_commit(reward_catalog.invalidate)
@@ -1,3 +1,1648 @@
-from django.test import TestCase
+import re
+import tempfile
+import threading
+import time
+import zipfile
+from io import BytesIO
+from pathlib import Path
+from unittest import mock
+from datetime import timedelta
 
-# Create your tests here.
+from django.contrib.auth import authenticate
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+
+from . import barcode_cache, counters, deposit_sessions, device_auth, enrollment, heartbeats, id_card_export, id_cards, leaderboard, ledger, liveness, log_rollup, profile_stats, reward_catalog, school_ids, sequences
+from .identity import known_identifiers, normalize_identifier, resolve_profile
+from .models import UserProfile, Entry, RewardItem, RedeemedPoints, Device, DeviceLog, DeviceEvent, DeviceLogRollup, LeaderboardScore
+
+
+def run_in_threads(target, count):
+    """Run ``target(index)`` in ``count`` threads and return raised exceptions"""
+    errors = []
+    barrier = threading.Barrier(count)
+
+    def worker(index):
+        try:
+            barrier.wait()
+            target(index)
+        except Exception as e:  # pragma: no cover - surfaced by the caller
+            errors.append(e)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+class LedgerTests(TestCase):
+    def setUp(self):
+        self.profile = User.objects.create_user("ledger", password="x").profile
+
+    def test_credit_returns_new_balance(self):
+        self.assertEqual(ledger.credit_points(self.profile.pk, 30), 30)
+        self.assertEqual(ledger.credit_points(self.profile.pk, 5), 35)
+
+    def test_debit_is_guarded(self):
+        ledger.credit_points(self.profile.pk, 20)
+        with self.assertRaises(ledger.InsufficientPoints):
+            ledger.debit_points(self.profile.pk, 25)
+        self.assertEqual(ledger.debit_points(self.profile.pk, 20), 0)
+
+    def test_record_deposit(self):
+        device = Device.objects.create(
+            device_id="LEDGER", device_name="Ledger", location="Lab", api_key="k"
+        )
+        entry, balance = ledger.record_deposit(self.profile, bottles=3, device=device)
+        device.refresh_from_db()
+        self.assertEqual(balance, 30)
+        self.assertEqual(self.profile.total_points, 30)
+        self.assertEqual(entry.no_bottle, 3)
+        self.assertEqual(device.total_bottles_processed, 3)
+
+    def test_update_returning_is_chosen_by_vendor(self):
+        self.assertTrue(ledger.supports_update_returning())
+        # MariaDB returns columns from INSERT but not from UPDATE
+        with mock.patch.object(connection, "vendor", "mysql"):
+            self.assertFalse(ledger.supports_update_returning())
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(ledger.credit_points(self.profile.pk, 7), 7)
+            self.assertFalse([q for q in queries if "RETURNING" in q["sql"]])
+            self.assertEqual(sequences.reserve("vendor", 2), 1)
+
+
+class ProfileStatsTests(TestCase):
+    def setUp(self):
+        self.profile = User.objects.create_user("stats", password="x").profile
+
+    def test_ledger_maintains_stats_and_full_save_keeps_them(self):
+        stale = UserProfile.objects.get(pk=self.profile.pk)
+        ledger.record_deposit(self.profile, bottles=3)
+        ledger.credit_points(self.profile.pk, 20, bottles=2, deposits=2)
+        ledger.debit_points(self.profile.pk, 15)
+
+        stale.school_id = "C24-0300"
+        stale.save()  # Must not clobber the ledger-maintained stats
+
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.total_bottles, 5)
+        self.assertEqual(self.profile.deposit_count, 3)
+        self.assertEqual(self.profile.points_earned, 50)
+        self.assertEqual(self.profile.points_redeemed, 15)
+        self.assertIsNotNone(self.profile.last_deposit_at)
+
+    def test_backfill_repairs_drift(self):
+        ledger.record_deposit(self.profile, bottles=2)
+        UserProfile.objects.filter(pk=self.profile.pk).update(total_bottles=99)
+
+        self.assertEqual(profile_stats.backfill(batch_size=1, fix=False)[1], 1)
+        self.assertEqual(profile_stats.backfill(batch_size=1)[1], 1)
+        self.assertEqual(profile_stats.backfill()[1], 0)
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.total_bottles, 2)
+
+
+class BarcodeCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("barcode", password="x")
+        self.user.profile.school_id = "C24-0400"
+        self.user.profile.save()
+        self.client.force_login(self.user)
+
+    def test_renders_once_and_answers_304_without_rendering(self):
+        render = mock.patch.object(
+            barcode_cache,
+            "generate_barcode_buffer",
+            wraps=barcode_cache.generate_barcode_buffer,
+        )
+        with render as rendered:
+            first = self.client.get("/generate-qr-code/")
+            second = self.client.get("/generate-qr-code/")
+            revalidated = self.client.get(
+                "/generate-qr-code/", HTTP_IF_NONE_MATCH=first["ETag"]
+            )
+        self.assertEqual(rendered.call_count, 1)
+        self.assertEqual(first.content, second.content)
+        self.assertTrue(first.content.startswith(b"\x89PNG"))
+        self.assertFalse(first["ETag"].startswith("W/"))
+        self.assertIn("private", first["Cache-Control"])
+        self.assertEqual(revalidated.status_code, 304)
+
+        self.user.profile.school_id = "C24-0401"
+        self.user.profile.save()
+        changed = self.client.get("/generate-qr-code/")
+        self.assertNotEqual(changed["ETag"], first["ETag"])
+
+    def test_disk_cache_evicts_least_recently_used(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(BARCODE_CACHE_DIR=directory):
+                size = len(barcode_cache.get_png("C24-0001"))
+                with override_settings(BARCODE_CACHE_MAX_BYTES=int(size * 2.5)):
+                    for number in range(2, 6):
+                        barcode_cache.get_png(f"C24-000{number}")
+                files = list(Path(directory).glob("*/*.png"))
+                self.assertLessEqual(sum(f.stat().st_size for f in files), size * 2.5)
+                self.assertIn(
+                    barcode_cache.digest("C24-0005"), [f.stem for f in files]
+                )
+
+
+class IdCardRendererTests(TestCase):
+    def test_card_layout_and_cached_resources(self):
+        user = User.objects.create_user("card", password="x", first_name="Ana", last_name="Cruz")
+        user.profile.school_id = "C24-0500"
+        user.profile.save()
+        self.assertEqual(id_cards.card_details(user), ("ANA CRUZ", "C24-0500"))
+        card = Image.open(id_cards.render_png(user))
+        self.assertEqual(card.size, (id_cards.WIDTH, id_cards.HEIGHT))
+        self.assertIs(id_cards.font("name"), id_cards.font("name"))
+        self.assertEqual(card.getpixel((5, 5)), (30, 64, 175))  # Header blue
+
+    def test_barcode_is_drawn_from_modules_without_resampling(self):
+        image = id_cards.barcode_image("C24-0500")
+        self.assertEqual(image.size, id_cards.BARCODE_SIZE)
+        self.assertEqual(set(image.getdata()), {0, 255})
+        row = [image.getpixel((x, 60)) for x in range(image.width)]
+        first, last = row.index(0), len(row) - row[::-1].index(0)
+        modules = id_cards.barcode.get_barcode_class("code128")("C240500").build()[0]
+        module = (last - first) // len(modules)
+        drawn = "".join("1" if row[x] == 0 else "0" for x in range(first, last, module))
+        self.assertEqual(drawn, modules.rstrip("0"))
+
+
+
+@override_settings(ID_CARD_EXPORT_WORKERS=1)
+class IdCardExportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        for number in range(12):
+            user = User.objects.create_user(f"card{number}", password="x")
+            user.profile.school_id = f"C25-{number:04d}"
+            user.profile.save()
+        teacher = User.objects.create_user("prof", password="x", first_name="Pat")
+        teacher.profile.user_type = "teacher"
+        teacher.profile.school_id = "SMCIC-001-2025"
+        teacher.profile.save()
+        self.staff = User.objects.create_user("registrar", password="x", is_staff=True)
+
+    def test_filters_and_sheet_layout(self):
+        self.assertEqual(len(id_card_export.select_cards()), 13)
+        self.assertEqual(
+            id_card_export.select_cards(user_type="teacher"), [("PAT", "SMCIC-001-2025")]
+        )
+        cards = id_card_export.select_cards(id_prefix="C25-")
+        self.assertEqual(len(cards), 12)
+
+        archive = BytesIO()
+        self.assertEqual(id_card_export.export(cards, "zip", archive), 2)
+        with zipfile.ZipFile(archive) as opened:
+            self.assertEqual(opened.namelist(), ["sheet-0001.png", "sheet-0002.png"])
+            sheet = Image.open(BytesIO(opened.read("sheet-0001.png")))
+            self.assertEqual(sheet.size, id_cards.SHEET_SIZE)
+
+    def test_pdf_pages_and_cross_reference(self):
+        pdf = BytesIO()
+        pages = id_card_export.export(id_card_export.select_cards(), "pdf", pdf)
+        data = pdf.getvalue()
+        self.assertEqual(pages, 2)
+        self.assertTrue(data.startswith(b"%PDF-1.4"))
+        self.assertIn(b"/Count 2", data)
+        xref = int(data[data.rindex(b"startxref") :].split()[1])
+        entries = data[xref:].split(b"\n")[3:]
+        for number, entry in enumerate(entries[: 3 * pages + 2], 1):
+            offset = int(entry[:10])
+            self.assertTrue(data[offset:].startswith(f"{number} 0 obj".encode()))
+
+    def test_staff_export_runs_in_background(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(ID_CARD_EXPORT_DIR=directory):
+                self.client.force_login(User.objects.get(username="card0"))
+                forbidden = self.client.post("/console/id-cards/export/", {"format": "pdf"})
+                self.assertEqual(forbidden.status_code, 403)
+
+                self.client.force_login(self.staff)
+                started = self.client.post(
+                    "/console/id-cards/export/",
+                    {
+                        "format": "pdf",
+                        "user_ids": [self.staff.pk, User.objects.get(username="prof").pk],
+                    },
+                )
+                self.assertEqual(started.status_code, 202)
+                self.assertEqual(started.json()["cards"], 1)  # Staff has no school ID
+
+                deadline = time.monotonic() + 30
+                while True:
+                    job = self.client.get(started.json()["status_url"]).json()
+                    if job["state"] != "running" or time.monotonic() > deadline:
+                        break
+                    time.sleep(0.05)
+                self.assertEqual(job["state"], "done")
+                download = self.client.get(job["download_url"])
+                self.assertTrue(b"".join(download.streaming_content).startswith(b"%PDF"))
+                download.close()
+
+
+class GlobalCounterTests(TestCase):
+    def setUp(self):
+        counters.reconcile()
+
+    def test_counters_follow_every_write_path(self):
+        profile = User.objects.create_user("counted", password="x").profile
+        staff = User.objects.create_user("staffer", password="x", is_staff=True)
+        device = Device.objects.create(
+            device_id="COUNT", device_name="Count", location="Lab", api_key="count"
+        )
+        ledger.record_deposit(profile, bottles=4, device=device)
+        ledger.record_deposit(profile, bottles=2)
+        reward = RewardItem.objects.create(reward_name="Pen", points_required=15)
+        ledger.debit_points(profile.pk, 15)
+        RedeemedPoints.objects.create(
+            user_profile=profile, reward_item=reward, redeemed_points=15
+        )
+
+        profile.total_points = 100  # Admin edit
+        profile.save()
+        staff.is_staff = False
+        staff.save()
+        User.objects.create_user("gone", password="x").delete()
+
+        self.assertEqual(counters.get_many(), counters.compute())
+        totals = counters.get_many()
+        self.assertEqual(totals[counters.BOTTLES], 6)
+        self.assertEqual(totals[counters.POINTS_REDEEMED], 15)
+        self.assertEqual(totals[counters.STAFF_USERS], 0)
+
+    def test_reconcile_repairs_drift(self):
+        User.objects.create_user("drift", password="x")
+        counters.bump(**{counters.USERS: 5})
+        changes = counters.reconcile()
+        self.assertNotEqual(*changes[counters.USERS])
+        self.assertEqual(counters.get_many(), counters.compute())
+
+    @override_settings(
+        STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage"
+    )
+    def test_dashboards_do_not_aggregate_tables(self):
+        staff = User.objects.create_user("admin", password="x", is_staff=True)
+        self.client.force_login(staff)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/admin_dashboard/")
+        self.assertEqual(response.status_code, 200)
+        sums = [q for q in queries if 'SUM("core_entry"' in q["sql"]]
+        self.assertEqual(sums, [])
+
+
+@override_settings(
+    STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage"
+)
+class AdminDashboardQueryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_user("boss", password="x", is_staff=True)
+        profile = User.objects.create_user("saver", password="x").profile
+        device = Device.objects.create(
+            device_id="DASH", device_name="Dash", location="Lab", api_key="dash"
+        )
+        ledger.record_deposit(profile, bottles=2, device=device)
+        DeviceLog.objects.create(
+            device=device, log_type="bottle_detected", sort_result="plastic"
+        )
+        self.client.force_login(self.admin)
+
+    def test_query_count_is_pinned(self):
+        # Session, user and one query per widget table (the user list is
+        # lazy and not rendered)
+        with self.assertNumQueries(9):
+            response = self.client.get("/admin_dashboard/")
+        self.assertEqual(response.context["total_devices"], 1)
+        self.assertEqual(response.context["device_performance"][0].recent_bottles, 1)
+
+        # Warm cache: only the session and user remain
+        with self.assertNumQueries(2):
+            self.client.get("/admin_dashboard/")
+
+    def test_device_change_invalidates_device_widgets(self):
+        self.client.get("/admin_dashboard/")
+        Device.objects.create(
+            device_id="DASH2", device_name="Dash 2", location="Lab", api_key="dash2"
+        )
+        response = self.client.get("/admin_dashboard/")
+        self.assertEqual(response.context["total_devices"], 2)
+
+
+@override_settings(DEVICE_STALE_AFTER=180)
+class DeviceLivenessTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        now = timezone.now()
+        for device_id, status, seen in [
+            ("LIVE", "online", now),
+            ("DEAD", "online", now - timedelta(hours=1)),
+            ("NEVER", "error", None),
+            ("FIX", "maintenance", None),
+        ]:
+            Device.objects.create(
+                device_id=device_id,
+                device_name=device_id,
+                location="Lab",
+                api_key=device_id,
+                status=status,
+                last_heartbeat=seen,
+            )
+
+    def test_stale_devices_count_as_offline(self):
+        with self.assertNumQueries(1):
+            counts = liveness.status_counts()
+        self.assertEqual(
+            counts,
+            {"online": 1, "offline": 2, "maintenance": 1, "error": 0, "total": 4},
+        )
+
+    def test_sweep_flips_stale_devices_and_next_heartbeat_is_logged(self):
+        dead = Device.objects.get(device_id="DEAD")
+        heartbeats.record_heartbeat(dead, "online", now=dead.last_heartbeat)
+
+        self.assertEqual(liveness.sweep(), 2)
+        self.assertEqual(liveness.sweep(), 0)
+        self.assertEqual(
+            Device.objects.get(device_id="FIX").status, "maintenance"
+        )
+        dead.refresh_from_db()
+        self.assertEqual(dead.status, "offline")
+
+        self.assertTrue(heartbeats.record_heartbeat(dead, "online"))
+        dead.refresh_from_db()
+        self.assertEqual(dead.status, "online")
+
+
+class LeaderboardTests(TestCase):
+    def setUp(self):
+        leaderboard.reset()
+        self.profiles = [
+            User.objects.create_user(f"student{i}", password="x").profile
+            for i in range(4)
+        ]
+        teacher = User.objects.create_user("teacher", password="x", is_staff=True)
+        ledger.record_deposit(teacher.profile, bottles=9)
+        for profile, bottles in zip(self.profiles, [3, 5, 3, 0]):
+            if bottles:
+                ledger.record_deposit(profile, bottles=bottles)
+
+    def tearDown(self):
+        leaderboard.reset()
+
+    def test_top_and_rank(self):
+        top = leaderboard.top("week", 2)
+        self.assertEqual([p.pk for p in top], [self.profiles[1].pk, self.profiles[0].pk])
+        self.assertEqual(top[0].score, 50)
+
+        standing = leaderboard.rank(self.profiles[2], "month")
+        self.assertEqual((standing["rank"], standing["total"]), (2, 3))  # Tied
+        self.assertIsNone(leaderboard.rank(self.profiles[3], "week"))
+        self.assertEqual(leaderboard.rank(self.profiles[3])["total"], 4)
+
+    def test_deposits_patch_the_snapshot(self):
+        leaderboard.rank(self.profiles[0], "week")  # Build snapshots
+        leaderboard.rank(self.profiles[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            ledger.record_deposit(self.profiles[3], bottles=10)
+        with self.assertNumQueries(0):
+            self.assertEqual(leaderboard.rank(self.profiles[3], "week")["rank"], 1)
+            self.assertEqual(leaderboard.rank(self.profiles[3])["rank"], 1)
+
+    def test_rolled_back_deposits_leave_the_snapshot_alone(self):
+        leaderboard.rank(self.profiles[0], "week")  # Build snapshots
+        leaderboard.rank(self.profiles[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    ledger.record_deposit(self.profiles[3], bottles=10)
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        self.assertIsNone(leaderboard.rank(self.profiles[3], "week"))
+        self.assertEqual(leaderboard.rank(self.profiles[3])["points"], 0)
+        self.assertNotIn(self.profiles[3].pk, [p.pk for p in leaderboard.top("all")][:1])
+
+    def test_rebuild_matches_incremental_scores(self):
+        before = set(
+            LeaderboardScore.objects.values_list("period", "user_profile", "points")
+        )
+        leaderboard.rebuild()
+        after = set(
+            LeaderboardScore.objects.values_list("period", "user_profile", "points")
+        )
+        self.assertEqual(before, after)
+
+
+class LedgerConcurrencyTests(TransactionTestCase):
+    threads = 8
+    operations = 25
+
+    def setUp(self):
+        self.profile = User.objects.create_user("stress", password="x").profile
+
+    def test_concurrent_credits_and_debits_stay_exact(self):
+        ledger.credit_points(self.profile.pk, 1000)
+
+        def hammer(index):
+            for _ in range(self.operations):
+                if index % 2:
+                    ledger.record_deposit(self.profile, bottles=1)
+                else:
+                    ledger.debit_points(self.profile.pk, 3)
+
+        self.assertEqual(run_in_threads(hammer, self.threads), [])
+
+        credits = (self.threads // 2) * self.operations * ledger.POINTS_PER_BOTTLE
+        debits = (self.threads - self.threads // 2) * self.operations * 3
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.total_points, 1000 + credits - debits)
+        self.assertEqual(
+            Entry.objects.filter(user_profile=self.profile).count(),
+            (self.threads // 2) * self.operations,
+        )
+
+    def test_concurrent_debits_never_overdraw(self):
+        ledger.credit_points(self.profile.pk, 50)
+        successes = []
+
+        def spend(index):
+            for _ in range(self.operations):
+                try:
+                    ledger.debit_points(self.profile.pk, 5)
+                    successes.append(index)
+                except ledger.InsufficientPoints:
+                    pass
+
+        self.assertEqual(run_in_threads(spend, self.threads), [])
+        self.profile.refresh_from_db()
+        self.assertEqual(len(successes), 10)
+        self.assertEqual(self.profile.total_points, 0)
+
+
+class SequenceTests(TestCase):
+    def test_blocks_are_consecutive_and_disjoint(self):
+        self.assertEqual(sequences.reserve("test"), 1)
+        self.assertEqual(sequences.reserve("test", 5), 2)
+        self.assertEqual(sequences.reserve("test"), 7)
+        self.assertEqual(sequences.reserve("other"), 1)
+
+    def test_fallback_without_returning(self):
+        features = mock.patch.object(
+            connection.features, "can_return_columns_from_insert", False
+        )
+        with features:
+            self.assertEqual(sequences.reserve("fallback", 3), 1)
+            self.assertEqual(sequences.reserve("fallback"), 4)
+
+
+class ReceiptNumberStressTests(TransactionTestCase):
+    threads = 8
+    redemptions = 15
+
+    def test_concurrent_redemptions_get_unique_receipts(self):
+        reward = RewardItem.objects.create(reward_name="Pen", points_required=1)
+        profiles = [
+            User.objects.create_user(f"rush{i}", password="x").profile
+            for i in range(self.threads)
+        ]
+        for profile in profiles:
+            ledger.credit_points(profile.pk, self.redemptions)
+
+        def redeem(index):
+            for _ in range(self.redemptions):
+                with transaction.atomic():
+                    ledger.debit_points(profiles[index].pk, 1)
+                    RedeemedPoints.objects.create(
+                        user_profile=profiles[index], reward_item=reward, redeemed_points=1
+                    )
+
+        self.assertEqual(run_in_threads(redeem, self.threads), [])
+        receipts = list(RedeemedPoints.objects.values_list("receipt_number", flat=True))
+        self.assertEqual(len(receipts), self.threads * self.redemptions)
+        self.assertEqual(len(set(receipts)), len(receipts))
+        for receipt in receipts:
+            self.assertRegex(receipt, r"^SMCEcoDrop-\d{4}-\d{8}\d{6}$")
+        self.assertEqual(
+            sequences.reserve(RedeemedPoints.RECEIPT_SEQUENCE),
+            self.threads * self.redemptions + 1,
+        )
+
+
+
+class SchoolIdTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user("registrar", password="x", is_staff=True)
+
+    def test_blocks_and_formats(self):
+        self.assertEqual(
+            school_ids.allocate_student_ids(3, year=2025), ["C25-0001", "C25-0002", "C25-0003"]
+        )
+        self.assertEqual(school_ids.peek("student", year=2025), "C25-0004")
+        self.assertEqual(UserProfile.generate_student_id(2025), "C25-0004")
+        self.assertEqual(school_ids.allocate_student_ids(1, year=2026), ["C26-0001"])
+        self.assertEqual(school_ids.format_student_id(25, 10000), "C25-10000")
+
+        self.assertEqual(UserProfile.generate_faculty_id(), "SMCIC-001-0001")
+        self.assertEqual(school_ids.format_faculty_id(10000), "SMCIC-002-0001")
+        self.assertEqual(
+            school_ids.sequence_position("smcic-002-0001"), (school_ids.FACULTY_SEQUENCE, 10000)
+        )
+
+    def test_ids_typed_by_hand_move_the_sequence(self):
+        profile = User.objects.create_user("manual", password="x").profile
+        profile.school_id = "C25-0500"
+        profile.save()
+        self.assertEqual(school_ids.allocate_student_ids(year=2025), ["C25-0501"])
+        profile.school_id = "C25-0100"  # Going backwards never rewinds
+        profile.save()
+        self.assertEqual(school_ids.allocate_student_ids(year=2025), ["C25-0502"])
+
+    def test_add_user_form_reserves_untouched_suggestions(self):
+        self.client.force_login(self.staff)
+        suggested = school_ids.peek("student")
+        for username in ("first", "second"):
+            self.client.post(
+                "/console/manage-users/add/",
+                {
+                    "username": username,
+                    "password": "pw",
+                    "user_type": "student",
+                    "school_id": suggested,
+                    "suggested_school_id": suggested,
+                },
+            )
+        first = UserProfile.objects.get(user__username="first").school_id
+        second = UserProfile.objects.get(user__username="second").school_id
+        self.assertEqual(first, suggested)
+        self.assertNotEqual(first, second)
+
+        self.client.post(
+            "/console/manage-users/add/",
+            {
+                "username": "prof",
+                "password": "pw",
+                "user_type": "teacher",
+                "faculty_id": "SMCIC-003-0007",
+                "suggested_faculty_id": school_ids.peek("teacher"),
+            },
+        )
+        self.assertEqual(
+            UserProfile.objects.get(user__username="prof").school_id, "SMCIC-003-0007"
+        )
+        self.assertEqual(school_ids.peek("teacher"), "SMCIC-003-0008")
+
+
+@override_settings(
+    PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"],
+    IMPORT_HASH_WORKERS=1,
+    STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage",
+)
+class EnrollmentImportTests(TestCase):
+    CSV = (
+        "Username,Password,First_Name,Last_Name,Email,User_Type,School_ID\n"
+        "ana,,Ana,Cruz,ana@smc.edu,student,\n"
+        "ben,own-secret,Ben,Reyes,,student,c25-0900\n"
+        "cy,,Cy,Lim,,,\n"
+        "dee,,Dee,Tan,,teacher,\n"
+    )
+
+    def setUp(self):
+        cache.clear()
+        self.staff = User.objects.create_user("registrar", password="x", is_staff=True)
+
+    def test_bulk_import_creates_profiles_without_signals(self):
+        users_before = counters.get_many()[counters.USERS]
+        with self.captureOnCommitCallbacks(execute=True):
+            with CaptureQueriesContext(connection) as queries:
+                result = enrollment.import_file(
+                    BytesIO(self.CSV.encode()), "list.csv", default_password="welcome"
+                )
+        self.assertEqual(result.errors, [])
+        self.assertEqual(result.created, 4)
+        self.assertLess(len(queries), 20)  # Not per row
+
+        ben = UserProfile.objects.get(user__username="ben")
+        self.assertEqual(ben.school_id, "C25-0900")
+        self.assertEqual(ben.identity_key, "C250900")
+        self.assertEqual(authenticate(username="ben", password="own-secret"), ben.user)
+        self.assertEqual(authenticate(username="ana", password="welcome").username, "ana")
+
+        ana, cy = (UserProfile.objects.get(user__username=name) for name in ("ana", "cy"))
+        # One block reserved for the two students without an ID
+        first, second = (school_ids.sequence_position(p.school_id) for p in (ana, cy))
+        self.assertEqual(first[0], second[0])
+        self.assertEqual(second[1], first[1] + 1)
+        self.assertEqual(ana.user_type, "student")
+        dee = UserProfile.objects.get(user__username="dee")
+        self.assertTrue(dee.user.is_staff)
+        self.assertTrue(dee.school_id.startswith("SMCIC-"))
+
+        self.assertEqual(resolve_profile(ana.school_id)[0], ana)
+        self.assertTrue(known_identifiers.might_exist(normalize_identifier(ana.school_id)))
+        totals = counters.get_many()
+        self.assertEqual(totals[counters.USERS], users_before + 4)
+
+    def test_invalid_file_imports_nothing(self):
+        User.objects.create_user("ana", password="x")
+        data = self.CSV + "ben,,,,not-an-email,wizard,\n"
+        result = enrollment.import_file(BytesIO(data.encode()), "list.csv")
+        self.assertEqual(result.created, 0)
+        self.assertEqual([line for line, _ in result.errors], [2, 6, 6, 6])
+        self.assertFalse(User.objects.filter(username="cy").exists())
+
+        with mock.patch.dict("sys.modules", {"openpyxl": None}):
+            with self.assertRaises(enrollment.ImportFileError):
+                enrollment.import_file(BytesIO(b""), "list.xlsx")
+
+    def test_rows_the_database_would_reject(self):
+        existing = User.objects.create_user("old", password="x").profile
+        existing.school_id = "C22-0369"
+        existing.save()
+        data = (
+            "username,first_name,user_type,school_id\n"
+            "bad user name,,student,\n"
+            f"{'u' * 151},,student,\n"
+            f"long,{'n' * 151},student,\n"
+            "spaced,,student,C25 0001\n"
+            f"wide,,student,C25-{'9' * 50}\n"
+            "twin,,student,C220369\n"
+            "pair1,,student,c25-0777\n"
+            "pair2,,student,C250777\n"
+        )
+        result = enrollment.import_file(BytesIO(data.encode()), "list.csv")
+        self.assertEqual(result.created, 0)
+        self.assertEqual(
+            sorted({line for line, _ in result.errors}), [2, 3, 4, 5, 6, 7, 9]
+        )
+        self.assertIn("already belongs to another account", dict(result.errors)[7])
+
+    def test_staff_upload_view(self):
+        self.client.force_login(self.staff)
+        upload = SimpleUploadedFile("list.csv", self.CSV.encode(), "text/csv")
+        response = self.client.post(
+            "/console/manage-users/import/", {"file": upload, "dry_run": "on"}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(User.objects.filter(username="ana").exists())
+
+        upload = SimpleUploadedFile("list.csv", self.CSV.encode(), "text/csv")
+        response = self.client.post("/console/manage-users/import/", {"file": upload})
+        self.assertRedirects(response, "/console/manage-users/", fetch_redirect_response=False)
+        self.assertTrue(User.objects.filter(username="ana").exists())
+
+
+
+class SchoolIdConcurrencyTests(TransactionTestCase):
+    def test_concurrent_allocations_never_collide(self):
+        allocated = []
+
+        def enroll(index):
+            for _ in range(10):
+                allocated.extend(school_ids.allocate_student_ids(5 if index % 2 else 1))
+
+        self.assertEqual(run_in_threads(enroll, 8), [])
+        self.assertEqual(len(allocated), 4 * 10 * 5 + 4 * 10)
+        self.assertEqual(len(set(allocated)), len(allocated))
+
+
+
+@override_settings(HEARTBEAT_FLUSH_INTERVAL=60)
+class HeartbeatBufferTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.device = Device.objects.create(
+            device_id="HB01", device_name="Heartbeat", location="Lab", api_key="hb"
+        )
+
+    def heartbeat_logs(self):
+        return DeviceLog.objects.filter(device=self.device, log_type="heartbeat")
+
+    def test_repeated_heartbeats_are_coalesced(self):
+        start = timezone.now()
+        heartbeats.record_heartbeat(self.device, "online", {"ir": 0}, now=start)
+        with self.assertNumQueries(0):
+            for seconds in (10, 20, 30):
+                heartbeats.record_heartbeat(
+                    self.device,
+                    "online",
+                    {"ir": 0},
+                    now=start + timedelta(seconds=seconds),
+                )
+        self.assertEqual(self.heartbeat_logs().count(), 1)
+
+        # The flush interval has passed: one narrow UPDATE, still no new log
+        with self.assertNumQueries(1):
+            heartbeats.record_heartbeat(
+                self.device, "online", {"ir": 0}, now=start + timedelta(seconds=61)
+            )
+        self.device.refresh_from_db()
+        self.assertEqual(self.device.last_heartbeat, start + timedelta(seconds=61))
+
+    def test_state_change_is_written_through(self):
+        heartbeats.record_heartbeat(self.device, "online", {"ir": 0})
+        heartbeats.record_heartbeat(self.device, "maintenance", {"ir": 0})
+        heartbeats.record_heartbeat(self.device, "maintenance", {"ir": 1})
+        self.device.refresh_from_db()
+        self.assertEqual(self.device.status, "maintenance")
+        self.assertEqual(self.heartbeat_logs().count(), 3)
+
+    def test_flush_pending_writes_buffered_heartbeats(self):
+        start = timezone.now()
+        heartbeats.record_heartbeat(self.device, "online", None, now=start)
+        later = start + timedelta(seconds=30)
+        heartbeats.record_heartbeat(self.device, "online", None, now=later)
+        self.assertEqual(heartbeats.flush_pending(), 1)
+        self.assertEqual(heartbeats.flush_pending(), 0)
+        self.device.refresh_from_db()
+        self.assertEqual(self.device.last_heartbeat, later)
+
+
+class DeviceAuthCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        device_auth._local.clear()
+        self.device = Device.objects.create(
+            device_id="AUTH", device_name="Auth", location="Lab", api_key="secret"
+        )
+
+    def test_lookups_are_cached(self):
+        self.assertEqual(device_auth.get_device_by_api_key("secret"), self.device)
+        with self.assertNumQueries(0):
+            self.assertEqual(device_auth.get_device_by_api_key("secret"), self.device)
+
+    def test_unknown_keys_are_negatively_cached(self):
+        self.assertIsNone(device_auth.get_device_by_api_key("bogus"))
+        with self.assertNumQueries(0):
+            self.assertIsNone(device_auth.get_device_by_api_key("bogus"))
+
+    def test_key_rotation_invalidates(self):
+        device_auth.get_device_by_api_key("secret")
+        device_auth.get_device_by_api_key("rotated")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.device.api_key = "rotated"
+            self.device.save()
+        self.assertIsNone(device_auth.get_device_by_api_key("secret"))
+        self.assertEqual(device_auth.get_device_by_api_key("rotated"), self.device)
+
+    def test_delete_invalidates(self):
+        device_auth.get_device_by_api_key("secret")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.device.delete()
+        self.assertIsNone(device_auth.get_device_by_api_key("secret"))
+
+    def test_plain_saves_do_not_revoke_other_processes(self):
+        device_auth.get_device_by_api_key("secret")
+        device = Device.objects.get(pk=self.device.pk)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            device.location = "Gym"
+            device.save()
+            # Nothing is dropped before the commit
+            self.assertTrue(device_auth._local)
+        self.assertTrue(callbacks)
+        self.assertFalse(device_auth._local)
+        self.assertIsNone(cache.get(device_auth.GENERATION_KEY))
+
+    def test_rotation_revokes_other_processes_entries(self):
+        device_auth.get_device_by_api_key("secret")
+        other_process = dict(device_auth._local)
+        Device.objects.filter(pk=self.device.pk).update(api_key="rotated")
+        device_auth.invalidate_api_key("secret")
+        device_auth._local.update(other_process)  # Still held elsewhere
+        self.assertIsNone(device_auth.get_device_by_api_key("secret"))
+
+    def test_lookups_do_not_share_the_dirty_field_snapshot(self):
+        first = device_auth.get_device_by_api_key("secret")
+        second = device_auth.get_device_by_api_key("secret")  # Same cached entry
+        self.assertIsNot(first._loaded_values, second._loaded_values)
+        first.location = "Gym"
+        first.save()
+        self.assertEqual(second.loaded_value("location"), "Lab")
+        second.status = "error"
+        with CaptureQueriesContext(connection) as queries:
+            second.save()
+        self.assertNotIn('"location"', queries[0]["sql"])
+
+
+class IdentityResolverTests(TestCase):
+    def setUp(self):
+        self.student = User.objects.create_user("maria", password="x").profile
+        self.student.school_id = "C22-0369"
+        self.student.save()
+        self.faculty = User.objects.create_user("pedro", password="x").profile
+        self.faculty.school_id = "SMCIC-001-0001"
+        self.faculty.save()
+        self.no_id = User.objects.create_user("C250001", password="x").profile
+
+    def test_normalize_identifier(self):
+        self.assertEqual(normalize_identifier(" c22-0369 "), "C220369")
+        self.assertIsNone(normalize_identifier(" - "))
+
+    def test_every_variant_resolves_in_one_query(self):
+        for code in ("C22-0369", "C220369", "c22-0369", " c220369 "):
+            with self.assertNumQueries(1):
+                profile, _ = resolve_profile(code)
+            self.assertEqual(profile, self.student)
+        with self.assertNumQueries(1):
+            self.assertEqual(resolve_profile("SMCIC0010001")[0], self.faculty)
+
+    def test_username_and_legacy_qr_code(self):
+        self.assertEqual(resolve_profile("c25-0001"), (self.no_id, "username"))
+        self.assertEqual(
+            resolve_profile(self.student.qr_code_data), (self.student, "qr_code_data")
+        )
+
+    def test_unknown_code(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(resolve_profile("C99-9999"), (None, None))
+
+
+class IdentifierIndexGenerationTests(TestCase):
+    def test_only_identifier_changes_bump_the_generation(self):
+        from .identity import GENERATION_KEY
+
+        profile = User.objects.create_user("indexed", password="x").profile
+        generation = cache.get(GENERATION_KEY, 0)
+        profile = UserProfile.objects.get(pk=profile.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            profile.total_points = 40
+            profile.save()
+            ledger.credit_points(profile.pk, 10)
+        self.assertEqual(cache.get(GENERATION_KEY, 0), generation)
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            profile.school_id = "C24-0999"
+            profile.save()
+            # Not before the save commits
+            self.assertEqual(cache.get(GENERATION_KEY, 0), generation)
+        self.assertTrue(callbacks)
+        self.assertEqual(cache.get(GENERATION_KEY, 0), generation + 1)
+
+
+class UserVerifyMissPathTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        device_auth._local.clear()
+        known_identifiers.invalidate()
+        self.device = Device.objects.create(
+            device_id="VER", device_name="Verify", location="Lab", api_key="verify"
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            profile = User.objects.create_user("ana", password="x").profile
+            profile.school_id = "C24-0007"
+            profile.save()
+
+    def verify(self, code):
+        return self.client.get(
+            "/api/user/verify/", {"code": code}, HTTP_AUTHORIZATION="Bearer verify"
+        ).json()
+
+    def test_known_code_still_resolves(self):
+        self.assertTrue(self.verify("C240007")["ok"])
+
+    def test_repeated_unknown_code_costs_no_queries(self):
+        response = self.verify("C99-0001")
+        self.assertFalse(response["ok"])
+        self.assertNotIn("debug", response)
+        with self.assertNumQueries(0):
+            self.assertFalse(self.verify("C99-0001")["ok"])
+        self.assertEqual(
+            DeviceLog.objects.filter(device=self.device, log_type="error").count(), 1
+        )
+
+    def test_new_profile_is_found_after_a_miss(self):
+        self.assertFalse(self.verify("C99-0002")["ok"])
+        with self.captureOnCommitCallbacks(execute=True):
+            profile = User.objects.create_user("late", password="x").profile
+            profile.school_id = "C99-0002"
+            profile.save()
+        self.assertTrue(self.verify("C99-0002")["ok"])
+
+
+@override_settings(DEVICE_API_THREAD_SENSITIVE=True)
+class DetectionBatchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        device_auth._local.clear()
+        self.device = Device.objects.create(
+            device_id="BATCH", device_name="Batch", location="Lab", api_key="batch"
+        )
+        self.ana = User.objects.create_user("ana", password="x").profile
+        self.ana.school_id = "C24-0301"
+        self.ana.save()
+        self.ben = User.objects.create_user("ben", password="x").profile
+        ledger.credit_points(self.ben.pk, 5)
+
+    def post(self, payload, api_key="batch"):
+        return self.client.post(
+            "/api/device/detection/batch/",
+            payload,
+            content_type="application/json",
+            HTTP_AUTHORIZATION=f"Bearer {api_key}",
+        )
+
+    def test_mixed_batch_credits_each_user(self):
+        events = [
+            {"sort_result": "plastic", "user_id": "c240301"},
+            {"sort_result": "plastic", "user_id": "C24-0301"},
+            {"sort_result": "invalid", "user_id": "C24-0301"},
+            {"sort_result": "plastic", "user_id": self.ben.qr_code_data},
+            {"sort_result": "plastic", "user_id": "NOBODY-1"},
+            {"sort_result": "plastic"},
+        ]
+        response = self.post({"events": events})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["processed"], 6)
+        self.assertEqual(data["bottles_credited"], 3)
+        points = ledger.POINTS_PER_BOTTLE
+        self.assertEqual(
+            data["points_awarded"],
+            {
+                "ana": {"points": 2 * points, "user_total_points": 2 * points},
+                "ben": {"points": points, "user_total_points": 5 + points},
+            },
+        )
+        self.assertEqual(
+            [result["status"] for result in data["results"]],
+            ["success", "success", "success", "success", "warning", "success"],
+        )
+        self.ana.refresh_from_db()
+        self.assertEqual(self.ana.total_points, 2 * points)
+        self.assertEqual(Entry.objects.filter(user_profile=self.ana).count(), 2)
+        self.assertEqual(DeviceLog.objects.filter(log_type="bottle_detected").count(), 6)
+        self.device.refresh_from_db()
+        self.assertEqual(self.device.total_bottles_processed, 3)
+
+    def test_profiles_are_locked_in_pk_order_before_the_counters(self):
+        events = [
+            {"sort_result": "plastic", "user_id": self.ben.qr_code_data},
+            {"sort_result": "plastic", "user_id": "C24-0301"},
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post({"events": events})
+        self.assertEqual(response.status_code, 200)
+        updates = [
+            q["sql"]
+            for q in queries
+            if re.match(r'UPDATE "core_(userprofile|globalcounter)"', q["sql"])
+        ]
+        self.assertEqual(len(updates), 3)
+        self.assertIn(f"= {self.ana.pk} ", updates[0])
+        self.assertIn(f"= {self.ben.pk} ", updates[1])
+        self.assertIn('"core_globalcounter"', updates[2])
+        totals = counters.get_many()
+        self.assertEqual(totals[counters.BOTTLES], 2)
+        self.assertEqual(totals[counters.POINTS_BALANCE], 5 + 2 * ledger.POINTS_PER_BOTTLE)
+
+    @override_settings(DEVICE_BATCH_MAX_EVENTS=3)
+    def test_rejects_bad_batches(self):
+        too_many = {"events": [{"sort_result": "plastic"}] * 4}
+        for payload in ({"events": []}, {"events": "plastic"}, {}, too_many):
+            with self.subTest(payload=payload):
+                self.assertEqual(self.post(payload).status_code, 400)
+        response = self.client.generic(
+            "POST", "/api/device/detection/batch/", "{not json",
+            content_type="application/json", HTTP_AUTHORIZATION="Bearer batch",
+        )
+        self.assertEqual(response.status_code, 400)
+        response = self.post({"events": [{}]}, api_key="wrong")
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(Entry.objects.count(), 0)
+
+
+@override_settings(DEVICE_API_THREAD_SENSITIVE=True)
+class IdempotentDetectionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        device_auth._local.clear()
+        self.device = Device.objects.create(
+            device_id="IDEM", device_name="Idem", location="Lab", api_key="idem"
+        )
+        self.profile = User.objects.create_user("retry", password="x").profile
+
+    def post(self, payload):
+        return self.client.post(
+            "/api/device/detection/",
+            payload,
+            content_type="application/json",
+            HTTP_AUTHORIZATION="Bearer idem",
+        )
+
+    def test_retry_returns_original_response_without_writes(self):
+        payload = {
+            "event_id": "boot1-42",
+            "sort_result": "plastic",
+            "user_id": self.profile.qr_code_data,
+        }
+        first = self.post(payload)
+        logs = DeviceLog.objects.count()
+        second = self.post(payload)
+
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(second["X-Idempotent-Replay"], "true")
+        self.assertEqual(Entry.objects.count(), 1)
+        self.assertEqual(DeviceLog.objects.count(), logs)
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.total_points, ledger.POINTS_PER_BOTTLE)
+
+    def test_sequence_numbers_are_scoped_by_boot(self):
+        base = {"sort_result": "plastic", "user_id": self.profile.qr_code_data}
+        self.post({**base, "boot_id": "a", "seq": 1})
+        self.post({**base, "boot_id": "b", "seq": 1})
+        self.assertEqual(Entry.objects.count(), 2)
+        self.assertEqual(DeviceEvent.objects.count(), 2)
+
+
+@override_settings(DEVICE_API_THREAD_SENSITIVE=True)
+class DepositSessionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        device_auth._local.clear()
+        self.device = Device.objects.create(
+            device_id="SESS", device_name="Session", location="Lab", api_key="sess"
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.profile = User.objects.create_user("depositor", password="x").profile
+            self.profile.school_id = "C24-0200"
+            self.profile.save()
+
+    def post(self, path, payload, api_key="sess"):
+        return self.client.post(
+            path,
+            payload,
+            content_type="application/json",
+            HTTP_AUTHORIZATION=f"Bearer {api_key}",
+        )
+
+    def open_session(self):
+        response = self.client.get(
+            "/api/user/verify/", {"code": "C24-0200"}, HTTP_AUTHORIZATION="Bearer sess"
+        )
+        return response.json()["session_token"]
+
+    def test_detections_with_token_skip_identity_lookup(self):
+        token = self.open_session()
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(3):
+                response = self.post(
+                    "/api/device/detection/",
+                    {"sort_result": "plastic", "session_token": token},
+                )
+        self.assertEqual(response.json()["session_bottles"], 3)
+        self.assertFalse(
+            [q for q in queries if q["sql"].startswith("SELECT") and "core_userprofile" in q["sql"]]
+        )
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.total_points, 3 * ledger.POINTS_PER_BOTTLE)
+        self.assertEqual(Entry.objects.count(), 3)
+
+        response = self.post("/api/device/session/close/", {"session_token": token})
+        self.assertEqual(response.json()["bottles"], 3)
+        summary = DeviceLog.objects.filter(log_type="bottle_sorted")
+        self.assertEqual(summary.count(), 1)
+        self.assertEqual(summary.get().sensor_data["bottles"], 3)
+
+        response = self.post(
+            "/api/device/detection/", {"sort_result": "plastic", "session_token": token}
+        )
+        self.assertTrue(response.json()["session_expired"])
+
+    def test_token_is_bound_to_its_device(self):
+        token = self.open_session()
+        Device.objects.create(
+            device_id="OTHER", device_name="Other", location="Lab", api_key="other"
+        )
+        response = self.post(
+            "/api/device/detection/",
+            {"sort_result": "plastic", "session_token": token},
+            api_key="other",
+        )
+        self.assertTrue(response.json()["session_expired"])
+        self.assertEqual(Entry.objects.count(), 0)
+        self.assertIsNotNone(deposit_sessions.get_session(self.device, token))
+
+    def test_batch_uses_session_for_events_without_user(self):
+        token = self.open_session()
+        response = self.post(
+            "/api/device/detection/batch/",
+            {
+                "session_token": token,
+                "events": [
+                    {"sort_result": "plastic"},
+                    {"sort_result": "plastic"},
+                    {"sort_result": "invalid"},
+                ],
+            },
+        )
+        self.assertEqual(response.json()["bottles_credited"], 2)
+        self.assertEqual(deposit_sessions.get_session(self.device, token)["bottles"], 2)
+
+    def test_batch_reports_an_expired_session(self):
+        response = self.post(
+            "/api/device/detection/batch/",
+            {
+                "session_token": "expired-token",
+                "events": [
+                    {"sort_result": "plastic"},
+                    {"sort_result": "plastic", "user_id": "C24-0200"},
+                    {"sort_result": "invalid"},
+                ],
+            },
+        )
+        data = response.json()
+        self.assertTrue(data["session_expired"])
+        self.assertEqual(data["bottles_credited"], 1)
+        self.assertEqual(
+            [result["status"] for result in data["results"]],
+            ["warning", "success", "success"],
+        )
+        self.assertTrue(data["results"][0]["session_expired"])
+
+
+@override_settings(DEVICE_LOG_RETENTION_DAYS=30)
+class DeviceLogRollupTests(TestCase):
+    def setUp(self):
+        self.device = Device.objects.create(
+            device_id="ROLL", device_name="Roll", location="Lab", api_key="roll"
+        )
+        self.now = timezone.now()
+
+    def log(self, age, log_type="bottle_detected", sort_result="plastic"):
+        log = DeviceLog.objects.create(
+            device=self.device, log_type=log_type, sort_result=sort_result
+        )
+        DeviceLog.objects.filter(pk=log.pk).update(created_at=self.now - age)
+
+    def test_old_logs_are_rolled_up_before_deletion(self):
+        for _ in range(3):
+            self.log(timedelta(days=40))
+        self.log(timedelta(days=40), sort_result="invalid")
+        self.log(timedelta(days=40), log_type="error", sort_result=None)
+        self.log(timedelta(days=2))
+        self.log(timedelta(0))  # Current hour, not complete yet
+
+        self.assertEqual(log_rollup.rollup_hours(now=self.now), 6)
+        log_rollup.rollup_days(now=self.now)
+        self.assertEqual(log_rollup.rollup_hours(now=self.now), 0)  # Idempotent
+
+        self.assertEqual(log_rollup.prune_logs(now=self.now, batch_size=2), 5)
+        self.assertEqual(DeviceLog.objects.count(), 2)
+
+        daily = DeviceLogRollup.objects.filter(period="day")
+        self.assertEqual(
+            daily.get(log_type="bottle_detected", sort_result="plastic",
+                      period_start__lt=self.now - timedelta(days=30)).count,
+            3,
+        )
+        self.assertEqual(daily.get(log_type="error").sort_result, "")
+        self.assertEqual(sum(daily.values_list("count", flat=True)), 6)
+
+    def test_unrolled_logs_are_never_pruned(self):
+        self.log(timedelta(days=40))
+        self.assertEqual(log_rollup.prune_logs(now=self.now), 0)
+        self.assertEqual(DeviceLog.objects.count(), 1)
+
+
+@override_settings(DEVICE_API_THREAD_SENSITIVE=True)
+class AsyncDeviceApiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        device_auth._local.clear()
+        self.device = Device.objects.create(
+            device_id="ASGI", device_name="Asgi", location="Lab", api_key="asgi"
+        )
+        self.profile = User.objects.create_user("async", password="x").profile
+        self.profile.school_id = "C24-0100"
+        self.profile.save()
+
+    async def test_device_endpoints_through_asgi(self):
+        client = AsyncClient()
+        auth = {"Authorization": "Bearer asgi"}
+        response = await client.post(
+            "/api/device/heartbeat/",
+            {"status": "online"},
+            content_type="application/json",
+            headers=auth,
+        )
+        self.assertEqual(response.status_code, 200)
+
+        response = await client.get(
+            "/api/user/verify/", {"code": "C240100"}, headers=auth
+        )
+        self.assertTrue(response.json()["ok"])
+
+        response = await client.post(
+            "/api/device/detection/",
+            {"sort_result": "plastic", "user_id": self.profile.qr_code_data},
+            content_type="application/json",
+            headers=auth,
+        )
+        self.assertEqual(
+            response.json()["user_total_points"], ledger.POINTS_PER_BOTTLE
+        )
+
+        response = await client.post(
+            "/api/device/heartbeat/", {}, headers={"Authorization": "Bearer nope"}
+        )
+        self.assertEqual(response.status_code, 401)
+
+
+class DetectionThreadTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        device_auth._local.clear()
+        Device.objects.create(
+            device_id="POOL", device_name="Pool", location="Lab", api_key="pool"
+        )
+        self.profile = User.objects.create_user("pooled", password="x").profile
+
+    def test_detections_leave_the_sync_page_thread_free(self):
+        from . import views
+
+        threads = []
+
+        def record(*args):
+            threads.append(threading.current_thread())
+            return run_once(*args)
+
+        run_once = views.run_once
+        with mock.patch.object(views, "run_once", record):
+            response = self.client.post(
+                "/api/device/detection/",
+                {"sort_result": "plastic", "user_id": self.profile.qr_code_data},
+                content_type="application/json",
+                HTTP_AUTHORIZATION="Bearer pool",
+            )
+        self.assertEqual(response.json()["user_total_points"], ledger.POINTS_PER_BOTTLE)
+        # Thread-sensitive work runs on this (the calling) thread
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.current_thread())
+
+
+@override_settings(
+    PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"],
+    STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage",
+)
+class DirtyFieldTrackingTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("tracked", password="pw")
+        self.device = Device.objects.create(
+            device_id="DIRTY", device_name="Dirty", location="Lab", api_key="dirty"
+        )
+
+    def test_login_does_not_touch_the_profile(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                "/login/", {"username": "tracked", "password": "pw"}
+            )
+        self.assertEqual(response.status_code, 302)
+        # User lookup, session create (4 with savepoints), last_login, session
+        # save (3 with savepoints): nothing for the profile
+        self.assertEqual(len(queries), 9)
+        profile_queries = [
+            q["sql"]
+            for q in queries
+            if q["sql"].startswith('UPDATE "core_userprofile"')
+            or re.match(r'SELECT [^()]* FROM "core_userprofile"', q["sql"])
+        ]
+        self.assertFalse(profile_queries)
+
+    def test_unchanged_saves_are_skipped(self):
+        profile = UserProfile.objects.get(user=self.user)
+        device = Device.objects.get(pk=self.device.pk)
+        with self.assertNumQueries(0):
+            profile.save()
+            device.save()
+
+    def test_only_changed_fields_are_written(self):
+        device = Device.objects.get(pk=self.device.pk)
+        device.location = "Gym"
+        with CaptureQueriesContext(connection) as queries:
+            device.save()
+        (update,) = [q["sql"] for q in queries if q["sql"].startswith("UPDATE")]
+        self.assertIn('"location"', update)
+        self.assertIn('"updated_at"', update)
+        self.assertNotIn('"device_name"', update)
+        with self.assertNumQueries(0):
+            device.save()  # The snapshot moved on with the write
+
+    def test_user_save_saves_a_changed_cached_profile(self):
+        user = User.objects.select_related("profile").get(pk=self.user.pk)
+        user.profile.school_id = "C24-0777"
+        user.first_name = "Tracked"
+        user.save()
+        profile = UserProfile.objects.get(user=self.user)
+        self.assertEqual(profile.school_id, "C24-0777")
+        self.assertEqual(profile.identity_key, normalize_identifier("C24-0777"))
+        self.assertEqual(sequences.current(school_ids.student_sequence(24)), 777)
+
+    def test_save_after_ledger_call_keeps_the_balance(self):
+        profile = UserProfile.objects.get(user=self.user)
+        ledger.record_deposit(profile)
+        ledger.credit_points(profile.pk, 100)  # Elsewhere, e.g. another request
+        profile.user_type = "teacher"
+        with CaptureQueriesContext(connection) as queries:
+            profile.save()
+        (update,) = [q["sql"] for q in queries if q["sql"].startswith("UPDATE")]
+        self.assertNotIn('"total_points"', update)
+        self.assertEqual(UserProfile.objects.get(pk=profile.pk).total_points, 110)
+        self.assertEqual(counters.get_many()[counters.POINTS_BALANCE], 110)
+
+    def test_username_change_updates_the_identity_key(self):
+        user = User.objects.get(pk=self.user.pk)
+        user.username = "renamed"
+        user.save()
+        profile = UserProfile.objects.get(user=self.user)
+        self.assertEqual(profile.identity_key, normalize_identifier("renamed"))
+
+
+@override_settings(PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class IdentifierBackendTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            "maria", email="maria@example.com", password="pw"
+        )
+        self.user.profile.school_id = "C22-0369"
+        self.user.profile.save()
+
+    def hashes(self):
+        from django.contrib.auth.hashers import MD5PasswordHasher
+
+        return (
+            mock.patch.object(MD5PasswordHasher, "verify", autospec=True,
+                              side_effect=MD5PasswordHasher.verify),
+            mock.patch.object(MD5PasswordHasher, "encode", autospec=True,
+                              side_effect=MD5PasswordHasher.encode),
+        )
+
+    def test_any_identifier_in_one_query(self):
+        for identifier in ("maria", "C22-0369", "c220369", "maria@example.com"):
+            with self.subTest(identifier=identifier), self.assertNumQueries(1):
+                self.assertEqual(authenticate(username=identifier, password="pw"), self.user)
+
+    def test_password_is_hashed_once(self):
+        verify, encode = self.hashes()
+        with verify as verified:
+            self.assertIsNone(authenticate(username="C22-0369", password="bad"))
+        self.assertEqual(verified.call_count, 1)
+        with encode as encoded:
+            self.assertIsNone(authenticate(username="nobody", password="pw"))
+        self.assertEqual(encoded.call_count, 1)  # The dummy hash for the miss
+
+    def test_username_beats_another_users_id_number(self):
+        other = User.objects.create_user("C220369", password="other")
+        self.assertEqual(authenticate(username="C220369", password="other"), other)
+        self.assertIsNone(authenticate(username="C220369", password="pw"))
+        self.assertEqual(authenticate(username="C22-0369", password="pw"), self.user)
+
+    def test_inactive_users_are_refused(self):
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsNone(authenticate(username="maria", password="pw"))
+
+    @override_settings(
+        STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage"
+    )
+    def test_login_view_accepts_an_id_number(self):
+        response = self.client.post("/login/", {"username": "c22-0369", "password": "pw"})
+        self.assertRedirects(response, "/dashboard/", fetch_redirect_response=False)
+
+
+class RewardRedemptionTests(TestCase):
+    def setUp(self):
+        self.profile = User.objects.create_user("shopper", password="x").profile
+        ledger.credit_points(self.profile.pk, 100)
+        self.reward = RewardItem.objects.create(
+            reward_name="Tumbler", points_required=30, stock=2
+        )
+
+    def assertState(self, points, stock, redemptions):
+        self.profile.refresh_from_db()
+        self.reward.refresh_from_db()
+        self.assertEqual(self.profile.total_points, points)
+        self.assertEqual(self.reward.stock, stock)
+        self.assertEqual(RedeemedPoints.objects.count(), redemptions)
+
+    def test_redemption_takes_points_and_stock(self):
+        redemption, balance = ledger.redeem_reward(self.profile, self.reward, 2)
+        self.assertEqual((redemption.redeemed_points, redemption.quantity), (60, 2))
+        self.assertEqual(balance, 40)
+        self.assertState(points=40, stock=0, redemptions=1)
+
+    def test_out_of_stock_changes_nothing(self):
+        with self.assertRaises(ledger.RewardUnavailable):
+            ledger.redeem_reward(self.profile, self.reward, 3)
+        self.assertState(points=100, stock=2, redemptions=0)
+
+    def test_insufficient_points_returns_the_stock(self):
+        RewardItem.objects.filter(pk=self.reward.pk).update(points_required=60)
+        self.reward.points_required = 60
+        with self.assertRaises(ledger.InsufficientPoints):
+            ledger.redeem_reward(self.profile, self.reward, 2)
+        self.assertState(points=100, stock=2, redemptions=0)
+
+    def test_unlimited_and_inactive_rewards(self):
+        unlimited = RewardItem.objects.create(reward_name="Sticker", points_required=1)
+        ledger.redeem_reward(self.profile, unlimited, 5)
+        unlimited.refresh_from_db()
+        self.assertIsNone(unlimited.stock)
+        RewardItem.objects.filter(pk=unlimited.pk).update(is_active=False)
+        with self.assertRaises(ledger.RewardUnavailable) as raised:
+            ledger.redeem_reward(self.profile, unlimited)
+        self.assertEqual(raised.exception.reason, "inactive")
+
+    def test_price_edited_meanwhile_is_not_charged_stale(self):
+        RewardItem.objects.filter(pk=self.reward.pk).update(points_required=40)
+        with self.assertRaises(ledger.RewardUnavailable) as raised:
+            ledger.redeem_reward(self.profile, self.reward)  # Read at 30 points
+        self.assertEqual(raised.exception.reason, "repriced")
+        self.assertState(points=100, stock=2, redemptions=0)
+
+    @override_settings(
+        STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage"
+    )
+    def test_sold_out_redemption_is_reported(self):
+        RewardItem.objects.filter(pk=self.reward.pk).update(stock=0)
+        self.client.force_login(self.profile.user)
+        response = self.client.post(
+            f"/redeem/{self.reward.pk}/", {"quantity": 1}, follow=True
+        )
+        self.assertContains(response, "Tumbler is out of stock")
+        self.assertState(points=100, stock=0, redemptions=0)
+
+    @override_settings(
+        STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage"
+    )
+    def test_inactive_redemption_is_not_reported_as_sold_out(self):
+        RewardItem.objects.filter(pk=self.reward.pk).update(is_active=False)
+        self.client.force_login(self.profile.user)
+        response = self.client.post(
+            f"/redeem/{self.reward.pk}/", {"quantity": 1}, follow=True
+        )
+        self.assertContains(response, "Tumbler is no longer available")
+        self.assertNotContains(response, "out of stock")
+        self.assertState(points=100, stock=2, redemptions=0)
+
+    def test_admin_edit_keeps_stock_taken_meanwhile(self):
+        staff = User.objects.create_user("keeper", password="x", is_staff=True)
+        self.client.force_login(staff)
+        ledger.redeem_reward(self.profile, self.reward)  # After the form loaded
+        form = {"reward_name": "Steel tumbler", "points_required": 30,
+                "stock": "2", "loaded_stock": "2", "is_active": "on"}
+        self.client.post(f"/console/manage-rewards/{self.reward.pk}/", form)
+        self.reward.refresh_from_db()
+        self.assertEqual((self.reward.reward_name, self.reward.stock), ("Steel tumbler", 1))
+        self.client.post(f"/console/manage-rewards/{self.reward.pk}/", {**form, "stock": "10"})
+        self.reward.refresh_from_db()
+        self.assertEqual(self.reward.stock, 10)
+
+
+    @override_settings(
+        STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage"
+    )
+    def test_django_admin_keeps_stock_taken_meanwhile(self):
+        admin = User.objects.create_superuser("root", password="x")
+        self.client.force_login(admin)
+        ledger.redeem_reward(self.profile, self.reward)  # After the form loaded
+        url = f"/admin/core/rewarditem/{self.reward.pk}/change/"
+        form = {"reward_name": "Tumbler", "points_required": 30, "stock": "2",
+                "initial-stock": "2", "is_active": "on"}
+        response = self.client.post(url, form)
+        self.assertEqual(response.status_code, 302)
+        self.reward.refresh_from_db()
+        self.assertEqual(self.reward.stock, 1)
+        self.client.post(url, {**form, "stock": "5"})
+        self.reward.refresh_from_db()
+        self.assertEqual(self.reward.stock, 5)
+
+    def test_console_edit_action_keeps_stock(self):
+        staff = User.objects.create_user("keeper", password="x", is_staff=True)
+        self.client.force_login(staff)
+        ledger.redeem_reward(self.profile, self.reward)
+        self.client.post("/console/manage-rewards/", {
+            "action": "edit", "reward_id": self.reward.pk,
+            "reward_name": "Mug", "points_required": 30})
+        self.reward.refresh_from_db()
+        self.assertEqual((self.reward.reward_name, self.reward.stock), ("Mug", 1))
+
+
+@override_settings(PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class RewardRedemptionStressTests(TransactionTestCase):
+    redeemers = 200
+    stock = 25
+
+    def test_concurrent_redeemers_never_oversell(self):
+        reward = RewardItem.objects.create(
+            reward_name="Limited", points_required=10, stock=self.stock
+        )
+        profiles = []
+        for i in range(self.redeemers):
+            profile = User.objects.create_user(f"fan{i}", password="x").profile
+            # Every fourth fan can't afford it
+            ledger.credit_points(profile.pk, 5 if i % 4 == 0 else 10)
+            profiles.append(profile)
+        outcomes = []
+        redeemed_before = counters.get_many(counters.POINTS_REDEEMED)[
+            counters.POINTS_REDEEMED
+        ]
+
+        def redeem(index):
+            try:
+                ledger.redeem_reward(profiles[index], reward)
+                outcomes.append("redeemed")
+            except ledger.RewardUnavailable:
+                outcomes.append("sold out")
+            except ledger.InsufficientPoints:
+                outcomes.append("too poor")
+
+        self.assertEqual(run_in_threads(redeem, self.redeemers), [])
+        self.assertEqual(len(outcomes), self.redeemers)
+        self.assertEqual(outcomes.count("redeemed"), self.stock)
+        reward.refresh_from_db()
+        self.assertEqual(reward.stock, 0)
+        self.assertEqual(RedeemedPoints.objects.count(), self.stock)
+        spent = UserProfile.objects.filter(total_points=0).count()
+        self.assertEqual(spent, self.stock)
+        self.assertFalse(UserProfile.objects.filter(total_points__lt=0).exists())
+        redeemed = counters.get_many(counters.POINTS_REDEEMED)[counters.POINTS_REDEEMED]
+        self.assertEqual(redeemed - redeemed_before, self.stock * reward.points_required)
+
+
+@override_settings(
+    STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage"
+)
+class RewardCatalogTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        reward_catalog.invalidate()
+        for name, points in (("Eco Bag", 50), ("Water Bottle 500ml", 300),
+                             ("Steel Bottle", 800), ("Old Mug", 100)):
+            RewardItem.objects.create(reward_name=name, points_required=points)
+        RewardItem.objects.filter(reward_name="Old Mug").update(is_active=False)
+        self.profile = User.objects.create_user("browser", password="x").profile
+
+    def names(self, query):
+        return [reward.reward_name for reward in reward_catalog.search(query)]
+
+    def test_search_runs_in_memory(self):
+        reward_catalog.search()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names(""), ["Eco Bag", "Water Bottle 500ml", "Steel Bottle"])
+            self.assertEqual(self.names("BOTTLE"), ["Water Bottle 500ml", "Steel Bottle"])
+            self.assertEqual(self.names("steel  bott"), ["Steel Bottle"])
+            self.assertEqual(self.names("100-800"), ["Water Bottle 500ml", "Steel Bottle"])
+            self.assertEqual(self.names("500"), ["Eco Bag", "Water Bottle 500ml"])
+            self.assertEqual(self.names("mug"), [])
+
+    def test_rewards_page_does_not_query_rewards(self):
+        self.client.force_login(self.profile.user)
+        self.client.get("/rewards/")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/rewards/", {"search": "bottle", "page": 1})
+        self.assertContains(response, "Steel Bottle")
+        self.assertNotContains(response, "Eco Bag")
+        self.assertFalse([q["sql"] for q in queries if "core_rewarditem" in q["sql"]])
+
+    def test_changes_invalidate_the_snapshot(self):
+        reward_catalog.search()
+        staff = User.objects.create_user("curator", password="x", is_staff=True)
+        self.client.force_login(staff)
+        bag = RewardItem.objects.get(reward_name="Eco Bag")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f"/console/manage-rewards/{bag.pk}/", {
+                "reward_name": "Canvas Bag", "points_required": 50,
+                "stock": "1", "loaded_stock": "", "is_active": "on"})
+        self.assertEqual(self.names("bag"), ["Canvas Bag"])
+
+        # Redemptions don't touch the snapshot; the stock is read live
+        from .reward_catalog import VERSION_KEY
+
+        version = cache.get(VERSION_KEY)
+        ledger.credit_points(self.profile.pk, 50)
+        with self.captureOnCommitCallbacks(execute=True):
+            ledger.redeem_reward(self.profile, RewardItem.objects.get(pk=bag.pk))
+        self.assertEqual(cache.get(VERSION_KEY), version)
+        self.assertEqual(reward_catalog.search("bag")[0].stock, 1)
+        with self.assertNumQueries(1):
+            (shown,) = reward_catalog.with_stock(reward_catalog.search("bag"))
+        self.assertEqual(shown.stock, 0)
+        with self.assertNumQueries(0):
+            reward_catalog.with_stock(reward_catalog.search("steel"))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f"/console/manage-rewards/{bag.pk}/delete/")
+        self.assertEqual(self.names("bag"), [])
@@ -27,6 +27,7 @@ urlpatterns = [
     # Custom admin management pages (quick actions) - use 'console/' to avoid conflict with Django admin
     path('console/manage-users/', views.admin_manage_users_view, name='admin_users'),
     path('console/manage-users/add/', views.admin_user_add_view, name='admin_user_add'),
+    path('console/manage-users/import/', views.admin_user_import_view, name='admin_user_import'),
     path('console/manage-users/<int:user_id>/', views.admin_user_edit_view, name='admin_user_edit'),
     path('console/manage-rewards/', views.admin_manage_rewards_view, name='admin_rewards'),
     path('console/manage-rewards/add/', views.admin_reward_add_view, name='admin_reward_add'),
@@ -40,13 +41,19 @@ urlpatterns = [
     path('console/device-logs/', views.admin_device_logs_view, name='admin_device_logs'),
     path('console/settings/', views.admin_settings_view, name='admin_settings'),
     path('console/debug-qr-codes/', views.debug_qr_codes_view, name='debug_qr_codes'),
+    path('console/diagnostics/identity/', views.identity_diagnostics_view, name='identity_diagnostics'),
     path('generate-qr-code/', views.generate_qr_code_view, name='generate_qr_code'),
     path('download-id-card/<int:user_id>/', views.download_id_card_view, name='download_id_card'),
+    path('console/id-cards/export/', views.admin_id_card_export_view, name='admin_id_card_export'),
+    path('console/id-cards/export/<slug:job_id>/', views.admin_id_card_export_status_view, name='admin_id_card_export_status'),
+    path('console/id-cards/export/<slug:job_id>/download/', views.admin_id_card_export_download_view, name='admin_id_card_export_download'),
     
     # API Endpoints for IoT device integration
     path('api/deposit/', views.api_deposit_view, name='api_deposit'),  # Legacy endpoint
     path('api/device/heartbeat/', views.api_device_heartbeat, name='api_device_heartbeat'),
     path('api/device/detection/', views.api_bottle_detection, name='api_bottle_detection'),
+    path('api/device/detection/batch/', views.api_bottle_detection_batch, name='api_bottle_detection_batch'),
+    path('api/device/session/close/', views.api_deposit_session_close, name='api_deposit_session_close'),
     path('api/device/error/', views.api_device_error, name='api_device_error'),
     path('api/user/verify/', views.api_user_verify, name='api_user_verify'),
 ]
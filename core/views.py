@@ -4,26 +4,53 @@
 # Each function handles a different page or action.
 # ======================================================================
 
-from django.shortcuts import render, redirect
+from django.shortcuts import get_object_or_404, render, redirect
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import DatabaseError, close_old_connections, transaction
 from .models import UserProfile, Entry, RewardItem, RedeemedPoints, Device, DeviceLog
 from .forms import LoginForm, RegisterForm
 
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition
+from django.utils.cache import patch_cache_control, patch_vary_headers
 from django.http import JsonResponse
+from django.urls import reverse
 from django.utils import timezone
+from asgiref.sync import sync_to_async
 import json
 import uuid
 from .utils import (
     get_next_available_ids,
-    authenticate_device,
-    generate_barcode_buffer,
+    aauthenticate_device,
     generate_id_card_image,
 )
+from . import (
+    barcode_cache,
+    counters,
+    dashboard,
+    deposit_sessions,
+    enrollment,
+    heartbeats,
+    id_card_export,
+    leaderboard,
+    ledger,
+    liveness,
+    reward_catalog,
+    school_ids,
+)
+from .idempotency import event_id_from, run_once
+from .identity import (
+    aremember_miss,
+    aresolve_profile,
+    ais_cached_miss,
+    known_identifiers,
+    normalize_identifier,
+    resolve_profile,
+    resolve_profiles,
+)
 
 
 def home_view(request):
@@ -31,10 +58,11 @@ def home_view(request):
     if request.user.is_authenticated:
         return redirect("dashboard")
 
-    # Get some stats for the landing page
-    total_users = UserProfile.objects.count()
-    total_bottles = Entry.objects.aggregate(total=models.Sum("no_bottle"))["total"] or 0
-    available_rewards = RewardItem.objects.count()
+    # Get some stats for the landing page (running totals, see core/counters.py)
+    totals = counters.get_many(counters.USERS, counters.BOTTLES)
+    total_users = totals[counters.USERS]
+    total_bottles = totals[counters.BOTTLES]
+    available_rewards = RewardItem.objects.filter(is_active=True).count()
     context = {
         "total_users": total_users,
         "total_bottles": total_bottles,
@@ -74,34 +102,12 @@ def login_view(request):
             username_or_id_or_email = form.cleaned_data["username"]
             password = form.cleaned_data["password"]
 
-            # Try to find the user by username, school_id, or email
-            user = None
-
-            # Method 1: Try authenticating with username directly
+            # Username, school_id (any hyphen/case variant) or email: resolved
+            # to one user by core.auth_backends.IdentifierBackend
             user = authenticate(
                 request, username=username_or_id_or_email, password=password
             )
 
-            # Method 2: Try finding by school_id (ID Number)
-            if user is None:
-                try:
-                    profile = UserProfile.objects.get(school_id=username_or_id_or_email)
-                    user = authenticate(
-                        request, username=profile.user.username, password=password
-                    )
-                except UserProfile.DoesNotExist:
-                    pass
-
-            # Method 3: Try finding by email
-            if user is None:
-                try:
-                    user_obj = User.objects.get(email=username_or_id_or_email)
-                    user = authenticate(
-                        request, username=user_obj.username, password=password
-                    )
-                except User.DoesNotExist:
-                    pass
-
             # If user found and authenticated, log them in
             if user is not None:
                 login(request, user)
@@ -146,12 +152,13 @@ def dashboard_view(request):
     recent_entries = Entry.objects.filter(user_profile=user_profile).order_by(
         "-created_at"
     )[:10]
-    total_bottles = (
-        Entry.objects.filter(user_profile=user_profile).aggregate(
-            total=models.Sum("no_bottle")
-        )["total"]
-        or 0
-    )
+    total_bottles = user_profile.total_bottles
+
+    # Leaderboard standing (rank/percentile lookups, see core/leaderboard.py)
+    ranks = {
+        period: leaderboard.rank(user_profile, period)
+        for period in leaderboard.PERIODS
+    }
 
     return render(
         request,
@@ -160,6 +167,9 @@ def dashboard_view(request):
             "user_profile": user_profile,
             "recent_entries": recent_entries,
             "total_bottles": total_bottles,
+            "rank_all": ranks["all"],
+            "rank_week": ranks["week"],
+            "rank_month": ranks["month"],
         },
     )
 
@@ -170,37 +180,28 @@ def teacher_dashboard_view(request):
     if not request.user.is_staff:
         return redirect("dashboard")
 
-    from django.db.models import Sum, Count
     from django.utils import timezone
     from datetime import timedelta
 
     # Teacher's own stats
     user_profile = request.user.profile
-    teacher_bottles = (
-        Entry.objects.filter(user_profile=user_profile).aggregate(
-            total=models.Sum("no_bottle")
-        )["total"]
-        or 0
-    )
+    teacher_bottles = user_profile.total_bottles
     teacher_points = user_profile.total_points
 
     # School-wide statistics
-    total_students = User.objects.filter(is_staff=False).count()
-    total_bottles_all = (
-        Entry.objects.aggregate(total=models.Sum("no_bottle"))["total"] or 0
-    )
-    total_points_all = (
-        UserProfile.objects.aggregate(total=models.Sum("total_points"))["total"] or 0
+    totals = counters.get_many(
+        counters.USERS, counters.STAFF_USERS, counters.BOTTLES, counters.POINTS_BALANCE
     )
+    total_students = totals[counters.USERS] - totals[counters.STAFF_USERS]
+    total_bottles_all = totals[counters.BOTTLES]
+    total_points_all = totals[counters.POINTS_BALANCE]
 
     # Recent activity (last 7 days)
     week_ago = timezone.now() - timedelta(days=7)
     recent_deposits = Entry.objects.filter(created_at__gte=week_ago).count()
 
-    # Top students
-    top_students = UserProfile.objects.filter(user__is_staff=False).order_by(
-        "-total_points"
-    )[:10]
+    # Top students (all-time leaderboard)
+    top_students = leaderboard.top("all", 10)
 
     # Recent transactions
     recent_transactions = Entry.objects.select_related("user_profile__user").order_by(
@@ -237,12 +238,7 @@ def teacher_profile_view(request):
         return redirect("dashboard")
 
     user_profile = request.user.profile
-    teacher_bottles = (
-        Entry.objects.filter(user_profile=user_profile).aggregate(
-            total=models.Sum("no_bottle")
-        )["total"]
-        or 0
-    )
+    teacher_bottles = user_profile.total_bottles
     recent_entries = Entry.objects.filter(user_profile=user_profile).order_by(
         "-created_at"
     )[:10]
@@ -268,12 +264,7 @@ def student_profile_view(request):
     from datetime import timedelta
 
     user_profile = request.user.profile
-    total_bottles = (
-        Entry.objects.filter(user_profile=user_profile).aggregate(
-            total=models.Sum("no_bottle")
-        )["total"]
-        or 0
-    )
+    total_bottles = user_profile.total_bottles
     recent_entries = Entry.objects.filter(user_profile=user_profile).order_by(
         "-created_at"
     )[:10]
@@ -300,25 +291,22 @@ def student_profile_view(request):
 def rewards_view(request):
     """Display available rewards for redemption with search and pagination"""
     from django.core.paginator import Paginator
-    from django.db.models import Q
 
     user_profile = request.user.profile
 
     # Get search query
     search_query = request.GET.get("search", "")
 
-    # Filter rewards based on search
-    rewards = RewardItem.objects.all().order_by("points_required")
-    if search_query:
-        rewards = rewards.filter(
-            Q(reward_name__icontains=search_query)
-            | Q(points_required__icontains=search_query)
-        )
+    # Search the in-memory catalog: names, "300" (affordable with 300 points)
+    # or "100-500" (point range); no queries, and paging a list needs no COUNT
+    rewards = reward_catalog.search(search_query)
 
     # Paginate results (9 per page for 3x3 grid)
     paginator = Paginator(rewards, 9)
     page_number = request.GET.get("page", 1)
     page_obj = paginator.get_page(page_number)
+    # Live stock for the limited rewards on this page (it isn't cached)
+    page_obj.object_list = reward_catalog.with_stock(page_obj.object_list)
 
     # Get last redemption from session and clear it
     last_redemption = request.session.pop("last_redemption", None)
@@ -338,7 +326,7 @@ def rewards_view(request):
 
 @login_required
 def redeem_reward_view(request, reward_id):
-    reward = RewardItem.objects.get(id=reward_id)
+    reward = get_object_or_404(RewardItem, id=reward_id)
     profile = request.user.profile
 
     # Get quantity from POST request (default to 1)
@@ -355,19 +343,28 @@ def redeem_reward_view(request, reward_id):
     # Calculate total points required
     total_points_required = reward.points_required * quantity
 
-    if profile.total_points >= total_points_required:
-        # Subtract total points
-        profile.total_points -= total_points_required
-        profile.save()
-
-        # Create a redemption record with quantity
-        redemption = RedeemedPoints.objects.create(
-            user_profile=profile,
-            reward_item=reward,
-            redeemed_points=total_points_required,
-            quantity=quantity,
-        )
+    # Stock, points and the redemption record change together or not at all
+    try:
+        redemption, _ = ledger.redeem_reward(profile, reward, quantity)
+    except ledger.RewardUnavailable as e:
+        redemption = None
+        if e.reason == "inactive":
+            messages.error(
+                request, f"Sorry, {reward.reward_name} is no longer available."
+            )
+        elif e.reason == "repriced":
+            messages.error(
+                request,
+                f"The points required for {reward.reward_name} have changed. "
+                "Please check the new price and try again.",
+            )
+        else:
+            messages.error(request, f"Sorry, {reward.reward_name} is out of stock.")
+    except ledger.InsufficientPoints:
+        redemption = None
+        messages.error(request, "You don't have enough points for this reward.")
 
+    if redemption is not None:
         # Calculate valid until date (3 days from now)
         from datetime import timedelta
 
@@ -430,95 +427,13 @@ def admin_dashboard_view(request):
     if not request.user.is_staff:
         return redirect("dashboard")
 
-    # Comprehensive admin dashboard data
-    from django.db.models import Sum, Count, Avg
-    from django.utils import timezone
-    from datetime import timedelta
-
-    # User statistics
-    total_users = UserProfile.objects.count()
-    student_users = UserProfile.objects.filter(user__is_staff=False).count()
-    faculty_users = UserProfile.objects.filter(user__is_staff=True).count()
-
-    # Recycling statistics
-    total_bottles = Entry.objects.aggregate(total=Sum("no_bottle"))["total"] or 0
-    total_points_earned = Entry.objects.aggregate(total=Sum("points"))["total"] or 0
-    total_points_redeemed = (
-        RedeemedPoints.objects.aggregate(total=Sum("redeemed_points"))["total"] or 0
-    )
-
-    # Recent activity (last 7 days)
-    week_ago = timezone.now() - timedelta(days=7)
-    recent_deposits = Entry.objects.filter(created_at__gte=week_ago).count()
-    recent_redemptions = RedeemedPoints.objects.filter(created_at__gte=week_ago).count()
-
-    # Top recyclers
-    top_recyclers = UserProfile.objects.order_by("-total_points")[:5]
-
-    # Recent transactions
-    recent_transactions = Entry.objects.select_related("user_profile__user").order_by(
-        "-created_at"
-    )[:10]
-
-    # Reward statistics
-    reward_stats = (
-        RedeemedPoints.objects.values("reward_item__reward_name")
-        .annotate(count=Count("id"), total_points=Sum("redeemed_points"))
-        .order_by("-count")[:5]
-    )
-
-    # Average points per user
-    avg_points_per_user = (
-        UserProfile.objects.aggregate(avg=Avg("total_points"))["avg"] or 0
-    )
-
-    # Device statistics
-    total_devices = Device.objects.count()
-    online_devices = Device.objects.filter(status="online").count()
-    offline_devices = Device.objects.filter(status="offline").count()
-    error_devices = Device.objects.filter(status="error").count()
-    maintenance_devices = Device.objects.filter(status="maintenance").count()
-
-    # Recent device activity
-    recent_device_logs = DeviceLog.objects.select_related("device").order_by(
-        "-created_at"
-    )[:10]
-
-    # Device performance data
-    device_performance = Device.objects.annotate(
-        recent_bottles=Count(
-            "devicelog",
-            filter=models.Q(
-                devicelog__log_type="bottle_sorted", devicelog__created_at__gte=week_ago
-            ),
-        )
-    ).order_by("-total_bottles_processed")[:5]
+    # Comprehensive admin dashboard data: cached widgets (see core/dashboard.py)
+    context = dashboard.get_context()
 
     # Basic user list for Manage Users section (no backend actions here)
-    user_list = User.objects.select_related("profile").order_by("username")[:100]
-
-    context = {
-        "total_users": total_users,
-        "student_users": student_users,
-        "faculty_users": faculty_users,
-        "total_bottles": total_bottles,
-        "total_points_earned": total_points_earned,
-        "total_points_redeemed": total_points_redeemed,
-        "recent_deposits": recent_deposits,
-        "recent_redemptions": recent_redemptions,
-        "top_recyclers": top_recyclers,
-        "recent_transactions": recent_transactions,
-        "reward_stats": reward_stats,
-        "avg_points_per_user": round(avg_points_per_user, 1),
-        "total_devices": total_devices,
-        "online_devices": online_devices,
-        "offline_devices": offline_devices,
-        "error_devices": error_devices,
-        "maintenance_devices": maintenance_devices,
-        "recent_device_logs": recent_device_logs,
-        "device_performance": device_performance,
-        "user_list": user_list,
-    }
+    context["user_list"] = User.objects.select_related("profile").order_by(
+        "username"
+    )[:100]
 
     return render(request, "core/admin_dashboard.html", context)
 
@@ -576,7 +491,15 @@ def admin_manage_rewards_view(request):
                 reward.reward_name = reward_name
                 reward.points_required = int(points_required)
                 reward.icon = icon
-                reward.save()
+                fields = ["reward_name", "points_required"]
+                # Same stock guard as admin_reward_edit_view: redemptions
+                # may have taken stock since the page was loaded
+                if "stock" in request.POST:
+                    stock = _posted_stock(request)
+                    if stock != _posted_stock(request, "loaded_stock"):
+                        reward.stock = stock
+                        fields.append("stock")
+                reward.save(update_fields=fields)
 
         elif action == "delete":
             reward_id = request.POST.get("reward_id")
@@ -595,6 +518,12 @@ def admin_manage_rewards_view(request):
     )
 
 
+def _posted_stock(request, name="stock"):
+    """Stock from the reward form; blank means unlimited"""
+    stock = (request.POST.get(name) or "").strip()
+    return max(int(stock), 0) if stock else None
+
+
 @login_required
 def admin_reward_add_view(request):
     if not request.user.is_staff:
@@ -603,6 +532,8 @@ def admin_reward_add_view(request):
         reward = RewardItem.objects.create(
             reward_name=request.POST.get("reward_name"),
             points_required=int(request.POST.get("points_required")),
+            stock=_posted_stock(request),
+            is_active=request.POST.get("is_active") == "on",
         )
         # Handle image upload (now required)
         if request.FILES.get("image"):
@@ -624,10 +555,18 @@ def admin_reward_edit_view(request, reward_id):
     if request.method == "POST":
         reward.reward_name = request.POST.get("reward_name")
         reward.points_required = int(request.POST.get("points_required"))
+        reward.is_active = request.POST.get("is_active") == "on"
+        fields = ["reward_name", "points_required", "is_active", "image"]
+        # Redemptions may have taken stock since the form was loaded: only
+        # write it if the admin actually changed the number
+        stock = _posted_stock(request)
+        if stock != _posted_stock(request, "loaded_stock"):
+            reward.stock = stock
+            fields.append("stock")
         # Handle image upload
         if request.FILES.get("image"):
             reward.image = request.FILES["image"]
-        reward.save()
+        reward.save(update_fields=fields)
         return redirect("admin_rewards")
     return render(request, "core/admin_reward_edit.html", {"reward": reward})
 
@@ -661,7 +600,8 @@ def admin_redemptions_view(request):
 def admin_manage_devices_view(request):
     if not request.user.is_staff:
         return redirect("dashboard")
-    devices = Device.objects.all().order_by("device_name")
+    # live_status: reported status, or offline when heartbeats stopped
+    devices = liveness.with_liveness().order_by("device_name")
     return render(
         request,
         "core/admin_manage_devices.html",
@@ -781,58 +721,21 @@ def admin_user_add_view(request):
         manual_school_id = request.POST.get("school_id", "").strip()
         manual_faculty_id = request.POST.get("faculty_id", "").strip()
 
-        # Use manual ID if provided, otherwise auto-generate
+        # Use manual ID if provided, otherwise reserve the next one. The form
+        # is pre-filled with a suggestion; an untouched suggestion counts as
+        # "auto" so two admins adding users at once don't both claim it.
         if user_type == "student":
-            if manual_school_id:
-                # Use the manually entered ID
-                generated_id = manual_school_id
-            else:
-                # Auto-generate only if not provided
-                last_student = (
-                    UserProfile.objects.filter(
-                        school_id__startswith=f"C{current_year}-"
-                    )
-                    .order_by("-school_id")
-                    .first()
-                )
-
-                if last_student and last_student.school_id:
-                    try:
-                        last_num = int(last_student.school_id.split("-")[1])
-                        generated_id = f"C{current_year}-{str(last_num + 1).zfill(4)}"
-                    except:
-                        generated_id = f"C{current_year}-0001"
-                else:
-                    generated_id = f"C{current_year}-0001"
-        elif user_type == "teacher":
-            if manual_faculty_id:
-                # Use the manually entered ID
-                generated_id = manual_faculty_id
-            else:
-                # Auto-generate only if not provided
-                from datetime import datetime
-
-                current_year_full = str(datetime.now().year)
-                last_faculty = (
-                    UserProfile.objects.filter(school_id__startswith="SMCIC-")
-                    .order_by("-school_id")
-                    .first()
-                )
-
-                if last_faculty and last_faculty.school_id:
-                    try:
-                        parts = last_faculty.school_id.split("-")
-                        if len(parts) == 3:
-                            last_num = int(parts[1])
-                            generated_id = f"SMCIC-{str(last_num + 1).zfill(3)}-{current_year_full}"
-                        else:
-                            generated_id = f"SMCIC-001-{current_year_full}"
-                    except:
-                        generated_id = f"SMCIC-001-{current_year_full}"
-                else:
-                    generated_id = f"SMCIC-001-{current_year_full}"
+            manual_id = manual_school_id
+            suggested_id = request.POST.get("suggested_school_id", "").strip()
         else:
-            generated_id = None
+            manual_id = manual_faculty_id
+            suggested_id = request.POST.get("suggested_faculty_id", "").strip()
+        generated_id = None
+        if user_type in ("student", "teacher"):
+            if manual_id and manual_id != suggested_id:
+                generated_id = manual_id
+            elif username and password:
+                generated_id = school_ids.allocate(user_type)[0]
 
         # Set is_staff based on user type
         is_staff = user_type in ["teacher", "staff"]
@@ -882,6 +785,42 @@ def admin_user_add_view(request):
     )
 
 
+@login_required
+def admin_user_import_view(request):
+    """Bulk enrollment from a CSV/XLSX upload (validated before anything is created)"""
+    if not request.user.is_staff:
+        return redirect("dashboard")
+
+    context = {}
+    upload = request.FILES.get("file") if request.method == "POST" else None
+    if upload is not None:
+        dry_run = request.POST.get("dry_run") == "on"
+        try:
+            result = enrollment.import_file(
+                upload,
+                upload.name,
+                default_password=request.POST.get("default_password") or None,
+                dry_run=dry_run,
+            )
+        except enrollment.ImportFileError as e:
+            messages.error(request, str(e))
+        except (DatabaseError, ValueError) as e:
+            # Validation should catch everything; if the database still
+            # refuses a row the whole batch was rolled back
+            messages.error(request, f"Nothing was imported: {e}")
+        else:
+            if result.errors:
+                context["errors"] = result.errors[:100]
+                context["more_errors"] = max(0, len(result.errors) - 100)
+            elif dry_run:
+                messages.success(request, f"{len(result.rows)} row(s) are ready to import")
+            else:
+                messages.success(request, f"Imported {result.created} account(s)")
+                return redirect("admin_users")
+
+    return render(request, "core/admin_user_import.html", context)
+
+
 @login_required
 def admin_device_add_view(request):
     """Add new device page"""
@@ -955,16 +894,38 @@ def admin_settings_view(request):
 
 
 # --- API Views for IoT Device Integration ---
+# The device endpoints are async views: served through ecodrop_project/asgi.py
+# a slow board or slow DB write no longer blocks a whole worker. Transactional
+# work that the async ORM cannot do is offloaded with sync_to_async.
+
+
+def _in_pool(func, *args):
+    """
+    Run ``func(*args)`` in a pool thread (see DEVICE_API_THREAD_SENSITIVE).
+    A pool thread has its own connection, which is released as at the end
+    of a request: closed, or kept for reuse under CONN_MAX_AGE.
+    """
+    close_old_connections()
+    try:
+        return func(*args)
+    finally:
+        close_old_connections()
+
 
+def _run_detection(*args):
+    """Awaitable run_once(*args) for the detection endpoints"""
+    from django.conf import settings
 
-# Removed - now using version imported from .utils
+    if getattr(settings, "DEVICE_API_THREAD_SENSITIVE", False):
+        return sync_to_async(run_once)(*args)
+    return sync_to_async(_in_pool, thread_sensitive=False)(run_once, *args)
 
 
 @csrf_exempt
-def api_device_heartbeat(request):
+async def api_device_heartbeat(request):
     """Device heartbeat endpoint to track device status"""
     if request.method == "POST":
-        device = authenticate_device(request)
+        device = await aauthenticate_device(request)
         if not device:
             return JsonResponse(
                 {"status": "error", "message": "Invalid API key."}, status=401
@@ -973,17 +934,10 @@ def api_device_heartbeat(request):
         try:
             data = json.loads(request.body)
 
-            # Update device status and heartbeat
-            device.status = data.get("status", "online")
-            device.last_heartbeat = timezone.now()
-            device.save()
-
-            # Log heartbeat
-            DeviceLog.objects.create(
-                device=device,
-                log_type="heartbeat",
-                sensor_data=data.get("sensor_data"),
-                message=f"Device {device.device_name} heartbeat",
+            # Buffer status and heartbeat; the device row and heartbeat log
+            # are only written when something changes or the flush is due
+            await heartbeats.arecord_heartbeat(
+                device, data.get("status", "online"), data.get("sensor_data")
             )
 
             return JsonResponse(
@@ -1002,11 +956,92 @@ def api_device_heartbeat(request):
     )
 
 
+def _process_bottle_detection(device, data, session=None):
+    """Apply one detection event; returns the JsonResponse for the device"""
+    sort_result = data.get("sort_result")  # 'plastic', 'invalid', 'error'
+    sensor_data = data.get("sensor_data", {})
+    user_id = data.get("user_id")  # Scanned ID if there is no deposit session
+    token = data.get("session_token")
+
+    # Log the detection event
+    DeviceLog.objects.create(
+        device=device,
+        log_type="bottle_detected",
+        sort_result=sort_result,
+        sensor_data=sensor_data,
+        message=f"Bottle detected: {sort_result}",
+    )
+
+    # Deposit session: the profile was resolved once by api_user_verify, so
+    # credit it directly. The session's summary log is written on close.
+    if sort_result == "plastic" and session is not None:
+        points_earned = ledger.POINTS_PER_BOTTLE
+        profile = UserProfile(pk=session["profile"])
+        ledger.record_deposit(profile, bottles=1, points=points_earned, device=device)
+        deposit_sessions.add_bottles(token, session, 1, points_earned)
+        return JsonResponse(
+            {
+                "status": "success",
+                "message": f"{points_earned} points awarded to {session['username']}",
+                "user_total_points": profile.total_points,
+                "session_bottles": session["bottles"],
+            }
+        )
+
+    if sort_result == "plastic" and token and not user_id:
+        return JsonResponse(
+            {
+                "status": "warning",
+                "message": "Deposit session expired, please scan your ID again",
+                "session_expired": True,
+            }
+        )
+
+    # If plastic bottle and user identified, award points
+    if sort_result == "plastic" and user_id:
+        # Same resolver as api_user_verify (school ID variants or QR data)
+        profile, _ = resolve_profile(user_id)
+        if profile is None:
+            return JsonResponse(
+                {
+                    "status": "warning",
+                    "message": "Plastic bottle detected but user not found",
+                }
+            )
+        points_earned = ledger.POINTS_PER_BOTTLE
+
+        # Credit points, create the entry record and update the
+        # device bottle count in one transaction
+        ledger.record_deposit(profile, bottles=1, points=points_earned, device=device)
+
+        # Log successful sorting
+        DeviceLog.objects.create(
+            device=device,
+            log_type="bottle_sorted",
+            sort_result="plastic",
+            sensor_data=sensor_data,
+            message=f"Points awarded to {profile.user.username}",
+        )
+
+        return JsonResponse(
+            {
+                "status": "success",
+                "message": f"{points_earned} points awarded to {profile.user.username}",
+                "user_total_points": profile.total_points,
+            }
+        )
+
+    # For invalid bottles or no user ID
+    return JsonResponse(
+        {"status": "success", "message": f"Bottle processed: {sort_result}"}
+    )
+
+
 @csrf_exempt
-def api_bottle_detection(request):
+async def api_bottle_detection(request):
     """Endpoint for device to report bottle detection and sorting results"""
     if request.method == "POST":
-        device = authenticate_device(request)
+        device = await aauthenticate_device(request)
         if not device:
             return JsonResponse(
                 {"status": "error", "message": "Invalid API key."}, status=401
@@ -1014,72 +1049,199 @@ def api_bottle_detection(request):
 
         try:
             data = json.loads(request.body)
-            sort_result = data.get("sort_result")  # 'plastic', 'invalid', 'error'
-            sensor_data = data.get("sensor_data", {})
-            user_id = data.get("user_id")  # QR code data if bottle is valid plastic
+            # Retries of an already processed event get the original response
+            session = await deposit_sessions.aget_session(
+                device, data.get("session_token")
+            )
+            # The transactional part runs in a worker thread
+            return await _run_detection(
+                device,
+                event_id_from(data, request),
+                lambda: _process_bottle_detection(device, data, session),
+            )
+
+        except Exception as e:
+            # Log error
+            if device:
+                await DeviceLog.objects.acreate(
+                    device=device, log_type="error", message=f"API Error: {str(e)}"
+                )
+            return JsonResponse({"status": "error", "message": str(e)}, status=400)
+
+    return JsonResponse(
+        {"status": "error", "message": "Invalid request method."}, status=405
+    )
+
 
-            # Log the detection event
-            DeviceLog.objects.create(
+def _process_bottle_detection_batch(device, events, session=None, token=None):
+    """Apply a batch of detection events in one transaction"""
+    points_per_bottle = ledger.POINTS_PER_BOTTLE
+
+    # Events without a user_id belong to the batch's deposit session; resolve
+    # every other user in the batch with one query
+    profiles = resolve_profiles(
+        {
+            event.get("user_id")
+            for event in events
+            if event.get("sort_result") == "plastic" and event.get("user_id")
+        }
+    )
+    usernames = {profile.pk: profile.user.username for profile in profiles.values()}
+    if session is not None:
+        usernames[session["profile"]] = session["username"]
+
+    logs = []
+    entries = []
+    bottles_per_profile = {}
+    results = []
+    session_bottles = 0
+    session_expired = False
+    for event in events:
+        sort_result = event.get("sort_result")
+        sensor_data = event.get("sensor_data", {})
+        user_id = event.get("user_id")
+
+        logs.append(
+            DeviceLog(
                 device=device,
                 log_type="bottle_detected",
                 sort_result=sort_result,
                 sensor_data=sensor_data,
                 message=f"Bottle detected: {sort_result}",
             )
+        )
 
-            # If plastic bottle and user identified, award points
-            if sort_result == "plastic" and user_id:
-                try:
-                    profile = UserProfile.objects.get(qr_code_data=user_id)
-                    points_earned = 10  # 10 points per plastic bottle
+        if sort_result == "plastic" and token and not (user_id or session):
+            # Same answer as api_bottle_detection: the bottle can't be credited
+            session_expired = True
+            results.append(
+                {"status": "warning", "user_id": None, "session_expired": True}
+            )
+            continue
+
+        if sort_result != "plastic" or not (user_id or session):
+            results.append({"status": "success", "user_id": user_id})
+            continue
+
+        if user_id:
+            profile = profiles.get(user_id)
+            if profile is None:
+                results.append({"status": "warning", "user_id": user_id})
+                continue
+            profile_pk = profile.pk
+            logs.append(
+                DeviceLog(
+                    device=device,
+                    log_type="bottle_sorted",
+                    sort_result="plastic",
+                    sensor_data=sensor_data,
+                    message=f"Points awarded to {profile.user.username}",
+                )
+            )
+        else:
+            # Credited to the deposit session; summarized when it closes
+            profile_pk = session["profile"]
+            session_bottles += 1
 
-                    # Update user's total points
-                    profile.total_points += points_earned
-                    profile.save()
+        entries.append(
+            Entry(user_profile_id=profile_pk, no_bottle=1, points=points_per_bottle)
+        )
+        bottles_per_profile[profile_pk] = bottles_per_profile.get(profile_pk, 0) + 1
+        results.append({"status": "success", "user_id": user_id})
+
+    balances = {}
+    counter_deltas = {}
+    with transaction.atomic():
+        DeviceLog.objects.bulk_create(logs)
+        Entry.objects.bulk_create(entries)
+        # Profile rows in pk order, then the counters once, like a single
+        # deposit (profile, then counters): concurrent batches and deposits
+        # take their locks in the same order and can't deadlock
+        for profile_pk in sorted(bottles_per_profile):
+            bottles = bottles_per_profile[profile_pk]
+            balances[profile_pk] = ledger.credit_points(
+                profile_pk,
+                bottles * points_per_bottle,
+                bottles=bottles,
+                deposits=bottles,  # One Entry per event
+                counter_deltas=counter_deltas,
+            )
+        counters.bump(**counter_deltas)
+        if entries:
+            ledger.add_device_bottles(device.pk, len(entries))
+    if session_bottles:
+        deposit_sessions.add_bottles(
+            token, session, session_bottles, session_bottles * points_per_bottle
+        )
 
-                    # Create entry record
-                    Entry.objects.create(
-                        user_profile=profile, no_bottle=1, points=points_earned
-                    )
+    points_awarded = {
+        usernames[profile_pk]: {
+            "points": bottles * points_per_bottle,
+            "user_total_points": balances[profile_pk],
+        }
+        for profile_pk, bottles in bottles_per_profile.items()
+    }
 
-                    # Update device bottle count
-                    device.total_bottles_processed += 1
-                    device.save()
-
-                    # Log successful sorting
-                    DeviceLog.objects.create(
-                        device=device,
-                        log_type="bottle_sorted",
-                        sort_result="plastic",
-                        sensor_data=sensor_data,
-                        message=f"Points awarded to {profile.user.username}",
-                    )
+    response = {
+        "status": "success",
+        "message": f"{len(events)} events processed",
+        "processed": len(events),
+        "bottles_credited": len(entries),
+        "points_awarded": points_awarded,
+        "results": results,
+    }
+    if session_expired:
+        response["session_expired"] = True
+        response["message"] += "; deposit session expired, please scan your ID again"
+    return JsonResponse(response)
 
-                    return JsonResponse(
-                        {
-                            "status": "success",
-                            "message": f"{points_earned} points awarded to {profile.user.username}",
-                            "user_total_points": profile.total_points,
-                        }
-                    )
 
-                except UserProfile.DoesNotExist:
-                    return JsonResponse(
-                        {
-                            "status": "warning",
-                            "message": "Plastic bottle detected but user not found",
-                        }
-                    )
+@csrf_exempt
+async def api_bottle_detection_batch(request):
+    """
+    Batch variant of api_bottle_detection.
+    Accepts {"events": [{"sort_result", "sensor_data", "user_id"}, ...]} and
+    applies the whole batch in one transaction with bulk inserts and a single
+    points update per user.
+    """
+    from django.conf import settings
 
-            # For invalid bottles or no user ID
+    if request.method == "POST":
+        device = await aauthenticate_device(request)
+        if not device:
             return JsonResponse(
-                {"status": "success", "message": f"Bottle processed: {sort_result}"}
+                {"status": "error", "message": "Invalid API key."}, status=401
+            )
+
+        try:
+            data = json.loads(request.body)
+            events = data.get("events")
+            max_events = getattr(settings, "DEVICE_BATCH_MAX_EVENTS", 100)
+            if not isinstance(events, list) or not events:
+                return JsonResponse(
+                    {"status": "error", "message": "No events provided."}, status=400
+                )
+            if len(events) > max_events:
+                return JsonResponse(
+                    {
+                        "status": "error",
+                        "message": f"Too many events (max {max_events}).",
+                    },
+                    status=400,
+                )
+
+            token = data.get("session_token")
+            session = await deposit_sessions.aget_session(device, token)
+            return await _run_detection(
+                device,
+                event_id_from(data, request),
+                lambda: _process_bottle_detection_batch(device, events, session, token),
             )
 
         except Exception as e:
             # Log error
             if device:
-                DeviceLog.objects.create(
+                await DeviceLog.objects.acreate(
                     device=device, log_type="error", message=f"API Error: {str(e)}"
                 )
             return JsonResponse({"status": "error", "message": str(e)}, status=400)
@@ -1090,10 +1252,10 @@ def api_bottle_detection(request):
 
 
 @csrf_exempt
-def api_device_error(request):
+async def api_device_error(request):
     """Endpoint for device to report errors"""
     if request.method == "POST":
-        device = authenticate_device(request)
+        device = await aauthenticate_device(request)
         if not device:
             return JsonResponse(
                 {"status": "error", "message": "Invalid API key."}, status=401
@@ -1106,10 +1268,12 @@ def api_device_error(request):
 
             # Update device status to error
             device.status = "error"
-            device.save()
+            await device.asave(update_fields=["status", "updated_at"])
+            # Make the next heartbeat write its status through again
+            await heartbeats.aforget(device)
 
             # Log the error
-            DeviceLog.objects.create(
+            await DeviceLog.objects.acreate(
                 device=device,
                 log_type="error",
                 sensor_data=data.get("sensor_data"),
@@ -1127,10 +1291,46 @@ def api_device_error(request):
 
 
 @csrf_exempt
-def api_user_verify(request):
+async def api_deposit_session_close(request):
+    """Endpoint for device to end a deposit session (student is done)"""
+    if request.method == "POST":
+        device = await aauthenticate_device(request)
+        if not device:
+            return JsonResponse(
+                {"status": "error", "message": "Invalid API key."}, status=401
+            )
+
+        try:
+            data = json.loads(request.body)
+            session = await sync_to_async(deposit_sessions.close_session)(
+                device, data.get("session_token")
+            )
+            if session is None:
+                return JsonResponse(
+                    {"status": "warning", "message": "Session not found or expired"}
+                )
+            return JsonResponse(
+                {
+                    "status": "success",
+                    "message": f"Session closed for {session['username']}",
+                    "bottles": session["bottles"],
+                    "points": session["points"],
+                }
+            )
+
+        except Exception as e:
+            return JsonResponse({"status": "error", "message": str(e)}, status=400)
+
+    return JsonResponse(
+        {"status": "error", "message": "Invalid request method."}, status=405
+    )
+
+
+@csrf_exempt
+async def api_user_verify(request):
     """Endpoint for device to verify user QR code"""
     if request.method == "GET":
-        device = authenticate_device(request)
+        device = await aauthenticate_device(request)
         if not device:
             return JsonResponse(
                 {"status": "error", "message": "Invalid API key.", "ok": False},
@@ -1145,103 +1345,36 @@ def api_user_verify(request):
                     status=400,
                 )
 
-                # Clean the student ID - handle format like "C22-0369" or "C220369" (without hyphen)
+            # Clean the student ID - handle format like "C22-0369" or "C220369" (without hyphen)
             clean_code = code.strip().upper()  # Convert to uppercase for consistency
+            identity_key = normalize_identifier(code)
 
-            # Debug: Log the incoming student ID
-            print(f"DEBUG: Received student ID: '{code}' -> cleaned: '{clean_code}'")
-
-            # Try to find user by student ID first, then fallback to other methods
-            profile = None
-            lookup_method = None
-
-            # Method 1: Look up by school_id field (exact match with hyphen)
-            if not profile:
-                try:
-                    profile = UserProfile.objects.get(school_id=clean_code)
-                    lookup_method = "school_id"
-                    print(f"DEBUG: User found by school_id - {profile.user.username}")
-                except UserProfile.DoesNotExist:
-                    pass
-
-            # Method 1b: If not found, try adding hyphen for student IDs (C250001 -> C25-0001)
-            if (
-                not profile
-                and len(clean_code) >= 7
-                and clean_code[0] == "C"
-                and "-" not in clean_code
+            profile = lookup_method = None
+            # Unknown codes are answered without touching the database: a
+            # recent miss on this device, or a key no profile could match
+            recent_miss = identity_key is None or await ais_cached_miss(
+                device, identity_key
+            )
+            if not recent_miss and await sync_to_async(known_identifiers.might_exist)(
+                identity_key
             ):
-                try:
-                    # Format: C + 2-digit year + 4-digit number (e.g., C250001 -> C25-0001)
-                    formatted_code = f"{clean_code[:3]}-{clean_code[3:]}"
-                    profile = UserProfile.objects.get(school_id=formatted_code)
-                    lookup_method = "school_id_formatted"
-                    print(
-                        f"DEBUG: User found by formatted school_id ({formatted_code}) - {profile.user.username}"
-                    )
-                except (UserProfile.DoesNotExist, IndexError):
-                    pass
-
-                    # Method 1c: Try adding hyphen for faculty IDs (SMCIC1232025 -> SMCIC-123-2025)
-            if not profile and clean_code.startswith("SMCIC") and "-" not in clean_code:
-                try:
-                    # Format: SMCIC + 3-digit number + 4-digit year (e.g., SMCIC1232025 -> SMCIC-123-2025)
-                    if len(clean_code) == 12:  # SMCIC + 3 digits + 4 digits
-                        formatted_code = f"SMCIC-{clean_code[5:8]}-{clean_code[8:]}"
-                        profile = UserProfile.objects.get(school_id=formatted_code)
-                        lookup_method = "faculty_id_formatted"
-                        print(
-                            f"DEBUG: User found by formatted faculty_id ({formatted_code}) - {profile.user.username}"
-                        )
-                except (UserProfile.DoesNotExist, IndexError):
-                    pass
-
-            # Method 2: Look up by school_id case-insensitive
-            if not profile:
-                try:
-                    profile = UserProfile.objects.get(school_id__iexact=clean_code)
-                    lookup_method = "school_id_case_insensitive"
-                    print(
-                        f"DEBUG: User found by school_id (case-insensitive) - {profile.user.username}"
-                    )
-                except UserProfile.DoesNotExist:
-                    pass
-
-            # Method 3: Look up by username (if student ID matches username)
-            if not profile:
-                try:
-                    from django.contrib.auth.models import User
-
-                    user = User.objects.get(username=clean_code)
-                    profile = user.profile
-                    lookup_method = "username"
-                    # Set the school_id if it's missing
-                    if not profile.school_id:
-                        profile.school_id = clean_code
-                        profile.save()
-                        print(f"DEBUG: Auto-set school_id for {user.username}")
-                    print(f"DEBUG: User found by username - {profile.user.username}")
-                except (User.DoesNotExist, UserProfile.DoesNotExist):
-                    pass
-
-            # Method 4: Look up by old qr_code_data field (backward compatibility)
-            if not profile:
-                try:
-                    profile = UserProfile.objects.get(qr_code_data=clean_code)
-                    lookup_method = "qr_code_data"
-                    print(
-                        f"DEBUG: User found by qr_code_data - {profile.user.username}"
-                    )
-                except UserProfile.DoesNotExist:
-                    pass
+                # Resolve every barcode/QR variant (C22-0369, C220369, c22-0369,
+                # username, legacy qr_code_data) with one indexed query
+                profile, lookup_method = await aresolve_profile(code)
+                if profile and not profile.school_id:
+                    # Found by username: remember the scanned ID as the school_id
+                    profile.school_id = clean_code
+                    await profile.asave()
 
             if profile:
                 # Log successful verification
-                DeviceLog.objects.create(
+                await DeviceLog.objects.acreate(
                     device=device,
                     log_type="bottle_detected",  # Using existing log type
                     message=f"User {profile.user.username} verified with student ID '{clean_code}' via {lookup_method}",
                 )
+                # Bottles sent with this token are credited without a lookup
+                session_token = await deposit_sessions.aopen_session(device, profile)
 
                 return JsonResponse(
                     {
@@ -1255,64 +1388,37 @@ def api_user_verify(request):
                             "school_id": profile.school_id or clean_code,
                         },
                         "lookup_method": lookup_method,
+                        "session_token": session_token,
+                        "session_expires_in": deposit_sessions.session_ttl(),
                     }
                 )
 
-            # No user found - provide comprehensive debugging info
-            print(f"DEBUG: No user found for student ID '{clean_code}'")
-
-            # Get all existing student IDs and usernames for debugging
-            all_school_ids = list(
-                UserProfile.objects.exclude(school_id__isnull=True)
-                .exclude(school_id="")
-                .values_list("school_id", "user__username")
-            )
-
-            all_usernames = list(
-                User.objects.values_list("username", flat=True)[:20]
-            )  # Limit to 20
-
-            print(f"DEBUG: All student IDs in database: {all_school_ids}")
-            print(f"DEBUG: Sample usernames: {all_usernames}")
-
-            # Log failed verification with detailed info
-            DeviceLog.objects.create(
-                device=device,
-                log_type="error",
-                message=f"Failed verification: student ID '{clean_code}' not found. Available: {[sid for sid, _ in all_school_ids[:10]]}",
-            )
+            # No user found. Log it once per negative-cache window; staff can
+            # inspect the code with the identity diagnostics page.
+            if not recent_miss:
+                await aremember_miss(device, identity_key)
+                await DeviceLog.objects.acreate(
+                    device=device,
+                    log_type="error",
+                    message=f"Failed verification: student ID '{clean_code}' not found",
+                )
 
             return JsonResponse(
                 {
                     "status": "error",
                     "message": f"Student ID not found: {clean_code}",
                     "ok": False,
-                    "debug": {
-                        "received_school_id": clean_code,
-                        "original_input": code,
-                        "available_school_ids": [
-                            sid for sid, username in all_school_ids
-                        ],
-                        "available_usernames": all_usernames,
-                        "total_users": UserProfile.objects.count(),
-                        "users_with_school_id": UserProfile.objects.exclude(
-                            school_id__isnull=True
-                        )
-                        .exclude(school_id="")
-                        .count(),
-                    },
                 }
             )
 
         except Exception as e:
             # Log error
             if device:
-                DeviceLog.objects.create(
+                await DeviceLog.objects.acreate(
                     device=device,
                     log_type="error",
                     message=f"User verification API Error: {str(e)}",
                 )
-            print(f"ERROR in api_user_verify: {str(e)}")
             return JsonResponse(
                 {"status": "error", "message": str(e), "ok": False}, status=400
             )
@@ -1323,6 +1429,46 @@ def api_user_verify(request):
     )
 
 
+@login_required
+def identity_diagnostics_view(request):
+    """Staff-only diagnostics for a scanned code that does not resolve"""
+    if not request.user.is_staff:
+        return redirect("dashboard")
+
+    code = request.GET.get("code", "")
+    identity_key = normalize_identifier(code)
+    profile, lookup_method = resolve_profile(code)
+
+    # Profiles whose ID starts like the scanned code (e.g. same class/year)
+    similar = []
+    if identity_key:
+        similar = list(
+            UserProfile.objects.filter(identity_key__startswith=identity_key[:3])
+            .order_by("identity_key")
+            .values_list("school_id", "user__username")[:20]
+        )
+
+    with_school_id = UserProfile.objects.exclude(school_id__isnull=True).exclude(
+        school_id=""
+    )
+    return JsonResponse(
+        {
+            "original_input": code,
+            "normalized": identity_key,
+            "in_known_index": bool(identity_key)
+            and known_identifiers.might_exist(identity_key),
+            "resolved_username": profile.user.username if profile else None,
+            "lookup_method": lookup_method,
+            "similar_ids": [
+                {"school_id": school_id, "username": username}
+                for school_id, username in similar
+            ],
+            "total_users": UserProfile.objects.count(),
+            "users_with_school_id": with_school_id.count(),
+        }
+    )
+
+
 @login_required
 def debug_qr_codes_view(request):
     """Debug view to see all user QR codes"""
@@ -1339,7 +1485,16 @@ def debug_qr_codes_view(request):
     )
 
 
+def _barcode_etag(request):
+    """ETag of the user's barcode image, known without rendering it"""
+    if not request.user.is_authenticated:
+        return None
+    school_id = request.user.profile.school_id
+    return barcode_cache.digest(school_id) if school_id else None
+
+
 @login_required
+@condition(etag_func=_barcode_etag)
 def generate_qr_code_view(request):
     """Generate barcode for the logged-in user's student ID"""
     from django.http import HttpResponse
@@ -1351,10 +1506,14 @@ def generate_qr_code_view(request):
         return HttpResponse("No Student ID found", status=404)
 
     try:
-        buffer = generate_barcode_buffer(school_id)
-        # Return as image
-        response = HttpResponse(buffer, content_type="image/png")
+        # Rendered once per ID and options, then served from the cache;
+        # a matching If-None-Match never gets this far (304 above)
+        response = HttpResponse(
+            barcode_cache.get_png(school_id), content_type="image/png"
+        )
         response["Content-Disposition"] = f'inline; filename="{school_id}_barcode.png"'
+        patch_cache_control(response, private=True, max_age=300)
+        patch_vary_headers(response, ["Cookie"])
         return response
     except Exception as e:
         return HttpResponse(f"Error generating barcode: {str(e)}", status=500)
@@ -1380,28 +1539,99 @@ def download_id_card_view(request, user_id):
         return HttpResponse(f"Error generating ID card: {str(e)}", status=500)
 
 
+@login_required
+def admin_id_card_export_view(request):
+    """Start a bulk ID card export (print sheets) in the background"""
+    if not request.user.is_staff:
+        return JsonResponse({"error": "Forbidden"}, status=403)
+    if request.method != "POST":
+        return JsonResponse({"error": "POST required"}, status=405)
+
+    page_format = request.POST.get("format", "pdf")
+    if page_format not in id_card_export.FORMATS:
+        return JsonResponse({"error": "Unknown format"}, status=400)
+    try:
+        user_ids = [int(pk) for pk in request.POST.getlist("user_ids") if pk]
+    except ValueError:
+        return JsonResponse({"error": "Invalid user selection"}, status=400)
+
+    # Rows are read here so the export thread never touches the database
+    cards = id_card_export.select_cards(
+        user_type=request.POST.get("user_type") or None,
+        id_prefix=request.POST.get("prefix", "").strip() or None,
+        user_ids=user_ids,
+    )
+    if not cards:
+        return JsonResponse({"error": "No users with a school ID match"}, status=400)
+
+    job_id = id_card_export.start(cards, page_format)
+    return JsonResponse(
+        {
+            "job": job_id,
+            "cards": len(cards),
+            "status_url": reverse("admin_id_card_export_status", args=[job_id]),
+        },
+        status=202,
+    )
+
+
+@login_required
+def admin_id_card_export_status_view(request, job_id):
+    if not request.user.is_staff:
+        return JsonResponse({"error": "Forbidden"}, status=403)
+    job = id_card_export.status(job_id)
+    if job is None:
+        return JsonResponse({"error": "Unknown export"}, status=404)
+    if job["state"] == "done":
+        job["download_url"] = reverse("admin_id_card_export_download", args=[job_id])
+    return JsonResponse(job)
+
+
+@login_required
+def admin_id_card_export_download_view(request, job_id):
+    """Stream a finished export from disk"""
+    from django.http import FileResponse, Http404
+
+    if not request.user.is_staff:
+        return redirect("dashboard")
+    job = id_card_export.status(job_id)
+    if job is None or job["state"] != "done":
+        raise Http404("Export not ready")
+    page_format = job["format"]
+    return FileResponse(
+        open(id_card_export.path(job_id, page_format), "rb"),
+        as_attachment=True,
+        filename=f"id-cards-{timezone.localdate():%Y%m%d}.{page_format}",
+        content_type=id_card_export.CONTENT_TYPES[page_format],
+    )
+
+
+def _process_deposit(data):
+    """Credit a legacy /api/deposit/ submission"""
+    user_id = data.get("user_id")
+    bottles = data.get("bottles", 1)
+
+    profile, _ = resolve_profile(user_id)
+    if profile is None:
+        raise UserProfile.DoesNotExist
+    points_earned = bottles * ledger.POINTS_PER_BOTTLE
+
+    ledger.record_deposit(profile, bottles=bottles, points=points_earned)
+
+    return JsonResponse(
+        {"status": "success", "message": f"{points_earned} points added."},
+        status=201,
+    )
+
+
 # Legacy API endpoint (kept for backward compatibility)
 @csrf_exempt
 def api_deposit_view(request):
     if request.method == "POST":
         try:
             data = json.loads(request.body)
-            user_id = data.get("user_id")
-            bottles = data.get("bottles", 1)
-
-            profile = UserProfile.objects.get(qr_code_data=user_id)
-            points_earned = bottles * 10
-
-            profile.total_points += points_earned
-            profile.save()
-
-            Entry.objects.create(
-                user_profile=profile, no_bottle=bottles, points=points_earned
-            )
-
-            return JsonResponse(
-                {"status": "success", "message": f"{points_earned} points added."},
-                status=201,
+            return run_once(
+                None, event_id_from(data, request), lambda: _process_deposit(data)
             )
 
         except UserProfile.DoesNotExist:
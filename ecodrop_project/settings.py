@@ -66,6 +66,84 @@ CSRF_EXEMPT_URLS = [
     "/api/user/verify/",
 ]
 
+# Device API-key authentication cache (seconds / entries). Rotating or
+# deleting a key revokes the per-process entries of every worker at once
+# (through a generation number in the shared cache).
+DEVICE_AUTH_CACHE_TTL = int(os.environ.get("DEVICE_AUTH_CACHE_TTL", "300"))
+DEVICE_AUTH_LOCAL_TTL = int(os.environ.get("DEVICE_AUTH_LOCAL_TTL", "30"))
+DEVICE_AUTH_NEGATIVE_TTL = int(os.environ.get("DEVICE_AUTH_NEGATIVE_TTL", "30"))
+DEVICE_AUTH_LOCAL_SIZE = 256
+
+# api_user_verify answers unknown codes from memory: the known-identifier set is
+# rebuilt at least this often (seconds), and a miss is cached per device for
+# IDENTITY_NEGATIVE_TTL seconds.
+IDENTITY_INDEX_MAX_AGE = int(os.environ.get("IDENTITY_INDEX_MAX_AGE", "300"))
+IDENTITY_NEGATIVE_TTL = int(os.environ.get("IDENTITY_NEGATIVE_TTL", "30"))
+
+# How long processed device event ids are remembered for retry deduplication
+# (hours). Prune with "manage.py prune_device_events".
+DEVICE_EVENT_RETENTION_HOURS = int(os.environ.get("DEVICE_EVENT_RETENTION_HOURS", "48"))
+
+# Raw device logs are kept this many days; "manage.py rollup_device_logs"
+# summarizes them into hourly/daily rollups before deleting them.
+DEVICE_LOG_RETENTION_DAYS = int(os.environ.get("DEVICE_LOG_RETENTION_DAYS", "30"))
+
+# Maximum number of detection events accepted by /api/device/detection/batch/
+DEVICE_BATCH_MAX_EVENTS = int(os.environ.get("DEVICE_BATCH_MAX_EVENTS", "100"))
+
+# Detection transactions run in the thread pool rather than the worker's one
+# thread-sensitive thread, which also serves every sync page (CSV import, ID
+# card downloads, the admin), so they don't queue behind slow staff pages.
+# Tests set this to True: TestCase data is only visible to the test thread.
+DEVICE_API_THREAD_SENSITIVE = False
+
+# A successful /api/user/verify/ opens a deposit session; detections that send
+# its token are credited without looking the user up again. The session closes
+# after this many seconds without a bottle (or via /api/device/session/close/).
+DEPOSIT_SESSION_TTL = int(os.environ.get("DEPOSIT_SESSION_TTL", "300"))
+
+# Admin dashboard widgets are cached for this many seconds (device and reward
+# widgets are also dropped as soon as devices or redemptions change)
+DASHBOARD_CACHE_TTL = int(os.environ.get("DASHBOARD_CACHE_TTL", "30"))
+
+# A device whose last heartbeat is older than this (seconds) is shown as
+# offline whatever it last reported. "manage.py sweep_devices" also writes
+# that status back. Keep it above HEARTBEAT_FLUSH_INTERVAL.
+DEVICE_STALE_AFTER = int(os.environ.get("DEVICE_STALE_AFTER", "180"))
+
+# Each worker keeps sorted leaderboard snapshots and rebuilds them from the
+# database after this many seconds (its own deposits are applied at once)
+LEADERBOARD_SNAPSHOT_TTL = int(os.environ.get("LEADERBOARD_SNAPSHOT_TTL", "60"))
+
+# Each worker serves the student reward catalog (search and pagination) from
+# memory; stock is read live. Reward changes invalidate it at once; this is
+# only the upper bound on its age (seconds).
+REWARD_CATALOG_MAX_AGE = int(os.environ.get("REWARD_CATALOG_MAX_AGE", "600"))
+
+# Rendered barcode PNGs are cached by content hash: in the cache backend for
+# BARCODE_CACHE_TTL seconds, or on disk when BARCODE_CACHE_DIR is set (trimmed
+# to BARCODE_CACHE_MAX_BYTES, least recently used first)
+BARCODE_CACHE_TTL = int(os.environ.get("BARCODE_CACHE_TTL", str(7 * 24 * 3600)))
+BARCODE_CACHE_DIR = os.environ.get("BARCODE_CACHE_DIR") or None
+BARCODE_CACHE_MAX_BYTES = int(
+    os.environ.get("BARCODE_CACHE_MAX_BYTES", str(50 * 1024 * 1024))
+)
+
+# Bulk ID card exports from the staff console are written here (not under
+# MEDIA_ROOT: they are only served to staff) and deleted after a day.
+# ID_CARD_EXPORT_WORKERS render processes are used; 0 means one per CPU.
+ID_CARD_EXPORT_DIR = os.environ.get("ID_CARD_EXPORT_DIR") or None
+ID_CARD_EXPORT_WORKERS = int(os.environ.get("ID_CARD_EXPORT_WORKERS", "0"))
+
+# Bulk enrollment imports hash passwords in this many processes (0 = one
+# per CPU); hashing is nearly all of an import's run time
+IMPORT_HASH_WORKERS = int(os.environ.get("IMPORT_HASH_WORKERS", "0"))
+
+# Heartbeats are buffered in the cache and written to the Device row at most
+# once per interval (seconds). Run "manage.py flush_heartbeats" on a schedule
+# to push out buffered heartbeats of devices that have gone quiet.
+HEARTBEAT_FLUSH_INTERVAL = int(os.environ.get("HEARTBEAT_FLUSH_INTERVAL", "60"))
+
 
 # Application definition
 
@@ -140,6 +218,28 @@ else:
         "default": {
             "ENGINE": "django.db.backends.sqlite3",
             "NAME": BASE_DIR / "db.sqlite3",
+            # File-backed test database so the concurrency tests get real
+            # SQLite locking instead of shared-cache "table is locked" errors
+            "TEST": {"NAME": BASE_DIR / "test_db.sqlite3"},
+        }
+    }
+
+
+# Cache
+# Use Redis when REDIS_URL is set so every gunicorn worker shares the same
+# cache (device auth, heartbeat buffer, ...); otherwise fall back to a
+# per-process in-memory cache for local development.
+if os.environ.get("REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.environ.get("REDIS_URL"),
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
         }
     }
 
@@ -163,6 +263,11 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Users sign in with a username, ID number or email; the backend resolves it
+# with one query and checks the password once (see core/auth_backends.py)
+AUTHENTICATION_BACKENDS = ["core.auth_backends.IdentifierBackend"]
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
 